@@ -0,0 +1 @@
+default_app_config = 'veggy_pi.apps.VeggyPiConfig'
@@ -0,0 +1,145 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+from collections import OrderedDict, deque
+import time
+
+
+from . import metrics
+
+
+def write_pin(pin, state):
+    """
+    default writer - drives the physical pin (see RPiPin.set_output)
+    """
+    pin.set_output(state)
+
+
+class GPIOWriter(object):
+    """
+    the writer of the control loop - sets up the gpio on the first write and
+    switches every pin to output on its own first write, so the pins of the
+    condition groups added while the loop runs are driven too.
+    """
+    def __init__(self):
+        self.ready = False
+        self.configured = set()
+
+    def __call__(self, pin, state):
+        if pin.pin_number not in self.configured:
+            if not self.ready:
+                # RPi.GPIO is only imported here, on the pi itself
+                pin.setup()
+                self.ready = True
+            pin.set_mode('output')
+            self.configured.add(pin.pin_number)
+        pin.set_output(state)
+
+
+class PinState(object):
+    """
+    what the queue last wrote to a pin and when it switched.
+    """
+    __slots__ = ('state', 'changed_at', 'switches')
+
+    def __init__(self, state, changed_at):
+        self.state = state
+        self.changed_at = changed_at
+        self.switches = deque()
+
+
+class ActuatorQueue(object):
+    """
+    actuator command queue between rule evaluation and the pin writes.
+
+    commands submitted during a tick are coalesced per pin (the last command
+    for a pin wins) and only applied on flush(). a command is suppressed if
+    it wouldn't change the pin, if the pin hasn't been held in its current
+    state for min_on / min_off seconds yet or if the pin already switched
+    max_switches times within the last `window` seconds.
+
+    a queue which isn't `live` (i.e. a simulator replay) records no metrics.
+    """
+    def __init__(self, min_on=None, min_off=None, max_switches=None, window=None, clock=time.time, writer=write_pin,
+                 live=True):
+        self.min_on = min_on if min_on is not None else settings.VEGGY_PI_ACTUATOR_MIN_ON
+        self.min_off = min_off if min_off is not None else settings.VEGGY_PI_ACTUATOR_MIN_OFF
+        self.max_switches = max_switches if max_switches is not None else settings.VEGGY_PI_ACTUATOR_MAX_SWITCHES
+        self.window = window if window is not None else settings.VEGGY_PI_ACTUATOR_SWITCH_WINDOW
+        self.clock = clock
+        self.writer = writer
+        self.live = live
+
+        self._pending = OrderedDict()
+        self._pins = {}
+        self.stats = dict.fromkeys((
+            'submitted', 'written', 'coalesced', 'unchanged', 'min_time', 'rate_limited',
+        ), 0)
+
+    @property
+    def suppressed(self):
+        """
+        number of submitted commands which never resulted in a pin write.
+        """
+        return self.stats['submitted'] - self.stats['written']
+
+    def state(self, pin_number):
+        """
+        the last state written to the pin or None if it was never written.
+        """
+        pin_state = self._pins.get(pin_number)
+        return pin_state.state if pin_state else None
+
+    def submit(self, pin, state):
+        self.stats['submitted'] += 1
+        if pin.pin_number in self._pending:
+            self._suppress('coalesced')
+            del self._pending[pin.pin_number]
+        self._pending[pin.pin_number] = (pin, bool(state))
+
+    def flush(self):
+        """
+        applies the pending commands, returns the number of pin writes.
+        """
+        now = self.clock()
+        written = 0
+
+        pending, self._pending = self._pending, OrderedDict()
+        for pin_number, (pin, state) in pending.items():
+            pin_state = self._pins.get(pin_number)
+
+            if pin_state is not None:
+                if pin_state.state == state:
+                    self._suppress('unchanged')
+                    continue
+
+                min_hold = self.min_on if pin_state.state else self.min_off
+                if now - pin_state.changed_at < min_hold:
+                    self._suppress('min_time')
+                    continue
+
+                switches = pin_state.switches
+                while switches and now - switches[0] >= self.window:
+                    switches.popleft()
+                if self.max_switches is not None and len(switches) >= self.max_switches:
+                    self._suppress('rate_limited')
+                    continue
+            else:
+                pin_state = self._pins[pin_number] = PinState(state, now)
+
+            self.writer(pin, state)
+            pin_state.state = state
+            pin_state.changed_at = now
+            pin_state.switches.append(now)
+            self.stats['written'] += 1
+            written += 1
+
+        if self.live:
+            metrics.GPIO_WRITES.inc(written)
+        return written
+
+    def _suppress(self, reason):
+        self.stats[reason] += 1
+        if self.live:
+            metrics.GPIO_SUPPRESSED.labels(reason).inc()
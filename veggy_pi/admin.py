@@ -1,3 +1,116 @@
 from django.contrib import admin
 
 
+from . models import (
+    Condition,
+    ConditionGroup,
+    ConfigurationOption,
+    Input,
+    Reading,
+    ReadingRollup,
+    RPiPin,
+    Sensor,
+    SyncCursor,
+    UserInput,
+    VeggyConfiguration,
+)
+from . pagination import EstimatedCountPaginator
+
+
+class HistoryAdmin(admin.ModelAdmin):
+    """
+    shared setup of the append only history tables - no COUNT(*) of the
+    table per changelist, no select boxes listing every related row and
+    an ordering the indexes serve.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+
+
+@admin.register(Reading)
+class ReadingAdmin(HistoryAdmin):
+    list_display = ('id', 'created_at', 'sensor_name', 'data', 'origin')
+    list_select_related = ('sensor',)
+    raw_id_fields = ('sensor',)
+    # both are served by the (created_at, id) index
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at', '-id')
+
+    def sensor_name(self, obj):
+        return obj.sensor.name
+    sensor_name.admin_order_field = 'sensor__name'
+
+
+@admin.register(Input)
+class InputAdmin(HistoryAdmin):
+    list_display = ('id', 'created_at', 'sensor_name', 'value', 'origin')
+    # created_at isn't indexed on this table - the primary key is
+    ordering = ('-id',)
+
+
+@admin.register(ReadingRollup)
+class ReadingRollupAdmin(HistoryAdmin):
+    list_display = ('bucket_start', 'sensor', 'period', 'count', 'minimum', 'maximum')
+    list_select_related = ('sensor',)
+    raw_id_fields = ('sensor',)
+    ordering = ('-id',)
+
+
+@admin.register(Sensor)
+class SensorAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'current_value', 'current_at', 'origin')
+    list_select_related = ('current_reading',)
+    raw_id_fields = ('current_reading', 'pin')
+    search_fields = ('name',)
+
+    def current_value(self, obj):
+        return obj.current_reading.data if obj.current_reading else None
+
+    def current_at(self, obj):
+        return obj.current_reading.created_at if obj.current_reading else None
+
+
+class ConditionInline(admin.TabularInline):
+    model = Condition
+    extra = 0
+
+
+@admin.register(ConditionGroup)
+class ConditionGroupAdmin(admin.ModelAdmin):
+    list_display = ('id', 'operator', 'output_pin')
+    list_select_related = ('output_pin',)
+    inlines = (ConditionInline,)
+
+
+class UserInputInline(admin.TabularInline):
+    model = UserInput
+    extra = 0
+
+    def get_queryset(self, request):
+        # UserInput.__unicode__ shows both
+        return super(UserInputInline, self).get_queryset(request).select_related('veggy_config', 'variable')
+
+
+@admin.register(VeggyConfiguration)
+class VeggyConfigurationAdmin(admin.ModelAdmin):
+    list_display = ('label', 'parent_config', 'start_time', 'end_time')
+    list_select_related = ('parent_config',)
+    inlines = (UserInputInline,)
+
+
+@admin.register(ConfigurationOption)
+class ConfigurationOptionAdmin(admin.ModelAdmin):
+    list_display = ('option_label', 'parent_option')
+    list_select_related = ('parent_option',)
+
+
+@admin.register(RPiPin)
+class RPiPinAdmin(admin.ModelAdmin):
+    list_display = ('pin_number', 'label')
+    ordering = ('pin_number',)
+
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    list_display = ('hub', 'kind', 'last_id', 'updated_at')
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class VeggyPiConfig(AppConfig):
     name = 'veggy_pi'
+
+    def ready(self):
+        from . sqlite import apply_pragmas
+        connection_created.connect(apply_pragmas, dispatch_uid='veggy_pi.sqlite.apply_pragmas')
+
+        from . models import VeggyConfiguration
+        from . schedule import config_deleted, config_saved
+        post_save.connect(config_saved, sender=VeggyConfiguration, dispatch_uid='veggy_pi.schedule.config_saved')
+        post_delete.connect(config_deleted, sender=VeggyConfiguration, dispatch_uid='veggy_pi.schedule.config_deleted')
+
+        from . models import Sensor
+        from . ingest import sensor_changed
+        post_save.connect(sensor_changed, sender=Sensor, dispatch_uid='veggy_pi.ingest.sensor_saved')
+        post_delete.connect(sensor_changed, sender=Sensor, dispatch_uid='veggy_pi.ingest.sensor_deleted')
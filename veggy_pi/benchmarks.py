@@ -0,0 +1,630 @@
+"""
+micro benchmarks for the veggy_pi hot paths - see the `benchmark`
+management command. every suite builds its own synthetic data, so run them
+against a throwaway database (see test_database).
+"""
+from __future__ import unicode_literals, division
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from contextlib import contextmanager
+import datetime
+import math
+import time
+
+
+from . funcs import from_timestamp
+from . models import (
+    Condition,
+    ConditionGroup,
+    ConfigurationOption,
+    Operator,
+    Reading,
+    Sensor,
+    SensorState,
+    UserInput,
+    VeggyConfiguration,
+)
+from . schedule import ScheduleTimeline
+
+
+@contextmanager
+def test_database():
+    """
+    creates a test database for the duration of the block and points the
+    default connection at it, the same way the test runner does.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def timed(func, repeat=3):
+    """
+    runs func `repeat` times and returns the fastest run in seconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def percentile(samples, q):
+    """
+    nearest rank percentile of an already sorted list
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(math.ceil(q * len(samples))) - 1)]
+
+
+def measure(func, iterations=200):
+    """
+    calls func `iterations` times and reports throughput, p50 / p99 latency
+    in milliseconds and the number of SQL queries per call.
+    """
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(iterations):
+            start = time.time()
+            func()
+            latencies.append(time.time() - start)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total if total else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries_per_op': len(queries) / iterations,
+    }
+
+
+def make_readings(rows, sensors=1):
+    """
+    synthetic reading history - `rows` readings spread over `sensors` sensors
+    one second apart.
+    """
+    sensor_ids = [Sensor.objects.create(name='bench_%s' % i).pk for i in range(sensors)]
+    start = timezone.now() - datetime.timedelta(seconds=rows)
+    Reading.objects.bulk_ingest(
+        (sensor_ids[i % sensors], start + datetime.timedelta(seconds=i), '%.2f' % (20 + (i % 100) / 10))
+        for i in range(rows)
+    )
+    return sensor_ids
+
+
+def make_config_chain(depth, options):
+    """
+    a chain of `depth` configurations, each child overriding every one of the
+    `options` configuration options of its parent. the first options are the
+    validated ones (temp_format, min/max temp and rh) so the chain passes
+    validate_unique_values. returns the leaf configuration.
+    """
+    validated = [
+        ('temp_format', 'celcius'),
+        ('min_temp', '20'),
+        ('max_temp', '28'),
+        ('min_rh', '40'),
+        ('max_rh', '60'),
+    ]
+    labels = validated[:options] + [('bench_%s' % i, '%s' % i) for i in range(max(0, options - len(validated)))]
+    variables = [(ConfigurationOption.objects.create(option_label=label), value) for label, value in labels]
+
+    config = None
+    for level in range(depth):
+        config = VeggyConfiguration.objects.create(label='bench_%s' % level, parent_config=config)
+        UserInput.objects.bulk_create([
+            UserInput(veggy_config=config, variable=variable, value=value) for variable, value in variables
+        ])
+    return config
+
+
+def make_condition_group(conditions, sensors):
+    """
+    an AND group of `conditions` conditions spread over the sensor names,
+    all of which hold for the returned sensor state.
+    """
+    group = ConditionGroup.objects.create(operator=Operator.AND)
+    Condition.objects.bulk_create([
+        Condition(group=group, lhs='bench_%s' % (i % sensors), operator=Operator.LT, rhs='%s' % (100 + i))
+        for i in range(conditions)
+    ])
+    state = SensorState(dict(('bench_%s' % i, 20 + i % 10) for i in range(sensors)))
+    return group, state
+
+
+def bench_hotpaths(depth=4, options=10, conditions=10, sensors=4, readings=10000, iterations=200, **kwargs):
+    """
+    throughput, latency and query counts of the configuration, rule, ingest
+    and history hot paths over a synthetic dataset of the given size.
+    """
+    leaf = make_config_chain(depth, options)
+    group, state = make_condition_group(conditions, sensors)
+    sensor_ids = make_readings(readings, sensors)
+
+    values = leaf.get_values([], [])
+    unique = VeggyConfiguration.get_unique_values(list(values))
+
+    batch = 100
+    clock = [timezone.now()]
+
+    def records():
+        clock[0] += datetime.timedelta(seconds=1)
+        return [(sensor_ids[i % sensors], clock[0] + datetime.timedelta(milliseconds=i), '21.5') for i in range(batch)]
+
+    def reading_save():
+        clock[0] += datetime.timedelta(seconds=1)
+        Reading(sensor_id=sensor_ids[0], created_at=clock[0], data='21.5').save()
+
+    # seek into the middle of the history the way a deep keyset page does
+    middle = Reading.objects.filter(sensor_id=sensor_ids[0]).order_by('-created_at', '-id')[readings // sensors // 2]
+
+    def history_page():
+        list(Reading.objects.filter(sensor_id=sensor_ids[0], created_at__lt=middle.created_at)
+             .select_related('sensor').order_by('-created_at', '-id')[:100])
+
+    results = {
+        'dataset': {
+            'depth': depth, 'options': options, 'conditions': conditions,
+            'sensors': sensors, 'readings': readings,
+        },
+        'get_values': measure(lambda: leaf.get_values([], []), iterations),
+        'get_unique_values': measure(lambda: VeggyConfiguration.get_unique_values(list(values)), iterations),
+        'validate_unique_values': measure(lambda: VeggyConfiguration.validate_unique_values(unique), iterations),
+        'condition_group_evaluate': measure(lambda: group.evaluate(state), iterations),
+        'reading_save': measure(reading_save, iterations),
+        'reading_bulk_ingest_%s' % batch: measure(lambda: Reading.objects.bulk_ingest(records()), iterations),
+        'history_page': measure(history_page, iterations),
+    }
+    return results
+
+
+def compare(results, baseline, tolerance=0.1, path=()):
+    """
+    compares every *per_sec figure of a benchmark run to a saved baseline,
+    returns a list of (name, baseline, current, change) tuples and whether
+    any of them got slower by more than `tolerance` (a fraction).
+    """
+    changes = []
+    regressed = False
+    for key, value in sorted(results.items()):
+        if key not in baseline:
+            continue
+        if isinstance(value, dict):
+            nested, nested_regressed = compare(value, baseline[key], tolerance, path + (key,))
+            changes.extend(nested)
+            regressed = regressed or nested_regressed
+        elif key.endswith('per_sec') and value and baseline[key]:
+            change = (value - baseline[key]) / baseline[key]
+            changes.append(('.'.join(path + (key,)), baseline[key], value, change))
+            regressed = regressed or change < -tolerance
+    return changes, regressed
+
+
+def bench_serializers(rows=5000, repeat=3, **kwargs):
+    """
+    rows/second of the ModelSerializer path versus the values_list() fast
+    path, both rendered all the way to JSON.
+    """
+    from rest_framework.renderers import JSONRenderer
+    from . serializers import ReadingSerializer, FastReadingSerializer
+
+    make_readings(rows)
+    queryset = Reading.objects.select_related('sensor').order_by('-created_at', '-id')
+
+    model_path = timed(lambda: JSONRenderer().render(ReadingSerializer(queryset.all(), many=True).data), repeat)
+    fast_path = timed(lambda: FastReadingSerializer(FastReadingSerializer.values(queryset.all())).to_json(), repeat)
+
+    return {
+        'rows': rows,
+        'model_serializer_rows_per_sec': rows / model_path,
+        'fast_serializer_rows_per_sec': rows / fast_path,
+        'speedup': model_path / fast_path,
+    }
+
+
+def bench_ingest(rows=5000, repeat=3, **kwargs):
+    """
+    readings/second written one Reading.save() at a time, through the bulk
+    ingest path and through the bulk upload endpoint.
+    """
+    from django.contrib.auth import get_user_model
+    from django.core.urlresolvers import reverse
+    from django.test import Client
+    from . funcs import to_timestamp
+    import json
+
+    sensor = Sensor.objects.create(name='bench')
+    start = timezone.now()
+    records = [(sensor.pk, start + datetime.timedelta(milliseconds=i), '%.2f' % (20 + (i % 100) / 10))
+               for i in range(rows)]
+
+    def save_each():
+        for sensor_id, created_at, data in records:
+            Reading(sensor=sensor, created_at=created_at, data=data).save()
+
+    user = get_user_model().objects.create_superuser('bench', 'bench@localhost', 'bench')
+    client = Client()
+    client.force_login(user)
+    url = reverse('reading-bulk')
+    payload = json.dumps([[s, to_timestamp(c), d] for s, c, d in records])
+
+    def upload():
+        response = client.post(url, payload, content_type='application/json')
+        assert response.status_code == 200, response.content
+
+    single = timed(save_each, repeat)
+    bulk = timed(lambda: Reading.objects.bulk_ingest(records), repeat)
+    endpoint = timed(upload, repeat)
+
+    return {
+        'rows': rows,
+        'save_rows_per_sec': rows / single,
+        'bulk_ingest_rows_per_sec': rows / bulk,
+        'bulk_upload_rows_per_sec': rows / endpoint,
+    }
+
+
+@contextmanager
+def file_databases(split=False):
+    """
+    points the default database (and with `split` the timeseries one, see
+    routers.WorkloadRouter) at freshly migrated sqlite files for the
+    duration of the block - locking only shows up with real files.
+    """
+    from django.core.management import call_command
+    from django.db import connections
+    from . routers import TIMESERIES
+    import os
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    saved = dict(connections.databases)
+    aliases = ['default', TIMESERIES] if split else ['default']
+
+    # the open connections are put aside untouched (a test case may hold a
+    # transaction on them) and put back afterwards
+    previous = {}
+    for alias in ['default', TIMESERIES]:
+        if alias in connections.databases:
+            previous[alias] = connections[alias]
+            del connections[alias]
+    connections.databases.pop(TIMESERIES, None)
+    for alias in aliases:
+        connections.databases[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, '%s.sqlite3' % alias),
+        }
+    try:
+        for alias in aliases:
+            call_command('migrate', database=alias, verbosity=0, interactive=False)
+        yield
+    finally:
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+        connections.databases.clear()
+        connections.databases.update(saved)
+        for alias, connection in previous.items():
+            connections[alias] = connection
+        shutil.rmtree(directory)
+
+
+def bench_workloads(rows=5000, batch=250, **kwargs):
+    """
+    latency of configuration / rule reads while another process ingests
+    `rows` readings in bulk batches - on one database without any tuning
+    (the old setup) and split across the default and timeseries databases
+    with the VEGGY_PI_SQLITE_PRAGMAS applied.
+    """
+    from django.conf import settings
+    from django.db import DatabaseError, connections
+    from django.test.utils import override_settings
+    import multiprocessing
+
+    results = {}
+    for mode in ('shared', 'split'):
+        pragmas = settings.VEGGY_PI_SQLITE_PRAGMAS if mode == 'split' else {}
+        with override_settings(VEGGY_PI_SQLITE_PRAGMAS=pragmas), file_databases(split=mode == 'split'):
+            leaf = make_config_chain(4, 10)
+            group, state = make_condition_group(10, 4)
+            sensor = Sensor.objects.create(name='bench')
+            start = timezone.now()
+            records = [(sensor.pk, start + datetime.timedelta(milliseconds=i), '21.5') for i in range(rows)]
+
+            # the writer is a separate process like the controller / celery
+            # worker would be, so only the database locks are shared
+            errors = multiprocessing.Value('i', 0)
+
+            def ingest():
+                try:
+                    for i in range(0, rows, batch):
+                        Reading.objects.bulk_ingest(records[i:i + batch])
+                except DatabaseError:
+                    errors.value += 1
+                finally:
+                    connections.close_all()
+
+            latencies = []
+            connections.close_all()
+            writer = multiprocessing.Process(target=ingest)
+            started = time.time()
+            writer.start()
+            while writer.is_alive():
+                read_start = time.time()
+                try:
+                    leaf.get_values([], [])
+                    group.evaluate(state)
+                except DatabaseError:
+                    errors.value += 1
+                latencies.append(time.time() - read_start)
+            writer.join()
+            elapsed = time.time() - started
+
+            latencies.sort()
+            results[mode] = {
+                'reads': len(latencies),
+                'read_p50_ms': percentile(latencies, 0.50) * 1000,
+                'read_p99_ms': percentile(latencies, 0.99) * 1000,
+                'read_max_ms': latencies[-1] * 1000,
+                'ingest_rows_per_sec': rows / elapsed,
+                'errors': errors.value,
+            }
+    return results
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    bytes held by obj and everything it references, each object counted once.
+    """
+    from django.utils import six
+    import sys
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, six.string_types + (six.binary_type, int, float)):
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+def bench_records(rows=5000, **kwargs):
+    """
+    bytes per in-memory reading held as Reading instances, plain tuples,
+    ReadingRecords and in a ReadingBatch.
+    """
+    from . funcs import to_timestamp
+    from . records import ReadingBatch, ReadingRecord
+
+    start = to_timestamp(timezone.now())
+    rows = max(rows, 1)
+
+    def records():
+        return [(i % 8 + 1, start + i / 1000, '%.2f' % (20 + (i % 100) / 10)) for i in range(rows)]
+
+    def per_row(container):
+        return deep_sizeof(container) / rows
+
+    return {
+        'rows': rows,
+        'model_bytes_per_reading': per_row([
+            Reading(sensor_id=s, created_at=from_timestamp(t), data=d) for s, t, d in records()
+        ]),
+        'tuple_bytes_per_reading': per_row(records()),
+        'record_bytes_per_reading': per_row([ReadingRecord(*r) for r in records()]),
+        'batch_bytes_per_reading': per_row(ReadingBatch(records())),
+    }
+
+
+def scan_active(now):
+    """
+    the active config without the schedule timeline - every config is
+    fetched and its times compared against `now`.
+    """
+    from . schedule import chain_depth
+
+    configs = ScheduleTimeline.load()
+    tz = timezone.get_default_timezone()
+    time_of_day = timezone.localtime(now, tz).time()
+    active = []
+    for pk, (parent_id, start_time, end_time) in configs.items():
+        if start_time is not None and end_time is not None:
+            start = timezone.localtime(start_time, tz).time()
+            end = timezone.localtime(end_time, tz).time()
+            if start < end and not start <= time_of_day < end:
+                continue
+            if start >= end and end <= time_of_day < start:
+                continue
+        active.append((chain_depth(configs, pk), pk))
+    return max(active)[1] if active else None
+
+
+def bench_schedule(configs=50, iterations=200, **kwargs):
+    """
+    selecting the active configuration per tick - scanning every config
+    against a lookup in the materialized schedule timeline.
+    """
+    now = timezone.now()
+    parent = None
+    for i in range(configs):
+        # alternating always-on and one hour windows, each a child of the last
+        start = now.replace(hour=i % 24, minute=0) if i % 2 else None
+        end = start + datetime.timedelta(hours=1) if start else None
+        parent = VeggyConfiguration.objects.create(
+            label='bench_%s' % i, parent_config=parent, start_time=start, end_time=end,
+        )
+
+    timeline = ScheduleTimeline(reload_interval=3600)
+    ticks = [now + datetime.timedelta(minutes=i) for i in range(iterations)]
+    scanned = [scan_active(tick) for tick in ticks]
+    looked_up = [timeline.active(tick) for tick in ticks]
+
+    def build():
+        timeline.clear()
+        timeline.active(now)
+
+    tick = iter(ticks * 2)
+    return {
+        'configs': configs,
+        'agree': scanned == looked_up,
+        'intervals': len(timeline.intervals()),
+        'scan': measure(lambda: scan_active(next(tick)), iterations),
+        'timeline': measure(lambda: timeline.active(next(tick)), iterations),
+        'timeline_build': measure(build, 20),
+    }
+
+
+def bench_compliance(rows=20000, repeat=3, **kwargs):
+    """
+    compliance check of a temperature history, one reading a second.
+    """
+    from . import compliance
+
+    make_config_chain(1, 3)
+    make_readings(rows)
+    end = timezone.now() + datetime.timedelta(seconds=1)
+    start = end - datetime.timedelta(seconds=rows + 1)
+    sensors = {'temp': 'bench_0'}
+
+    def check():
+        return compliance.check_compliance(start, end, sensors=sensors)
+
+    results = {
+        'rows': rows,
+        'violations': len(check()[0]['violations']),
+        'seconds': timed(check, repeat),
+    }
+    results['rows_per_sec'] = rows / results['seconds']
+    return results
+
+
+def bench_replay(rows=5000, conditions=10, interval=5, **kwargs):
+    """
+    replay speed of the simulator over `rows` seconds of one-a-second history.
+    """
+    from . models import RPiPin
+    from . simulator import Replay
+
+    group, state = make_condition_group(conditions, 1)
+    group.output_pin = RPiPin.objects.create(pin_number=11, label='gpio_17')
+    group.save()
+    make_readings(rows)
+    end = timezone.now() + datetime.timedelta(seconds=1)
+    report = Replay(end - datetime.timedelta(seconds=rows), end, interval=interval).run()
+    return dict((key, report[key]) for key in ('ticks', 'readings', 'seconds', 'speedup'))
+
+
+def bench_filters(channels=300, ticks=1000, **kwargs):
+    """
+    cost of filtering every channel once per tick through an outlier,
+    median and ema chain.
+    """
+    from . filters import SensorFilters
+
+    filters = SensorFilters(dict(
+        ('bench_%s' % i, [
+            {'filter': 'outlier', 'size': 10, 'threshold': 3},
+            {'filter': 'median', 'size': 5},
+            {'filter': 'ema', 'alpha': 0.3},
+        ]) for i in range(channels)
+    ))
+    names = ['bench_%s' % i for i in range(channels)]
+    samples = ['%.2f' % (20 + (i % 7) / 10) for i in range(ticks)]
+
+    def run():
+        for value in samples:
+            for name in names:
+                filters.sample(name, value)
+
+    seconds = timed(run, 1)
+    return {
+        'channels': channels,
+        'ticks': ticks,
+        'us_per_tick': seconds / ticks * 1e6,
+        'us_per_sample': seconds / ticks / channels * 1e6,
+    }
+
+
+# boots django and imports the control loop in a fresh interpreter, then
+# reports the wall time, peak rss in kB and the modules loaded. ru_maxrss
+# survives the fork + exec of the benchmark process on linux, so the peak
+# is taken from /proc where available
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.time()
+import django
+django.setup()
+import veggy_pi.controller
+elapsed = time.time() - start
+try:
+    with open('/proc/self/status') as f:
+        maxrss = int([line.split()[1] for line in f if line.startswith('VmHWM:')][0])
+except (IOError, IndexError):
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': elapsed, 'maxrss_kb': maxrss, 'modules': len(sys.modules)}))
+'''
+
+
+def bench_startup(repeat=3, profiles=('www.settings', 'www.settings_controller'), **kwargs):
+    """
+    startup time and memory of the controller entry point under the full
+    (web) settings and the slim controller settings profile.
+    """
+    from django.conf import settings
+    import json
+    import os
+    import subprocess
+    import sys
+
+    results = {}
+    for profile in profiles:
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+        runs = [
+            json.loads(subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=settings.BASE_DIR, env=env))
+            for i in range(repeat)
+        ]
+        results[profile] = {
+            'import_seconds': min(run['seconds'] for run in runs),
+            'maxrss_kb': min(run['maxrss_kb'] for run in runs),
+            'modules': runs[0]['modules'],
+        }
+    return results
+
+
+SUITES = {
+    'hotpaths': bench_hotpaths,
+    'serializers': bench_serializers,
+    'ingest': bench_ingest,
+    'startup': bench_startup,
+    'records': bench_records,
+    'workloads': bench_workloads,
+    'schedule': bench_schedule,
+    'compliance': bench_compliance,
+    'replay': bench_replay,
+    'filters': bench_filters,
+}
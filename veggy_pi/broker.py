@@ -0,0 +1,109 @@
+"""
+in-process fan-out of live events (new readings, condition state changes)
+to the server-sent-events stream subscribers.
+
+only events raised in this process are seen - readings written by a
+separate celery worker or controller process don't show up here.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+import time
+
+
+from . records import ReadingRecord
+
+class Subscription(object):
+    """
+    a bounded event queue for one client. events are keyed (i.e. per sensor)
+    and a new event replaces a still undelivered one with the same key, so a
+    slow client only ever gets the newest value. once `maxsize` different
+    keys are waiting the oldest event is dropped.
+    """
+    def __init__(self, maxsize=100, accept=None):
+        self.maxsize = maxsize
+        self.accept = accept
+        self.coalesced = 0
+        self.dropped = 0
+        self._events = OrderedDict()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, key, event):
+        if self.accept is not None and not self.accept(key):
+            return
+        with self._cond:
+            if key in self._events:
+                del self._events[key]
+                self.coalesced += 1
+            elif len(self._events) >= self.maxsize:
+                self._events.popitem(last=False)
+                self.dropped += 1
+            self._events[key] = event
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        the oldest waiting event or None if nothing arrived within `timeout`.
+        """
+        with self._cond:
+            if not self._events:
+                deadline = None if timeout is None else time.time() + timeout
+                while not self._events:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+            key, event = self._events.popitem(last=False)
+            return event
+
+
+class Broker(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self, maxsize=100, accept=None):
+        subscription = Subscription(maxsize=maxsize, accept=accept)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish(self, kind, key, data):
+        """
+        hands (kind, data) to every subscriber, coalescing on (kind, key).
+        """
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        for subscription in subscriptions:
+            subscription.put((kind, key), (kind, data))
+
+    @property
+    def subscribed(self):
+        return bool(self._subscriptions)
+
+    def publish_reading(self, sensor_id, created_at, data):
+        """
+        queues a ReadingRecord - it is only formatted (see as_event) when a
+        subscriber actually sends it.
+        """
+        if not self._subscriptions:
+            return
+        self.publish('reading', sensor_id, ReadingRecord(sensor_id, created_at, data))
+
+    def publish_condition(self, group_id, state):
+        self.publish('condition', group_id, {
+            'group': group_id,
+            'state': state,
+        })
+
+
+broker = Broker()
@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+
+import threading
+
+
+class VersionedCache(object):
+    """
+    tiny in-process cache holding a single value together with the version
+    (i.e. the newest reading id) it was built for. get() only rebuilds the
+    value when the version moved on, so any number of requests for an
+    unchanged version share one build.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self, version, build):
+        with self._lock:
+            if self._version != version or self._value is None:
+                self._value = build()
+                self._version = version
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._value = None
+
+
+# the serialized latest reading of every sensor, versioned by max(Reading.id)
+# and the sensor list (see views.latest_readings)
+latest_readings = VersionedCache()
@@ -0,0 +1,215 @@
+"""
+threshold compliance of the reading history - how long the temperature,
+humidity and pH stayed outside the min / max values of the configuration
+that was active at the time.
+
+the history is a step function: a reading holds from its created_at until
+the next reading of the sensor, but never longer than
+VEGGY_PI_COMPLIANCE_MAX_GAP seconds, so an offline sensor doesn't count as
+out of range. for each active config interval (see schedule.schedule_between)
+the readings are checked VEGGY_PI_COMPLIANCE_CHUNK seconds at a time by the
+database - cast to numbers, compared to the thresholds and paired with the
+timestamp of the next reading - so only the out of range readings are
+fetched and merged into runs of consecutive out of range time. readings
+which aren't numbers ('on', 'ok') are never out of range, they just end the
+reading before them.
+
+    for result in check_compliance(start, end):
+        print result['name'], result['metric'], result['out_of_range_seconds']
+"""
+from __future__ import unicode_literals, division
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+
+
+from . funcs import from_timestamp, to_number, to_timestamp
+from . models import AsFloat, ConfigurationOption, IsNumber, NextReading, Sensor, TimeBucket, VeggyConfiguration
+from . partitions import PartitionedReadings
+from . schedule import schedule_between
+
+
+METRICS = ('temp', 'rh', 'ph')
+
+LOW, HIGH = -1, 1
+
+
+def to_celsius(value, temp_format):
+    """
+    converts a temperature in the given temp_format to celsius
+    """
+    if temp_format == 'farenheit':
+        return (value - 32) * 5 / 9
+    if temp_format == 'kelvin':
+        return value - 273.15
+    return value
+
+
+def resolve_thresholds(config):
+    """
+    the {metric: (min, max)} thresholds of the resolved values of a config
+    and its parents, temperatures in celsius. None is an open bound.
+    """
+    values = config.get_values([], [])
+    values = VeggyConfiguration.get_unique_values(values) if values else []
+    labels = dict(ConfigurationOption.objects.filter(
+        pk__in=[value['variable_id'] for value in values],
+    ).values_list('pk', 'option_label'))
+    options = dict((labels.get(value['variable_id']), value['value']) for value in values)
+
+    thresholds = {}
+    for metric in METRICS:
+        low, high = to_number(options.get('min_%s' % metric)), to_number(options.get('max_%s' % metric))
+        if metric == 'temp':
+            temp_format = options.get('temp_format') or 'celcius'
+            low = to_celsius(low, temp_format) if low is not None else None
+            high = to_celsius(high, temp_format) if high is not None else None
+        if low is not None or high is not None:
+            thresholds[metric] = (low, high)
+    return thresholds
+
+
+def later_reading(sensor_id, alias, timestamp, max_gap):
+    """
+    the timestamp of the first reading of a sensor after `timestamp` in a
+    later partition than `alias`, if there is one within max_gap.
+    """
+    querysets = PartitionedReadings(
+        from_timestamp(timestamp), from_timestamp(timestamp + max_gap),
+    ).filter(sensor_id=sensor_id).querysets()
+    later = False
+    for queryset in querysets:
+        if not later:
+            later = queryset.db == alias
+            continue
+        following = queryset.annotate(timestamp=TimeBucket('created_at', 1)).order_by(
+            'created_at', 'id',
+        ).values_list('timestamp', flat=True).first()
+        if following is not None:
+            return following
+    return None
+
+
+def out_of_range(sensor_id, start, end, max_gap, low, high):
+    """
+    the [(timestamp, next timestamp, value), ...] of the numeric readings of
+    a sensor outside [low, high] which hold between two epoch timestamps,
+    including the archived partitions. the threshold test and the timestamp
+    of the next reading (NULL for the last one) come from the database, so
+    only the out of range rows are fetched.
+    """
+    condition = Q()
+    if low is not None:
+        condition |= Q(value__lt=low)
+    if high is not None:
+        condition |= Q(value__gt=high)
+
+    rows = []
+    querysets = PartitionedReadings(
+        from_timestamp(start - max_gap), from_timestamp(end),
+    ).filter(sensor_id=sensor_id).querysets()
+    for queryset in querysets:
+        for timestamp, following, value in queryset.annotate(
+            numeric=IsNumber('data'), value=AsFloat('data'),
+        ).filter(condition, numeric=True).annotate(
+            timestamp=TimeBucket('created_at', 1), following=NextReading(),
+        ).order_by('created_at', 'id').values_list('timestamp', 'following', 'value'):
+            if following is None:
+                # the last reading of the partition
+                following = later_reading(sensor_id, queryset.db, timestamp, max_gap)
+            rows.append((timestamp, following, value))
+    return rows
+
+
+def out_of_range_runs(rows, start, end, max_gap, low):
+    """
+    the (start, end, LOW / HIGH) runs between start and end of the out of
+    range readings `rows` - each holds until the next reading, but no longer
+    than max_gap.
+    """
+    runs = []
+    for timestamp, following, value in rows:
+        begin = max(timestamp, start)
+        finish = min(end, timestamp + max_gap, following if following is not None else end)
+        if finish <= begin:
+            continue
+        code = LOW if low is not None and value < low else HIGH
+        if runs and runs[-1][1] == begin and runs[-1][2] == code:
+            runs[-1] = (runs[-1][0], finish, code)
+        else:
+            runs.append((begin, finish, code))
+    return runs
+
+
+def sensor_runs(sensor_id, start, end, low, high, chunk=None, max_gap=None):
+    """
+    the out of range runs of a sensor between two epoch timestamps, streamed
+    `chunk` seconds at a time.
+    """
+    chunk = chunk or settings.VEGGY_PI_COMPLIANCE_CHUNK
+    max_gap = max_gap or settings.VEGGY_PI_COMPLIANCE_MAX_GAP
+
+    runs = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(end, chunk_start + chunk)
+        rows = out_of_range(sensor_id, chunk_start, chunk_end, max_gap, low, high)
+        new_runs = out_of_range_runs(rows, chunk_start, chunk_end, max_gap, low)
+        # a run reaching the end of a chunk goes on in the next one
+        if runs and new_runs and runs[-1][1] == new_runs[0][0] and runs[-1][2] == new_runs[0][2]:
+            runs[-1] = (runs[-1][0], new_runs[0][1], runs[-1][2])
+            new_runs = new_runs[1:]
+        runs.extend(new_runs)
+        chunk_start = chunk_end
+    return runs
+
+
+def check_compliance(start, end, sensors=None, chunk=None, max_gap=None):
+    """
+    checks the history between two datetimes against the configs active at
+    the time. sensors maps the metrics to sensor names (default
+    VEGGY_PI_COMPLIANCE_SENSORS), every sensor of that name - i.e. one per
+    tent synced to a hub - is checked. returns one dict per sensor and
+    metric with the total out_of_range_seconds and the violations, each
+    with start, end, seconds, the config and the kind ('low' / 'high').
+    """
+    if end <= start:
+        raise ValueError(_('the end of the range must be after its start'))
+    sensors = sensors or settings.VEGGY_PI_COMPLIANCE_SENSORS
+
+    intervals = [
+        (to_timestamp(interval_start), to_timestamp(interval_end), pk)
+        for interval_start, interval_end, pk in schedule_between(start, end) if pk is not None
+    ]
+    configs = VeggyConfiguration.objects.in_bulk(set(pk for interval_start, interval_end, pk in intervals))
+    thresholds = dict((pk, resolve_thresholds(config)) for pk, config in configs.items())
+
+    results = []
+    names = dict((name, metric) for metric, name in sensors.items() if metric in METRICS)
+    for sensor_id, name, origin in Sensor.objects.filter(name__in=names).order_by('origin', 'name', 'pk').values_list(
+        'pk', 'name', 'origin',
+    ):
+        metric = names[name]
+        violations = []
+        for interval_start, interval_end, pk in intervals:
+            if metric not in thresholds[pk]:
+                continue
+            low, high = thresholds[pk][metric]
+            for run_start, run_end, code in sensor_runs(sensor_id, interval_start, interval_end, low, high, chunk, max_gap):
+                violations.append({
+                    'start': from_timestamp(run_start),
+                    'end': from_timestamp(run_end),
+                    'seconds': run_end - run_start,
+                    'config': pk,
+                    'kind': 'low' if code == LOW else 'high',
+                })
+        results.append({
+            'sensor': sensor_id,
+            'name': name,
+            'origin': origin,
+            'metric': metric,
+            'out_of_range_seconds': sum(violation['seconds'] for violation in violations),
+            'violations': violations,
+        })
+    return results
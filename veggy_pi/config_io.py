@@ -0,0 +1,384 @@
+"""
+import / export of whole configuration trees as YAML - the configuration
+options, the configurations with their parents, times and values and the
+condition groups with their conditions:
+
+    options:
+    - {label: temperature}
+    - {label: min_temp, parent: temperature}
+    configurations:
+    - label: main_config
+      values: {temp_format: celcius, min_temp: '20'}
+    - label: day_config
+      parent: main_config
+      start_time: '2026-01-01T06:00:00+00:00'
+      end_time: '2026-01-01T18:00:00+00:00'
+      values: {min_temp: '24'}
+    condition_groups:
+    - operator: AND
+      output_pin: 11
+      conditions:
+      - {lhs: TEMP, operator: '<', rhs: '20'}
+
+options and configurations are matched by label, a configuration in the
+file replaces the values of the stored one of the same label and the
+condition groups in the file replace the stored groups driving the same
+pins (and the pin-less groups replace the stored pin-less ones). the whole
+document is checked before anything is written, then it is applied in one
+transaction - bulk inserts, a CASE update per batch of rows (UPDATE_BATCH)
+and an insert per condition group, whose id its conditions need - in
+which the resolved values of every imported configuration are validated
+(validate_unique_values) before it commits.
+"""
+from __future__ import unicode_literals
+
+from django.db import router, transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from collections import OrderedDict, defaultdict
+import datetime
+import yaml
+
+
+from . ingest import parse_timestamp
+from . models import (
+    Condition,
+    ConditionGroup,
+    ConfigurationOption,
+    Operator,
+    RPiPin,
+    UserInput,
+    VeggyConfiguration,
+)
+from . schedule import timeline as schedule_timeline
+
+
+GROUP_OPERATORS = {'AND': Operator.AND, 'OR': Operator.OR}
+
+COMPARE_OPERATORS = {
+    '==': Operator.EQUALS,
+    '!=': Operator.NOT_EQUALS,
+    '>': Operator.GT,
+    '<': Operator.LT,
+    '>=': Operator.GTE,
+    '<=': Operator.LTE,
+}
+
+VALUE_LENGTH = UserInput._meta.get_field('value').max_length
+
+# rows per CASE update - every row takes two parameters per field and sqlite
+# allows 999 per statement
+UPDATE_BATCH = 100
+
+
+class ConfigImportError(ValueError):
+    """
+    a document which can't be imported - errors lists every problem found.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(ConfigImportError, self).__init__('; '.join('%s' % error for error in errors))
+
+
+def _name(operators, value):
+    return dict((code, name) for name, code in operators.items())[value]
+
+
+def export_configuration(labels=None):
+    """
+    the configuration tree as a dict - the configurations with the given
+    labels and their parents (default: all of them), every option and every
+    condition group.
+    """
+    configs = dict((c.pk, c) for c in VeggyConfiguration.objects.all())
+    if labels is not None:
+        wanted = set()
+        for config in configs.values():
+            if config.label in labels:
+                # the chain up to the root, guarding against cycles
+                while config is not None and config.pk not in wanted:
+                    wanted.add(config.pk)
+                    config = configs.get(config.parent_config_id)
+        configs = dict((pk, config) for pk, config in configs.items() if pk in wanted)
+
+    values = defaultdict(dict)
+    for config_id, label, value in UserInput.objects.filter(veggy_config__in=list(configs)).values_list(
+        'veggy_config_id', 'variable__option_label', 'value',
+    ):
+        values[config_id][label] = value
+
+    options = dict(ConfigurationOption.objects.values_list('pk', 'option_label'))
+    document = {
+        'options': [
+            dict([('label', label)] + ([('parent', options[parent_id])] if parent_id else []))
+            for label, parent_id in ConfigurationOption.objects.order_by('pk').values_list('option_label', 'parent_option_id')
+        ],
+        'configurations': [],
+        'condition_groups': [],
+    }
+    for pk, config in sorted(configs.items()):
+        item = {'label': config.label, 'values': values[pk]}
+        if config.parent_config_id in configs:
+            item['parent'] = configs[config.parent_config_id].label
+        for field in ('start_time', 'end_time'):
+            if getattr(config, field) is not None:
+                item[field] = getattr(config, field).isoformat()
+        document['configurations'].append(item)
+
+    for group in ConditionGroup.objects.select_related('output_pin').prefetch_related('condition_set').order_by('pk'):
+        item = {
+            'operator': _name(GROUP_OPERATORS, group.operator),
+            'conditions': [
+                {'lhs': c.lhs, 'operator': _name(COMPARE_OPERATORS, c.operator), 'rhs': c.rhs}
+                for c in sorted(group.condition_set.all(), key=lambda c: c.pk)
+            ],
+        }
+        if group.output_pin is not None:
+            item['output_pin'] = group.output_pin.pin_number
+        document['condition_groups'].append(item)
+    return document
+
+
+def dump(document, stream=None):
+    return yaml.safe_dump(document, stream, default_flow_style=False, allow_unicode=True)
+
+
+def load(stream):
+    try:
+        document = yaml.safe_load(stream)
+    except yaml.YAMLError as ex:
+        raise ConfigImportError([_('invalid yaml: %s') % ex])
+    if document is None:
+        document = {}
+    if not isinstance(document, dict):
+        raise ConfigImportError([_('expected a mapping of options, configurations and condition_groups')])
+    return document
+
+
+def _text(value):
+    if value is None or isinstance(value, (bool, list, dict)):
+        return None
+    return '%s' % value
+
+
+def _key(value):
+    # lists and mappings can't be looked up (they aren't hashable)
+    return None if isinstance(value, (list, dict)) else value
+
+
+def _datetime(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.make_aware(value, timezone.utc) if timezone.is_naive(value) else value
+    return parse_timestamp(value)
+
+
+def _items(document, key):
+    items = document.get(key) or []
+    return items if isinstance(items, list) else None
+
+
+def check(document):
+    """
+    checks the whole document against itself and the stored rows with a
+    query per table, returns the normalized plan or raises ConfigImportError
+    with every problem found.
+    """
+    errors = []
+    # in document order, so the rows are created in it
+    plan = {'options': OrderedDict(), 'configurations': OrderedDict(), 'condition_groups': []}
+
+    for key in ('options', 'configurations', 'condition_groups'):
+        if _items(document, key) is None:
+            errors.append(_('%s must be a list') % key)
+    if errors:
+        raise ConfigImportError(errors)
+
+    stored_options = set(ConfigurationOption.objects.values_list('option_label', flat=True))
+    for i, item in enumerate(_items(document, 'options')):
+        label = _text(item.get('label')) if isinstance(item, dict) else None
+        if not label:
+            errors.append(_('options[%s]: a label is required') % i)
+            continue
+        if label in plan['options']:
+            errors.append(_('options[%s]: %s is listed twice') % (i, label))
+        plan['options'][label] = _text(item.get('parent'))
+    known_options = stored_options | set(plan['options'])
+    for label, parent in plan['options'].items():
+        if parent is not None and parent not in known_options:
+            errors.append(_('option %s: unknown parent option %s') % (label, parent))
+
+    stored_configs = defaultdict(int)
+    for label in VeggyConfiguration.objects.values_list('label', flat=True):
+        stored_configs[label] += 1
+    for i, item in enumerate(_items(document, 'configurations')):
+        label = _text(item.get('label')) if isinstance(item, dict) else None
+        if not label:
+            errors.append(_('configurations[%s]: a label is required') % i)
+            continue
+        if label in plan['configurations']:
+            errors.append(_('configurations[%s]: %s is listed twice') % (i, label))
+        if stored_configs[label] > 1:
+            errors.append(_('configuration %s: the label is ambiguous, %s are stored') % (label, stored_configs[label]))
+
+        config = {'parent': _text(item.get('parent')), 'values': {}}
+        for field in ('start_time', 'end_time'):
+            config[field] = None
+            if item.get(field) is not None:
+                config[field] = _datetime(item[field])
+                if config[field] is None:
+                    errors.append(_('configuration %s: invalid %s') % (label, field))
+        values = item.get('values') or {}
+        if not isinstance(values, dict):
+            errors.append(_('configuration %s: values must be a mapping') % label)
+            values = {}
+        for option, value in values.items():
+            value = _text(value)
+            if option not in known_options:
+                errors.append(_('configuration %s: unknown option %s') % (label, option))
+            elif value is None or len(value) > VALUE_LENGTH:
+                errors.append(_('configuration %s: invalid value for %s') % (label, option))
+            else:
+                config['values'][option] = value
+        plan['configurations'][label] = config
+
+    for label, config in plan['configurations'].items():
+        parent = config['parent']
+        if parent is not None and parent not in plan['configurations'] and not stored_configs[parent]:
+            errors.append(_('configuration %s: unknown parent configuration %s') % (label, parent))
+        # a cycle within the file
+        seen = set([label])
+        while parent in plan['configurations'] and parent not in seen:
+            seen.add(parent)
+            parent = plan['configurations'][parent]['parent']
+        if parent == label:
+            errors.append(_('configuration %s: is its own ancestor') % label)
+
+    pins = dict(RPiPin.objects.values_list('pin_number', 'pk'))
+    for i, item in enumerate(_items(document, 'condition_groups')):
+        if not isinstance(item, dict) or _key(item.get('operator', 'AND')) not in GROUP_OPERATORS:
+            errors.append(_('condition_groups[%s]: the operator must be AND or OR') % i)
+            continue
+        group = {'operator': GROUP_OPERATORS[item.get('operator', 'AND')], 'output_pin': None, 'conditions': []}
+        if item.get('output_pin') is not None:
+            group['output_pin'] = pins.get(_key(item['output_pin']))
+            if group['output_pin'] is None:
+                errors.append(_('condition_groups[%s]: unknown pin %s') % (i, item['output_pin']))
+        for j, condition in enumerate(item.get('conditions') or []):
+            lhs = _text(condition.get('lhs')) if isinstance(condition, dict) else None
+            rhs = _text(condition.get('rhs')) if isinstance(condition, dict) else None
+            if not lhs or rhs is None or _key(condition.get('operator')) not in COMPARE_OPERATORS:
+                errors.append(_('condition_groups[%s].conditions[%s]: expected lhs, operator and rhs') % (i, j))
+                continue
+            group['conditions'].append((lhs, COMPARE_OPERATORS[condition['operator']], rhs))
+        plan['condition_groups'].append(group)
+
+    if errors:
+        raise ConfigImportError(errors)
+    return plan
+
+
+def _case_update(model, updates):
+    """
+    applies {pk: {field: value}} with one UPDATE ... SET field = CASE ...
+    per UPDATE_BATCH rows, whatever the number of distinct values.
+    """
+    pks = sorted(updates)
+    for start in range(0, len(pks), UPDATE_BATCH):
+        batch = pks[start:start + UPDATE_BATCH]
+        fields = {}
+        for name in set(name for pk in batch for name in updates[pk]):
+            field = model._meta.get_field(name)
+            output_field = field.target_field if field.is_relation else field
+            fields[name] = Case(*[
+                When(pk=pk, then=Value(updates[pk][name], output_field=output_field))
+                for pk in batch if name in updates[pk]
+            ], default=name, output_field=output_field)
+        model.objects.filter(pk__in=batch).update(**fields)
+
+
+def import_configuration(document, dry_run=False):
+    """
+    checks and applies a document (a dict, see load()) in one transaction,
+    returns the number of options, configurations, values, condition groups
+    and conditions written. dry_run rolls the transaction back.
+    """
+    plan = check(document)
+    db = router.db_for_write(VeggyConfiguration)
+    counts = {}
+    with transaction.atomic(using=db):
+        # options - the new ones in one insert, then their parents
+        options = dict(ConfigurationOption.objects.values_list('option_label', 'pk'))
+        ConfigurationOption.objects.bulk_create([
+            ConfigurationOption(option_label=label) for label in plan['options'] if label not in options
+        ])
+        options = dict(ConfigurationOption.objects.values_list('option_label', 'pk'))
+        _case_update(ConfigurationOption, dict(
+            (options[label], {'parent_option': options[parent] if parent else None})
+            for label, parent in plan['options'].items()
+        ))
+        counts['options'] = len(plan['options'])
+
+        # configurations - created, then linked up and timed
+        configs = dict(VeggyConfiguration.objects.values_list('label', 'pk'))
+        VeggyConfiguration.objects.bulk_create([
+            VeggyConfiguration(label=label) for label in plan['configurations'] if label not in configs
+        ])
+        configs = dict(VeggyConfiguration.objects.values_list('label', 'pk'))
+        _case_update(VeggyConfiguration, dict(
+            (configs[label], {
+                'parent_config': configs[config['parent']] if config['parent'] else None,
+                'start_time': config['start_time'],
+                'end_time': config['end_time'],
+            })
+            for label, config in plan['configurations'].items()
+        ))
+        counts['configurations'] = len(plan['configurations'])
+
+        # the values of the imported configurations are replaced
+        imported = [configs[label] for label in plan['configurations']]
+        UserInput.objects.filter(veggy_config__in=imported).delete()
+        inputs = [
+            UserInput(veggy_config_id=configs[label], variable_id=options[option], value=value)
+            for label, config in plan['configurations'].items()
+            for option, value in config['values'].items()
+        ]
+        UserInput.objects.bulk_create(inputs)
+        counts['values'] = len(inputs)
+
+        # and so are the groups driving the pins in the document - and the
+        # pin-less ones if it has any, so a re-import doesn't duplicate them
+        pins = set(group['output_pin'] for group in plan['condition_groups'])
+        replaced = Q(output_pin__in=pins - set([None]))
+        if None in pins:
+            replaced |= Q(output_pin=None)
+        ConditionGroup.objects.filter(replaced).delete()
+        conditions = []
+        for group in plan['condition_groups']:
+            created = ConditionGroup.objects.create(operator=group['operator'], output_pin_id=group['output_pin'])
+            for lhs, operator, rhs in group['conditions']:
+                condition = Condition(group=created, lhs=lhs, operator=operator, rhs=rhs)
+                condition.parse_rhs()
+                conditions.append(condition)
+        Condition.objects.bulk_create(conditions)
+        counts['condition_groups'] = len(plan['condition_groups'])
+        counts['conditions'] = len(conditions)
+
+        errors = []
+        for config in VeggyConfiguration.objects.filter(pk__in=imported).order_by('pk'):
+            values = config.get_values([], [])
+            if values:
+                try:
+                    VeggyConfiguration.validate_unique_values(VeggyConfiguration.get_unique_values(values))
+                except ValueError as ex:
+                    errors.append(_('configuration %s: %s') % (config.label, ex))
+        if errors:
+            raise ConfigImportError(errors)
+
+        if dry_run:
+            transaction.set_rollback(True, using=db)
+        else:
+            # bulk writes send no post_save
+            transaction.on_commit(schedule_timeline.refresh, using=db)
+    return counts
@@ -0,0 +1,130 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+import time
+
+
+from . actuators import ActuatorQueue
+from . broker import broker
+from . filters import SensorFilters
+from . profiling import profiler
+from . models import ConditionGroup, Sensor, SensorState
+from . import metrics
+
+
+class Controller(object):
+    """
+    the control loop - each tick evaluates the condition groups driving an
+    output against the current sensor state and hands the resulting pin
+    commands to the actuator queue, which decides what is actually written.
+
+    a controller which isn't `live` (i.e. a simulator replay) records no
+    metrics, writes no metrics textfile and publishes no condition events.
+    """
+    def __init__(self, groups=None, actuators=None, filters=None, reload_interval=None, live=True):
+        # the default groups are reloaded every VEGGY_PI_CONTROLLER_RELOAD
+        # seconds - their conditions are prefetched rather than fetched by
+        # every evaluate(), but edits must still reach a long running loop
+        self._queryset = None
+        if groups is None:
+            groups = self._queryset = ConditionGroup.objects.exclude(output_pin=None).select_related(
+                'output_pin',
+            ).prefetch_related('condition_set')
+        self.groups = list(groups)
+        self.reload_interval = reload_interval
+        self.live = live
+        self._loaded = time.time()
+        self.actuators = actuators or ActuatorQueue()
+        self.filters = filters if filters is not None else SensorFilters()
+        self.states = {}
+        # the last reading fed to the filters and its filtered value per sensor
+        self._sampled = {}
+        self._filtered = {}
+        self._metrics_written = 0
+
+    def read_sensors(self):
+        """
+        the sensor state the groups are evaluated against - the current
+        value of every sensor keyed by its name, passed through the sensor
+        filters (see filters.py) once per new reading.
+        """
+        sensors = Sensor.objects.exclude(current_reading=None)
+        if not self.filters:
+            return SensorState(sensors.values_list('name', 'current_reading__data'))
+
+        state = SensorState()
+        for name, reading_id, data in sensors.values_list('name', 'current_reading_id', 'current_reading__data'):
+            if self._sampled.get(name) != reading_id:
+                self._sampled[name] = reading_id
+                self._filtered[name] = self.filters.sample(name, data)
+            state[name] = self._filtered[name]
+        return state
+
+    def run(self, interval=None, ticks=None, sleep=time.sleep):
+        """
+        ticks every `interval` seconds, forever or `ticks` times.
+        """
+        if interval is None:
+            interval = settings.VEGGY_PI_CONTROLLER_INTERVAL
+        count = 0
+        while True:
+            started = time.time()
+            self.tick(self.read_sensors())
+            count += 1
+            if ticks is not None and count >= ticks:
+                return
+            sleep(max(0, interval - (time.time() - started)))
+
+    def reload(self, force=False):
+        """
+        reloads the default groups once they are older than the reload
+        interval (or right away with force).
+        """
+        if self._queryset is None:
+            return
+        reload_interval = self.reload_interval
+        if reload_interval is None:
+            reload_interval = settings.VEGGY_PI_CONTROLLER_RELOAD
+        if force or time.time() - self._loaded >= reload_interval:
+            self.groups = list(self._queryset.all())
+            self._loaded = time.time()
+
+    def tick(self, sensor_state):
+        """
+        runs one evaluate -> actuate pass, returns the number of pin writes.
+        """
+        self.reload()
+        if not self.live:
+            return self._tick(sensor_state)
+
+        with metrics.TICK_SECONDS.time(), profiler.profile('tick'):
+            written = self._tick(sensor_state)
+
+        self.export_metrics()
+        return written
+
+    def _tick(self, sensor_state):
+        for group in self.groups:
+            if self.live:
+                profiler.mark('condition group %s' % group.pk)
+                state = group.evaluate(sensor_state)
+            else:
+                state = group._evaluate(sensor_state)
+            if self.states.get(group.pk) != state:
+                self.states[group.pk] = state
+                if self.live:
+                    broker.publish_condition(group.pk, state)
+            self.actuators.submit(group.output_pin, state)
+        return self.actuators.flush()
+
+    def export_metrics(self):
+        """
+        the controller serves no http, so its metrics are written to the
+        VEGGY_PI_METRICS_TEXTFILE every VEGGY_PI_METRICS_INTERVAL seconds.
+        """
+        path = settings.VEGGY_PI_METRICS_TEXTFILE
+        now = time.time()
+        if path and now - self._metrics_written >= settings.VEGGY_PI_METRICS_INTERVAL:
+            metrics.REGISTRY.write_textfile(path)
+            self._metrics_written = now
@@ -0,0 +1,208 @@
+"""
+signal filters between the sensor reads and the SensorState the rules are
+evaluated against - so a noisy DHT22 or pH probe doesn't make the rules and
+the relays flap.
+
+the filters of a sensor are configured by its name in
+VEGGY_PI_SENSOR_FILTERS and applied in order to every new sample:
+
+    VEGGY_PI_SENSOR_FILTERS = {
+        'TEMP': [{'filter': 'outlier', 'size': 10, 'threshold': 3}, {'filter': 'ema', 'alpha': 0.3}],
+        'PH': [{'filter': 'median', 'size': 5}],
+    }
+
+every filter keeps its window in a typed array and does a constant amount
+of work per sample, whatever the length of the history.
+"""
+from __future__ import unicode_literals, division
+
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+
+from array import array
+from bisect import bisect_left, insort
+import math
+
+
+from . funcs import to_number
+
+
+class MovingAverage(object):
+    """
+    the mean of the last `size` samples - a running sum over a ring buffer.
+    """
+    __slots__ = ('window', 'position', 'count', 'total')
+
+    def __init__(self, size=5):
+        if size < 1:
+            raise ValueError(_('the window of a filter needs at least one sample'))
+        self.window = array(str('d'), [0.0] * size)
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+
+    def __call__(self, value):
+        size = len(self.window)
+        if self.count == size:
+            self.total -= self.window[self.position]
+        else:
+            self.count += 1
+        self.window[self.position] = value
+        self.total += value
+        self.position = (self.position + 1) % size
+        return self.total / self.count
+
+
+class ExponentialSmoothing(object):
+    """
+    exponential moving average - alpha is the weight of the new sample.
+    """
+    __slots__ = ('alpha', 'value')
+
+    def __init__(self, alpha=0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError(_('alpha must be in (0, 1]'))
+        self.alpha = alpha
+        self.value = None
+
+    def __call__(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class Median(object):
+    """
+    the median of the last `size` samples - the window is kept sorted next
+    to the ring buffer, so a sample is one removal and one insertion.
+    """
+    __slots__ = ('window', 'ordered', 'position')
+
+    def __init__(self, size=5):
+        if size < 1:
+            raise ValueError(_('the window of a filter needs at least one sample'))
+        self.window = array(str('d'), [0.0] * size)
+        self.ordered = array(str('d'))
+        self.position = 0
+
+    def __call__(self, value):
+        size = len(self.window)
+        if len(self.ordered) == size:
+            del self.ordered[bisect_left(self.ordered, self.window[self.position])]
+        self.window[self.position] = value
+        insort(self.ordered, value)
+        self.position = (self.position + 1) % size
+
+        count = len(self.ordered)
+        middle = count // 2
+        if count % 2:
+            return self.ordered[middle]
+        return (self.ordered[middle - 1] + self.ordered[middle]) / 2
+
+
+class OutlierRejection(object):
+    """
+    drops samples more than `threshold` standard deviations away from the
+    mean of the last `size` accepted ones and repeats the last accepted
+    value instead. after `size` rejections in a row the level is taken to
+    have really changed and the sample is accepted.
+    """
+    __slots__ = ('window', 'position', 'count', 'total', 'squares', 'threshold', 'rejected', 'last')
+
+    def __init__(self, size=10, threshold=3.0):
+        if size < 2:
+            raise ValueError(_('outlier rejection needs a window of at least two samples'))
+        self.window = array(str('d'), [0.0] * size)
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.threshold = threshold
+        self.rejected = 0
+        self.last = None
+
+    def __call__(self, value):
+        size = len(self.window)
+        if self.count >= size // 2 and self.rejected < size:
+            mean = self.total / self.count
+            deviation = math.sqrt(max(0.0, self.squares / self.count - mean * mean))
+            if abs(value - mean) > self.threshold * deviation and deviation:
+                self.rejected += 1
+                return self.last
+
+        self.rejected = 0
+        if self.count == size:
+            old = self.window[self.position]
+            self.total -= old
+            self.squares -= old * old
+        else:
+            self.count += 1
+        self.window[self.position] = value
+        self.total += value
+        self.squares += value * value
+        self.position = (self.position + 1) % size
+        self.last = value
+        return value
+
+
+FILTERS = {
+    'moving_average': MovingAverage,
+    'ema': ExponentialSmoothing,
+    'median': Median,
+    'outlier': OutlierRejection,
+}
+
+
+def build_chain(specs):
+    """
+    the filter instances of a list of {'filter': name, **options} specs
+    """
+    chain = []
+    for spec in specs:
+        options = dict(spec)
+        name = options.pop('filter', None)
+        if name not in FILTERS:
+            raise ValueError(_('unknown filter: %s') % name)
+        chain.append(FILTERS[name](**options))
+    return chain
+
+
+class SensorFilters(object):
+    """
+    the filter chains of all configured sensors, built on the first sample.
+    """
+    def __init__(self, config=None):
+        self.config = config if config is not None else settings.VEGGY_PI_SENSOR_FILTERS
+        self.chains = {}
+
+    def __nonzero__(self):
+        return bool(self.config)
+
+    __bool__ = __nonzero__
+
+    def sample(self, name, value):
+        """
+        feeds a new raw sample of a sensor through its filters, returns the
+        filtered value - non numeric values and unfiltered sensors pass as is.
+        """
+        specs = self.config.get(name)
+        if not specs:
+            return value
+        number = to_number(value)
+        if number is None:
+            return value
+
+        chain = self.chains.get(name)
+        if chain is None:
+            chain = self.chains[name] = build_chain(specs)
+        for step in chain:
+            number = step(number)
+        return number
+
+    def reset(self, name=None):
+        if name is None:
+            self.chains.clear()
+        else:
+            self.chains.pop(name, None)
@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+from django.utils import six
+from django.utils.timezone import utc
 from django.utils.translation import ugettext_lazy as _
 
+import calendar
+import datetime
+
 
 def is_number(num):
     """
@@ -13,6 +18,19 @@ def is_number(num):
     return True
 
 
+NUMBER_TYPES = six.integer_types + (float,)
+
+
+def to_number(value):
+    """
+    value as a float if it is a number or a numeric string, otherwise None
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def all_numbers(*numbers):
     """
     """
@@ -49,3 +67,17 @@ def shift_bit_list(bit_list=None):
     for bit in bit_list:
         out = (out << 1) | bit 
     return out
+
+
+def to_timestamp(dt):
+    """
+    converts an aware datetime to a utc epoch timestamp (float)
+    """
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+def from_timestamp(ts):
+    """
+    converts a utc epoch timestamp to an aware datetime
+    """
+    return datetime.datetime.fromtimestamp(float(ts), utc)
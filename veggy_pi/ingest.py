@@ -0,0 +1,184 @@
+from __future__ import unicode_literals
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+
+import numbers
+import threading
+
+
+from . funcs import from_timestamp, to_number
+from . models import Input, Sensor
+
+
+OK = 'ok'
+
+
+def parse_timestamp(value):
+    """
+    accepts an epoch timestamp or an iso 8601 string (utc unless it carries
+    an offset), returns an aware datetime or None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Number):
+        try:
+            return from_timestamp(value)
+        except (ValueError, OverflowError, OSError):
+            # nan or out of range of the platform's time_t
+            return None
+    try:
+        timestamp = parse_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+    return timestamp
+
+
+def validate_records(records):
+    """
+    validates a batch of compact [sensor_id, timestamp, value] records with
+    a single query for all of the sensor ids. returns the valid records as
+    (sensor_id, created_at, data) tuples and a status per input record -
+    'ok' or the reason it was rejected.
+    """
+    statuses = []
+    candidates = []
+    for record in records:
+        try:
+            sensor_id, timestamp, value = record
+        except (TypeError, ValueError):
+            statuses.append(_('expected [sensor, timestamp, value]'))
+            candidates.append(None)
+            continue
+
+        if isinstance(sensor_id, bool) or not isinstance(sensor_id, numbers.Integral):
+            statuses.append(_('invalid sensor id'))
+            candidates.append(None)
+            continue
+
+        created_at = parse_timestamp(timestamp)
+        if created_at is None:
+            statuses.append(_('invalid timestamp'))
+            candidates.append(None)
+            continue
+
+        if value is None or isinstance(value, (bool, list, dict)):
+            statuses.append(_('invalid value'))
+            candidates.append(None)
+            continue
+
+        statuses.append(OK)
+        candidates.append((sensor_id, created_at, '%s' % value))
+
+    sensor_ids = set(c[0] for c in candidates if c is not None)
+    known = set(Sensor.objects.filter(pk__in=sensor_ids).values_list('pk', flat=True)) if sensor_ids else set()
+
+    valid = []
+    for i, candidate in enumerate(candidates):
+        if candidate is None:
+            continue
+        if candidate[0] not in known:
+            statuses[i] = _('unknown sensor')
+            continue
+        valid.append(candidate)
+
+    return valid, [u'%s' % status for status in statuses]
+
+
+class InputNormalizer(object):
+    """
+    maps the free text sensor_name / value of Input rows to the sensor id
+    and a numeric value. names resolve to the sensor of the same origin (a
+    hub holds one sensor of a name per node) and are cached - renaming or
+    deleting a sensor clears the cache (see sensor_changed). names without
+    a sensor aren't cached, so a sensor created later is found.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sensor_ids = {}
+
+    def clear(self):
+        with self._lock:
+            self._sensor_ids.clear()
+
+    def sensor_ids(self, keys):
+        """
+        {(origin, name): sensor id} of the given keys, one query for the
+        names not cached yet.
+        """
+        with self._lock:
+            missing = set(keys) - set(self._sensor_ids)
+        if missing:
+            found = {}
+            rows = Sensor.objects.filter(
+                origin__in=set(origin for origin, name in missing), name__in=set(name for origin, name in missing),
+            ).order_by('-pk').values_list('origin', 'name', 'pk')
+            for origin, name, pk in rows:
+                # the oldest sensor of a name wins
+                found[(origin, name)] = pk
+            with self._lock:
+                self._sensor_ids.update(found)
+        with self._lock:
+            return dict((key, self._sensor_ids[key]) for key in keys if key in self._sensor_ids)
+
+    def normalize(self, inputs):
+        """
+        sets sensor_id, value_number and normalized of (unsaved) Input
+        instances, returns them.
+        """
+        sensor_ids = self.sensor_ids(set((i.origin, i.sensor_name) for i in inputs))
+        for i in inputs:
+            i.sensor_id = sensor_ids.get((i.origin, i.sensor_name))
+            i.value_number = to_number(i.value)
+            i.normalized = True
+        return inputs
+
+    def backfill(self, chunk_size=1000, max_chunks=None):
+        """
+        normalizes the stored rows which aren't yet, chunk_size rows per
+        transaction. an interrupted backfill carries on where it stopped -
+        the normalized flag is the checkpoint. returns the number of rows
+        normalized.
+        """
+        db = router.db_for_write(Input)
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s = %%s, %s = %%s, %s = %%s WHERE %s = %%s' % (
+            quote(Input._meta.db_table), quote('sensor_id'), quote('value_number'), quote('normalized'), quote('id'),
+        )
+
+        done = chunks = 0
+        last_id = 0
+        while max_chunks is None or chunks < max_chunks:
+            rows = list(Input.objects.using(db).filter(normalized=False, id__gt=last_id).order_by('id').values_list(
+                'id', 'origin', 'sensor_name', 'value',
+            )[:chunk_size])
+            if not rows:
+                break
+            sensor_ids = self.sensor_ids(set((origin, name) for pk, origin, name, value in rows))
+            with transaction.atomic(using=db), connection.cursor() as cursor:
+                cursor.executemany(sql, [
+                    (sensor_ids.get((origin, name)), to_number(value), True, pk) for pk, origin, name, value in rows
+                ])
+            done += len(rows)
+            chunks += 1
+            last_id = rows[-1][0]
+        return done
+
+
+input_normalizer = InputNormalizer()
+
+
+def sensor_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Sensor post_save / post_delete receiver - a new sensor doesn't change
+    the cached names (the oldest sensor of a name wins) and neither does
+    moving its current_reading forward.
+    """
+    if created or (update_fields is not None and not set(update_fields) & set(['name', 'origin'])):
+        return
+    input_normalizer.clear()
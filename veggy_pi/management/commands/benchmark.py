@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+
+
+from veggy_pi.benchmarks import SUITES, compare, test_database
+
+
+class Command(BaseCommand):
+    help = (
+        'runs veggy_pi benchmark suites against a throwaway test database and '
+        'prints the results as JSON, optionally compared to a saved baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', choices=sorted(SUITES), default=['hotpaths'])
+        # synthetic dataset size
+        parser.add_argument('--depth', type=int, default=4, help='configuration chain depth')
+        parser.add_argument('--options', type=int, default=10, help='configuration options per config')
+        parser.add_argument('--conditions', type=int, default=10, help='conditions per condition group')
+        parser.add_argument('--sensors', type=int, default=4)
+        parser.add_argument('--readings', type=int, default=10000)
+        parser.add_argument('--iterations', type=int, default=200, help='calls per measured hot path')
+        # serializers / ingest suites
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+        # baseline handling
+        parser.add_argument('--baseline', help='compare against the JSON results in this file')
+        parser.add_argument('--save-baseline', help='write the results to this file')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='slow down (fraction) reported as a regression, default 0.1')
+
+    def handle(self, *args, **options):
+        results = {}
+        with test_database():
+            for suite in options['suites']:
+                results[suite] = SUITES[suite](**options)
+
+        output = {'results': results}
+        regressed = False
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f).get('results', {})
+            changes, regressed = compare(results, baseline, options['tolerance'])
+            output['comparison'] = [
+                {'name': name, 'baseline': old, 'current': new, 'change': change}
+                for name, old, new, change in changes
+            ]
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'results': results}, f, indent=2, sort_keys=True)
+
+        self.stdout.write(json.dumps(output, indent=2, sort_keys=True))
+        if regressed:
+            raise CommandError('performance regressed by more than %s%%' % (options['tolerance'] * 100))
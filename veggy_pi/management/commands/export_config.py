@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+
+from veggy_pi import config_io
+
+
+class Command(BaseCommand):
+    help = 'exports configurations (and their parents), options and condition groups as yaml (see veggy_pi.config_io)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('labels', nargs='*', help='the configurations to export, default all of them')
+        parser.add_argument('--output', help='write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        document = config_io.export_configuration(options['labels'] or None)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                config_io.dump(document, output)
+        else:
+            self.stdout.write(config_io.dump(document))
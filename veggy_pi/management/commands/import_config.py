@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+from veggy_pi import config_io
+
+
+class Command(BaseCommand):
+    help = (
+        'imports configurations, options and condition groups from yaml in one transaction '
+        '(see veggy_pi.config_io) - nothing is written unless the whole file is valid'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--dry-run', action='store_true', help='check and apply, then roll back')
+
+    def handle(self, *args, **options):
+        with open(options['path']) as stream:
+            try:
+                counts = config_io.import_configuration(config_io.load(stream), options['dry_run'])
+            except config_io.ConfigImportError as ex:
+                raise CommandError('\n'.join('%s' % error for error in ex.errors))
+
+        self.stdout.write(', '.join('%s %s' % (counts[key], key) for key in (
+            'options', 'configurations', 'values', 'condition_groups', 'conditions',
+        )) + (' (dry run, rolled back)' if options['dry_run'] else ''))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from django.utils.six.moves.urllib.request import urlopen
+import os
+
+
+from veggy_pi.metrics import REGISTRY
+
+
+class Command(BaseCommand):
+    help = (
+        'prints a snapshot of the veggy_pi metrics in the prometheus text format - '
+        'scraped from a running server (--url), read from the controller textfile '
+        '(VEGGY_PI_METRICS_TEXTFILE) or, failing both, the metrics of this process'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='i.e. http://localhost:8000/metrics')
+        parser.add_argument('--file', default=settings.VEGGY_PI_METRICS_TEXTFILE,
+                            help='prometheus textfile written by the controller')
+        parser.add_argument('--output', help='write the snapshot to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            try:
+                snapshot = urlopen(options['url'], timeout=10).read().decode('utf-8')
+            except IOError as ex:
+                raise CommandError('could not fetch %s: %s' % (options['url'], ex))
+        elif options['file'] and os.path.exists(options['file']):
+            with open(options['file']) as f:
+                snapshot = f.read()
+        else:
+            snapshot = REGISTRY.render()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(snapshot)
+        else:
+            self.stdout.write(snapshot, ending='')
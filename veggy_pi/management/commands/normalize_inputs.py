@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+
+from veggy_pi.ingest import input_normalizer
+
+
+class Command(BaseCommand):
+    help = (
+        'backfills the sensor and numeric value of the Input rows stored before they were '
+        'normalized on write - safe to interrupt and rerun, it carries on where it stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='rows per transaction, default 1000')
+        parser.add_argument('--max-chunks', type=int, help='stop after this many chunks')
+
+    def handle(self, *args, **options):
+        done = input_normalizer.backfill(options['chunk_size'], options['max_chunks'])
+        self.stdout.write('%s inputs normalized' % done)
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+import datetime
+
+
+from veggy_pi import partitions
+from veggy_pi.models import Reading
+
+
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise CommandError('expected a month as YYYY-MM, got %r' % value)
+
+
+class Command(BaseCommand):
+    help = (
+        'manages the monthly reading history partitions (see veggy_pi.partitions): '
+        'list, archive YYYY-MM, rollover, readonly / writable YYYY-MM, drop YYYY-MM. '
+        'archived months are only seen by the compliance checks and the simulator - '
+        'the REST reading history and sensor aggregates only cover the default database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'archive', 'rollover', 'readonly', 'writable', 'drop'])
+        parser.add_argument('month', nargs='?', help='YYYY-MM')
+        parser.add_argument('--keep-months', type=int, default=1,
+                            help='rollover: closed months kept in the default database, default 1')
+        parser.add_argument('--archive-to', help='drop: move the file into this directory instead of deleting it')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            for month in partitions.months():
+                alias = partitions.alias_for(month)
+                self.stdout.write('%s %s %s readings' % (
+                    month.strftime('%Y-%m'), partitions.path_for(month), Reading.objects.using(alias).count(),
+                ))
+            return
+
+        if action == 'rollover':
+            self.rollover(options['keep_months'])
+            return
+
+        if not options['month']:
+            raise CommandError('%s needs a month' % action)
+        month = parse_month(options['month'])
+
+        if action == 'archive':
+            try:
+                moved = partitions.archive_month(month)
+            except ValueError as ex:
+                raise CommandError('%s' % ex)
+            self.stdout.write('%s: %s readings archived' % (options['month'], moved))
+        elif action in ('readonly', 'writable'):
+            partitions.set_readonly(month, action == 'readonly')
+        elif action == 'drop':
+            partitions.drop_month(month, options['archive_to'])
+
+    def rollover(self, keep_months):
+        """
+        archives every month in the default database older than the current
+        month and the `keep_months` before it.
+        """
+        oldest = Reading.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None:
+            return
+        cutoff = partitions.month_start(timezone.now())
+        for i in range(keep_months):
+            cutoff = partitions.month_start(cutoff - datetime.timedelta(days=1))
+
+        month = partitions.month_start(oldest)
+        while month < cutoff:
+            end = partitions.next_month(month)
+            if Reading.objects.filter(created_at__gte=month, created_at__lt=end).exists():
+                moved = partitions.archive_month(month)
+                self.stdout.write('%s: %s readings archived' % (month.strftime('%Y-%m'), moved))
+            month = end
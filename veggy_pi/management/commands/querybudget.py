@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+
+
+from veggy_pi.benchmarks import test_database
+from veggy_pi.querybudget import HOT_PATHS, SIZES, check, violations
+
+
+class Command(BaseCommand):
+    help = (
+        'measures the queries issued by the veggy_pi hot paths over growing synthetic data '
+        'against a throwaway test database and fails if one is over its budget (see veggy_pi.querybudget)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', choices=list(HOT_PATHS), default=[])
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='synthetic data sizes')
+
+    def handle(self, *args, **options):
+        with test_database():
+            report = check(options['paths'] or None, options['sizes'])
+        self.stdout.write(json.dumps(report, indent=2))
+        messages = violations(report)
+        if messages:
+            raise CommandError('\n'.join(messages))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+
+from veggy_pi.actuators import ActuatorQueue, GPIOWriter
+from veggy_pi.controller import Controller
+from veggy_pi.profiling import install_signal_handler
+
+
+class Command(BaseCommand):
+    help = (
+        'runs the control loop - start it with the slim controller settings: '
+        'DJANGO_SETTINGS_MODULE=www.settings_controller ./manage.py run_controller. '
+        'send SIGUSR2 to profile it (see veggy_pi.profiling)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='seconds between ticks, default VEGGY_PI_CONTROLLER_INTERVAL')
+        parser.add_argument('--ticks', type=int, help='stop after this many ticks')
+        parser.add_argument('--dry-run', action='store_true', help='log the pin writes instead of driving the gpio')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            actuators = ActuatorQueue(writer=self.log_write)
+        else:
+            # the pins are set up on their first write
+            actuators = ActuatorQueue(writer=GPIOWriter())
+        controller = Controller(actuators=actuators)
+
+        install_signal_handler()
+        try:
+            controller.run(options['interval'], options['ticks'])
+        except KeyboardInterrupt:
+            pass
+
+    def log_write(self, pin, state):
+        self.stdout.write('pin %s -> %s' % (pin.pin_number, 'HIGH' if state else 'LOW'))
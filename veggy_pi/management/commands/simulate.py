@@ -0,0 +1,55 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.utils import timezone
+
+import datetime
+import json
+
+
+from veggy_pi.ingest import parse_timestamp
+from veggy_pi.models import ConditionGroup
+from veggy_pi.simulator import Replay
+
+
+class Command(BaseCommand):
+    help = (
+        'replays recorded sensor history through the control loop and reports the '
+        'switch counts and duty cycles of the outputs (see veggy_pi.simulator). '
+        'rules loaded with --rules are rolled back afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='iso 8601 start of the replay, default 24 hours before --end')
+        parser.add_argument('--end', help='iso 8601 end of the replay, default now')
+        parser.add_argument('--interval', type=float, help='seconds between ticks, default VEGGY_PI_CONTROLLER_INTERVAL')
+        parser.add_argument('--rules', action='append', default=[],
+                            help='fixture with the condition groups / conditions to try, may be repeated')
+        parser.add_argument('--min-on', type=float)
+        parser.add_argument('--min-off', type=float)
+        parser.add_argument('--max-switches', type=int)
+
+    def handle(self, *args, **options):
+        end = self.parse(options['end']) if options['end'] else timezone.now()
+        start = self.parse(options['start']) if options['start'] else end - datetime.timedelta(days=1)
+        actuator_options = dict(
+            (name, options[name]) for name in ('min_on', 'min_off', 'max_switches') if options[name] is not None
+        )
+
+        with transaction.atomic(using=router.db_for_write(ConditionGroup)):
+            for fixture in options['rules']:
+                call_command('loaddata', fixture, verbosity=0)
+            try:
+                report = Replay(start, end, options['interval'], **actuator_options).run()
+            except ValueError as ex:
+                raise CommandError('%s' % ex)
+            finally:
+                transaction.set_rollback(True, using=router.db_for_write(ConditionGroup))
+
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+    def parse(self, value):
+        timestamp = parse_timestamp(value)
+        if timestamp is None:
+            raise CommandError('expected an iso 8601 datetime, got %r' % value)
+        return timestamp
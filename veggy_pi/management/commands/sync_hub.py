@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import time
+
+
+from veggy_pi.sync import SyncClient, SyncError
+
+
+class Command(BaseCommand):
+    help = (
+        'pushes the readings and inputs of this controller the hub has not '
+        'acknowledged yet (see veggy_pi.sync)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hub', help='sync url of the hub, default VEGGY_PI_SYNC_HUB_URL')
+        parser.add_argument('--node', help='name of this controller, default VEGGY_PI_SYNC_NODE')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--interval', type=float, help='keep syncing every this many seconds')
+        parser.add_argument('--no-resume', action='store_true',
+                            help="trust the local cursors instead of asking the hub what it holds")
+
+    def handle(self, *args, **options):
+        try:
+            client = SyncClient(url=options['hub'], node=options['node'], batch_size=options['batch_size'])
+            if not options['no_resume']:
+                client.resume()
+            while True:
+                sent = client.push()
+                self.stdout.write('%s batches sent, cursors %s' % (sent, client.cursors()))
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except SyncError as ex:
+            raise CommandError('%s' % ex)
+        except KeyboardInterrupt:
+            pass
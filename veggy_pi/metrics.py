@@ -0,0 +1,214 @@
+"""
+in-process instrumentation - counters, gauges and fixed bucket histograms
+rendered in the prometheus text exposition format (see the /metrics view).
+
+metrics live in the memory of the process that records them. the headless
+controller has no http server, so it writes the registry to a prometheus
+textfile (VEGGY_PI_METRICS_TEXTFILE) which node_exporter or the
+metrics_snapshot command can pick up.
+"""
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import os
+import tempfile
+import threading
+import time
+
+
+# seconds - from a fast dict lookup to a slow sqlite write
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *labelvalues):
+        """
+        the child metric for one combination of label values
+        """
+        labelvalues = tuple('%s' % value for value in labelvalues)
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+        try:
+            return self._children[labelvalues]
+        except KeyError:
+            with self._lock:
+                return self._children.setdefault(labelvalues, self._child())
+
+    def __getattr__(self, name):
+        # unlabelled metrics proxy straight to their single child
+        if name.startswith('_') or self.__dict__.get('labelnames', True):
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        for labelvalues, child in sorted(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+
+class _Value(object):
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _child(self):
+        return _Value()
+
+    def _render_child(self, labelvalues, child):
+        yield '%s%s %s' % (self.name, _format_labels(self.labelnames, labelvalues), _format_value(child.value))
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+
+class _Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return _Histogram(self.buckets)
+
+    def _render_child(self, labelvalues, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+            yield '%s_bucket%s %s' % (self.name, labels, cumulative)
+        labels = _format_labels(self.labelnames, labelvalues)
+        yield '%s_sum%s %s' % (self.name, labels, _format_value(child.sum))
+        yield '%s_count%s %s' % (self.name, labels, child.count)
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('duplicate metric %s' % metric.name)
+        self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        atomically (write + rename) dumps the registry to `path`.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+# readings
+READINGS_INGESTED = Counter('veggy_pi_readings_ingested_total', 'readings written to the database')
+INGEST_SECONDS = Histogram('veggy_pi_ingest_seconds', 'time spent writing a reading or a batch of readings')
+
+# rules and configuration
+CONDITION_EVALUATIONS = Counter('veggy_pi_condition_group_evaluations_total', 'condition group evaluations')
+CONDITION_SECONDS = Histogram('veggy_pi_condition_group_evaluate_seconds', 'time to evaluate a condition group')
+CONFIG_RESOLVE_SECONDS = Histogram('veggy_pi_config_resolve_seconds', 'time to resolve the values of a configuration chain')
+
+# control loop and gpio
+TICK_SECONDS = Histogram('veggy_pi_controller_tick_seconds', 'duration of a control loop tick')
+GPIO_WRITES = Counter('veggy_pi_gpio_writes_total', 'pin writes issued by the actuator queue')
+GPIO_SUPPRESSED = Counter('veggy_pi_gpio_writes_suppressed_total', 'pin commands not written', ['reason'])
+
+# http
+HTTP_REQUESTS = Counter('veggy_pi_http_requests_total', 'http requests handled', ['method', 'status'])
+HTTP_SECONDS = Histogram('veggy_pi_http_request_seconds', 'http request duration')
+HTTP_QUERIES = Histogram('veggy_pi_http_request_queries', 'sql queries per http request',
+                         buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200))
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connection
+
+import time
+
+
+from . import metrics
+from . profiling import profiler
+
+
+class MetricsMiddleware(object):
+    """
+    records the count, duration and (optionally) the number of sql queries
+    of every request - keep it first so the whole stack is timed.
+    """
+    def process_request(self, request):
+        request._metrics_started = time.time()
+        if settings.VEGGY_PI_METRICS_COUNT_QUERIES:
+            request._metrics_debug_cursor = connection.force_debug_cursor
+            request._metrics_queries = len(connection.queries_log)
+            connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            return response
+
+        metrics.HTTP_SECONDS.observe(time.time() - started)
+        metrics.HTTP_REQUESTS.labels(request.method, response.status_code).inc()
+
+        if hasattr(request, '_metrics_queries'):
+            metrics.HTTP_QUERIES.observe(len(connection.queries_log) - request._metrics_queries)
+            connection.force_debug_cursor = request._metrics_debug_cursor
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    profiles requests while a profiling session is running (see profiling.py),
+    place it right after MetricsMiddleware.
+    """
+    def process_request(self, request):
+        request._profile_unit = profiler.begin('%s %s' % (request.method, request.path))
+
+    def process_response(self, request, response):
+        profiler.end(getattr(request, '_profile_unit', None))
+        return response
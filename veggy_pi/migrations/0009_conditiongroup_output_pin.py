@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 05:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0008_auto_20261019_0553'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conditiongroup',
+            name='output_pin',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='veggy_pi.RPiPin'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 05:55
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0009_conditiongroup_output_pin'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='reading',
+            index_together=set([('created_at', 'id'), ('sensor', 'created_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 06:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0010_auto_20261019_0555'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='condition',
+            name='rhs_number',
+            field=models.FloatField(default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='condition',
+            name='rhs_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'text'), (2, 'number')], default=None, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+from veggy_pi.funcs import to_number
+
+
+TEXT = 1
+NUMBER = 2
+
+
+def parse_rhs(apps, schema_editor):
+    Condition = apps.get_model('veggy_pi', 'Condition')
+    for condition in Condition.objects.filter(rhs_type=None).only('id', 'rhs').iterator():
+        number = to_number(condition.rhs)
+        Condition.objects.filter(pk=condition.pk).update(
+            rhs_number=number,
+            rhs_type=TEXT if number is None else NUMBER,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0011_auto_20261019_0608'),
+    ]
+
+    operations = [
+        migrations.RunPython(parse_rhs, migrations.RunPython.noop, hints={'model_name': 'condition'}),
+    ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 06:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0012_parse_condition_rhs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hub', models.CharField(max_length=200)),
+                ('kind', models.CharField(max_length=20)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='input',
+            name='origin',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='input',
+            name='origin_id',
+            field=models.BigIntegerField(default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='reading',
+            name='origin',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='reading',
+            name='origin_id',
+            field=models.BigIntegerField(default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='origin',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='origin_id',
+            field=models.BigIntegerField(default=None, editable=False, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='input',
+            unique_together=set([('origin', 'origin_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reading',
+            unique_together=set([('origin', 'origin_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sensor',
+            unique_together=set([('origin', 'origin_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='synccursor',
+            unique_together=set([('hub', 'kind')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 06:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veggy_pi', '0013_auto_20261019_0609'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='input',
+            name='normalized',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='input',
+            name='sensor',
+            field=models.ForeignKey(default=None, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='veggy_pi.Sensor'),
+        ),
+        migrations.AddField(
+            model_name='input',
+            name='value_number',
+            field=models.FloatField(default=None, editable=False, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='input',
+            index_together=set([('sensor', 'created_at'), ('normalized', 'id')]),
+        ),
+    ]
@@ -1,18 +1,27 @@
 from __future__ import unicode_literals
 
-from django.db import models
-from django.utils import timezone
+from django.db import models, connections, transaction
+from django.utils import six, timezone
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
-from django.contrib.contenttypes.fields import GenericForeignKey
-from django.contrib.contenttypes.models import ContentType
 
 
-import bitarray
+from collections import OrderedDict
+from itertools import islice
+import datetime
 import json
+import operator
+import time
 
 
-from . funcs import is_number, all_numbers, is_greater_than, value_in_range, list_val_to_int, shift_bit_list
+from . broker import broker
+from . import metrics
+from . quantiles import P2Quantile
+from . records import ReadingRecord
+from . funcs import (
+    is_number, all_numbers, is_greater_than, value_in_range, list_val_to_int, shift_bit_list, from_timestamp,
+    to_number, NUMBER_TYPES,
+)
 
 
 class VeggyConfiguration(models.Model):
@@ -30,27 +39,50 @@ class VeggyConfiguration(models.Model):
 
     def get_values(self, config_list=[], values=[]):
         """
-        recursively builds and returns a values_list with user input items.
-        you shouldn't overwrite the default arguments - the config_list ensures
-        that there is no infinite recursion and the values list is populated 
-        and returned with the config.userinput_set.values() for each config.
+        builds and returns a values_list with the user input items of the config
+        and its parents. you shouldn't overwrite the default arguments - the
+        config_list ensures that there is no infinite recursion and the values
+        list is populated and returned with the userinput values of each config,
+        the child's first.
         """
-        config_list.append(self.pk)
-        objs = self.userinput_set.values()
-        
+        # only the outermost call of the recursion is timed
+        started = time.time() if not config_list else None
+
+        # the chain follows the parents already loaded on the instances and
+        # the (small) pk -> parent map past them, then the values of every
+        # config in it are fetched at once - two queries whatever its depth
+        cache_name = VeggyConfiguration._meta.get_field('parent_config').get_cache_name()
+        parents = None
+        chain = []
+        config, pk = self, self.pk
+        # prevents infinite recursion by avoiding to re-enter a parent item
+        # which has already been traversed
+        while pk is not None and pk not in config_list:
+            chain.append(pk)
+            config_list.append(pk)
+            if config is not None and hasattr(config, cache_name):
+                config = getattr(config, cache_name)
+                pk = config.pk if config is not None else None
+            elif config is not None:
+                config, pk = None, config.parent_config_id
+            else:
+                if parents is None:
+                    parents = dict(VeggyConfiguration.objects.values_list('pk', 'parent_config_id'))
+                pk = parents.get(pk)
+
+        position = dict((pk, i) for i, pk in enumerate(chain))
+        objs = sorted(
+            UserInput.objects.filter(veggy_config__in=chain).values(),
+            key=lambda obj: (position[obj['veggy_config_id']], obj['id']),
+        )
         for obj in objs:
             if obj in values:
                 pass
             else:
                 values.append(obj)
 
-        # prevents infinite recursion by avoiding to re-enter a parent item
-        # which has already been traversed
-        if self.parent_config and self.parent_config.pk not in config_list:
-            # passing the default values rather the lists passed to the first 
-            # method call results in buggy behaviour - fixed
-            self.parent_config.get_values(config_list, values)
-            
+        if started is not None:
+            metrics.CONFIG_RESOLVE_SECONDS.observe(time.time() - started)
         return values
 
     @staticmethod
@@ -98,24 +130,31 @@ class VeggyConfiguration(models.Model):
         """
         if not values:
             raise ValueError(_(u'empty list'))
+
+        # options missing from the config stay None and are not validated
+        min_temp = max_temp = min_ph = max_ph = min_ec = max_ec = min_rh = max_rh = None
+        temp_range = None
         
+        labels = dict(ConfigurationOption.objects.filter(
+            pk__in=set(elem[u'variable_id'] for elem in values),
+        ).values_list('pk', 'option_label'))
         for elem in values:
-            option = ConfigurationOption.objects.get(pk=elem[u'variable_id'])
-            if option.option_label == u'min_temp':
+            option_label = labels.get(elem[u'variable_id'])
+            if option_label == u'min_temp':
                 min_temp = float(elem[u'value'])
-            elif option.option_label == u'max_temp':
+            elif option_label == u'max_temp':
                 max_temp = float(elem[u'value']) 
-            elif option.option_label == u'max_ph':
+            elif option_label == u'min_ph':
                 min_ph = float(elem[u'value'])
-            elif option.option_label == u'min_ph':
+            elif option_label == u'max_ph':
                 max_ph = float(elem[u'value'])
-            elif option.option_label == u'min_ec':
+            elif option_label == u'min_ec':
                 min_ec = float(elem[u'value'])
-            elif option.option_label == u'min_rh':
+            elif option_label == u'min_rh':
                 min_rh = int(elem[u'value'])
-            elif option.option_label == u'max_rh':
+            elif option_label == u'max_rh':
                 max_rh = int(elem[u'value'])
-            elif option.option_label == u'temp_format':
+            elif option_label == u'temp_format':
                 temp_format = elem[u'value']
                 # temperature format field which will define which conversion
                 # type should be used i.e. celcius -> farenheit and the max_range
@@ -132,12 +171,9 @@ class VeggyConfiguration(models.Model):
         # user input validation
         # temperatur
         if min_temp or max_temp:
-            try:
-                if not temp_range:
-                    pass
-            # variable would be unbound if temp input items end up
-            # in a config without a temperature format type therefore no range.
-            except UnboundLocalError:
+            # temp input items in a config without a temperature format type
+            # have no range to be validated against.
+            if temp_range is None:
                 raise ValueError(_(u'temp_input elements require a temperature format type'))
 
             if min_temp:
@@ -202,12 +238,43 @@ class VeggyModel(models.Model):
     this is the shared base class for our models, it just provides
     some common fields and a "state"
     """
-    created_at = models.DateTimeField(auto_now_add=True)
+    # a default rather than auto_now_add so bulk inserted rows (i.e. batches
+    # from the celery ingest tasks) keep the time they were actually read at
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    class Meta:
+        abstract = True
+
+
+class SyncedModel(models.Model):
+    """
+    rows a hub received from a controller (see sync.py) keep the node they
+    came from and their id there, which is what duplicates are detected by.
+    local rows have neither.
+    """
+    origin = models.CharField(max_length=64, blank=True, default='', editable=False)
+    origin_id = models.BigIntegerField(null=True, default=None, editable=False)
     class Meta:
         abstract = True
 
 
-class Input(VeggyModel):
+class SyncCursor(models.Model):
+    """
+    high-water mark of the local rows of one kind (readings, inputs) a hub
+    has acknowledged - the next batch starts after last_id.
+    """
+    hub = models.CharField(max_length=200)
+    kind = models.CharField(max_length=20)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('hub', 'kind')
+
+    def __unicode__(self):
+        return "%s %s: %s" % (self.hub, self.kind, self.last_id)
+
+
+class Input(VeggyModel, SyncedModel):
     """
     Everything that was read in by all of the sensors
     """
@@ -217,23 +284,317 @@ class Input(VeggyModel):
     sensor_name = models.TextField()
     value = models.TextField()
 
+    # normalized on write (see ingest.InputNormalizer) - the sensor the name
+    # resolves to and the value as a number, None if it isn't one
+    sensor = models.ForeignKey("Sensor", null=True, default=None, editable=False, on_delete=models.SET_NULL)
+    value_number = models.FloatField(null=True, default=None, editable=False)
+    normalized = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        unique_together = ('origin', 'origin_id')
+        index_together = [
+            ('sensor', 'created_at'),
+            # the backfill seeks the rows still to normalize
+            ('normalized', 'id'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # on every save - an edited value or sensor_name must not leave
+        # value_number / sensor behind, and the lookup is cached
+        from . ingest import input_normalizer
+        input_normalizer.normalize([self])
+        super(Input, self).save(*args, **kwargs)
+
+
+class AsFloat(models.Func):
+    """
+    casts a text column (i.e. Reading.data) to a float on the database side
+    so it can be aggregated without pulling the rows into python.
+    """
+    template = 'CAST(%(expressions)s AS REAL)'
+
+    def __init__(self, expression, **extra):
+        super(AsFloat, self).__init__(expression, output_field=models.FloatField(), **extra)
+
+
+class TimeBucket(models.Func):
+    """
+    the start of the `interval` seconds long bucket a datetime column falls
+    into, as an epoch timestamp - computed by the database so grouping by
+    time windows happens in SQL.
+    """
+    template = '(FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / %(interval)d) * %(interval)d)'
+
+    def __init__(self, expression, interval, **extra):
+        super(TimeBucket, self).__init__(expression, interval=int(interval), output_field=models.IntegerField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        # '%%%%s' comes out of the template and the backend's placeholder
+        # handling as strftime's '%s' (seconds since the epoch)
+        return self.as_sql(compiler, connection, template=(
+            "(CAST(strftime('%%%%s', %(expressions)s) AS INTEGER) / %(interval)d * %(interval)d)"
+        ))
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection, template=(
+            '(FLOOR(UNIX_TIMESTAMP(%(expressions)s) / %(interval)d) * %(interval)d)'
+        ))
+
+
+class IsNumber(models.Func):
+    """
+    whether a text column (i.e. Reading.data) holds a number - AsFloat casts
+    anything else ('on', 'ok') to 0.
+    """
+    template = "(%(expressions)s ~ '^\\s*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)([eE][-+]?[0-9]+)?\\s*$')"
+
+    def __init__(self, expression, **extra):
+        super(IsNumber, self).__init__(expression, output_field=models.BooleanField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        # a digit and nothing but the characters of a float
+        return self.as_sql(compiler, connection, template=(
+            "(%(expressions)s GLOB '*[0-9]*' AND %(expressions)s NOT GLOB '*[^0-9.eE+ -]*')"
+        ))
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection, template=(
+            "(%(expressions)s REGEXP '^[[:space:]]*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)([eE][-+]?[0-9]+)?[[:space:]]*$')"
+        ))
+
+
+class NextReading(models.Func):
+    """
+    the epoch timestamp of the next reading of the same sensor, in
+    (created_at, id) order, or NULL for the last one - a correlated subquery
+    seeking on the (sensor, created_at, id) index, so every reading knows
+    until when it holds without pairing up the rows in python.
+    """
+    template = (
+        # the >= is a range the index can seek to, the OR alone isn't
+        '(SELECT %(epoch)s FROM %(db_table)s next_reading WHERE next_reading.sensor_id = %(table)s.sensor_id '
+        'AND next_reading.created_at >= %(table)s.created_at AND (next_reading.created_at > %(table)s.created_at '
+        'OR next_reading.id > %(table)s.id) ORDER BY next_reading.created_at, next_reading.id LIMIT 1)'
+    )
+
+    def __init__(self, **extra):
+        super(NextReading, self).__init__(output_field=models.IntegerField(), **extra)
+
+    def as_sql(self, compiler, connection, epoch='CAST(EXTRACT(EPOCH FROM next_reading.created_at) AS INTEGER)'):
+        self.extra['db_table'] = connection.ops.quote_name(Reading._meta.db_table)
+        self.extra['table'] = compiler.quote_name_unless_alias(compiler.query.get_initial_alias())
+        self.extra['epoch'] = epoch
+        return super(NextReading, self).as_sql(compiler, connection)
+
+    def as_sqlite(self, compiler, connection):
+        # the backend's placeholder handling turns '%%s' into strftime's '%s'
+        return self.as_sql(compiler, connection, epoch="CAST(strftime('%%s', next_reading.created_at) AS INTEGER)")
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection, epoch='UNIX_TIMESTAMP(next_reading.created_at)')
+
+
+class ReadingQuerySet(models.QuerySet):
+    # aggregates computed by the database, anything matching pNN (i.e. p95)
+    # is a percentile estimated while streaming the rows
+    SQL_AGGREGATES = {
+        'min': models.Min,
+        'max': models.Max,
+        'avg': models.Avg,
+        'sum': models.Sum,
+        'count': models.Count,
+    }
+
+    def bucketed(self, interval):
+        """
+        annotates every reading with the epoch start of its time bucket
+        """
+        if int(interval) <= 0:
+            raise ValueError(_('interval must be a positive number of seconds'))
+        return self.annotate(bucket=TimeBucket('created_at', interval))
+
+    def window_aggregate(self, interval, funcs=('min', 'max', 'avg', 'count')):
+        """
+        aggregates the (numeric) data of the readings in the queryset per
+        sensor and `interval` seconds long bucket, i.e.
+
+            Reading.objects.filter(sensor=s, created_at__gte=start).window_aggregate(3600, ('avg', 'p95'))
+
+        min / max / avg / sum / count are a single GROUP BY query, percentiles
+        (pNN) aren't available in SQLite and are estimated with a P-square
+        sketch per bucket while streaming the rows in bucket order. returns a
+        list of dicts with sensor, bucket (an aware datetime) and one key per
+        requested function, ordered by sensor and bucket.
+        """
+        sql_funcs = []
+        percentiles = []
+        for func in funcs:
+            if func in self.SQL_AGGREGATES:
+                sql_funcs.append(func)
+            elif func.startswith('p') and func[1:].isdigit() and 0 < int(func[1:]) < 100:
+                percentiles.append(func)
+            else:
+                raise ValueError(_('unknown aggregate: %s') % func)
+
+        buckets = OrderedDict()
+        queryset = self.bucketed(interval).order_by()
+
+        if sql_funcs or not percentiles:
+            aggregates = dict(
+                (func, self.SQL_AGGREGATES[func]('id' if func == 'count' else AsFloat('data')))
+                for func in sql_funcs or ['count']
+            )
+            rows = queryset.values('sensor_id', 'bucket').annotate(**aggregates).order_by('sensor_id', 'bucket')
+            for row in rows:
+                key = (row['sensor_id'], row['bucket'])
+                buckets[key] = dict((func, row[func]) for func in sql_funcs)
+
+        if percentiles:
+            rows = queryset.annotate(value=AsFloat('data')).order_by('sensor_id', 'bucket').values_list(
+                'sensor_id', 'bucket', 'value',
+            )
+            key, sketches = None, None
+            for sensor_id, bucket, value in rows.iterator():
+                if (sensor_id, bucket) != key:
+                    if key is not None:
+                        buckets.setdefault(key, {}).update((p, s.value) for p, s in sketches.items())
+                    key = (sensor_id, bucket)
+                    sketches = dict((p, P2Quantile(int(p[1:]) / 100.0)) for p in percentiles)
+                for sketch in sketches.values():
+                    sketch.add(value)
+            if key is not None:
+                buckets.setdefault(key, {}).update((p, s.value) for p, s in sketches.items())
+
+        results = []
+        for (sensor_id, bucket), values in sorted(buckets.items()):
+            values.update(sensor=sensor_id, bucket=from_timestamp(bucket))
+            results.append(values)
+        return results
+
+    def bulk_ingest(self, records, batch_size=500):
+        """
+        writes a batch of (sensor_id, created_at, data) records (tuples,
+        ReadingRecords or a ReadingBatch) with bulk inserts and then moves the
+        current_reading of every sensor in the batch forward with one UPDATE,
+        rather than the two queries per reading Reading.save() costs.
+        created_at may be a datetime or an epoch timestamp. Reading instances
+        are only built `batch_size` at a time, right before their insert.
+        returns the number of readings written.
+        """
+        started = time.time()
+        sensor_ids = set()
+        published = [] if broker.subscribed else None
+        count = 0
+
+        records = iter(records)
+        with transaction.atomic(using=self.db, savepoint=False):
+            while True:
+                readings = []
+                for sensor_id, created_at, data in islice(records, batch_size):
+                    if not isinstance(created_at, datetime.datetime):
+                        created_at = from_timestamp(created_at)
+                    readings.append(Reading(sensor_id=sensor_id, created_at=created_at, data=data))
+                    sensor_ids.add(sensor_id)
+                    if published is not None:
+                        published.append(ReadingRecord(sensor_id, created_at, data))
+                if not readings:
+                    break
+                self.model.objects.using(self.db).bulk_create(readings)
+                count += len(readings)
+
+            if not count:
+                return 0
+            self.update_current_readings(sensor_ids)
+
+        metrics.READINGS_INGESTED.inc(count)
+        metrics.INGEST_SECONDS.observe(time.time() - started)
+
+        for record in published or ():
+            broker.publish_reading(*record)
+        return count
+
+    def update_current_readings(self, sensor_ids):
+        """
+        points the current_reading of each of the given sensors at its newest
+        reading using a single correlated UPDATE.
+        """
+        sensor_ids = list(sensor_ids)
+        if not sensor_ids:
+            return
+
+        reading_table = self.model._meta.db_table
+        sensor_table = Sensor._meta.db_table
+        sql = (
+            'UPDATE {sensor} SET current_reading_id = ('
+            'SELECT r.id FROM {reading} r WHERE r.sensor_id = {sensor}.id '
+            'ORDER BY r.created_at DESC, r.id DESC LIMIT 1'
+            ') WHERE id IN ({params})'
+        ).format(sensor=sensor_table, reading=reading_table, params=', '.join(['%s'] * len(sensor_ids)))
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, sensor_ids)
 
-class Reading(VeggyModel):
+
+class Reading(VeggyModel, SyncedModel):
     sensor = models.ForeignKey("Sensor", null=False)
     data = models.TextField()
 
+    objects = ReadingQuerySet.as_manager()
+
+    class Meta:
+        # keyset pagination / history queries seek on (created_at, id),
+        # optionally for a single sensor
+        index_together = [
+            ('created_at', 'id'),
+            ('sensor', 'created_at', 'id'),
+        ]
+        unique_together = ('origin', 'origin_id')
+
     def save(self, *args, **kwargs):
         """
         when a Reading is saved it updates the current_reading
         of the related sensor to `self`.
         """
+        started = time.time()
         super(Reading, self).save(*args, **kwargs)
-        self.sensor.current_reading = self
-        self.sensor.save()
+        # one UPDATE, without loading the sensor when only sensor_id is set
+        Sensor.objects.filter(pk=self.sensor_id).update(current_reading=self)
+        if hasattr(self, Reading._meta.get_field('sensor').get_cache_name()):
+            self.sensor.current_reading = self
+        metrics.READINGS_INGESTED.inc()
+        metrics.INGEST_SECONDS.observe(time.time() - started)
+        broker.publish_reading(self.sensor_id, self.created_at, self.data)
     def __unicode__(self):
         return "%s: %s - %s" % (self.created_at, self.sensor.name, self.data)
 
 
+class ReadingRollup(models.Model):
+    """
+    pre-aggregated readings of a sensor over a fixed period (i.e. hourly),
+    kept up to date by the update_rollups task so charts and retention
+    don't have to scan the raw Reading table.
+    """
+    sensor = models.ForeignKey("Sensor")
+    period = models.PositiveIntegerField()
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0)
+    minimum = models.FloatField(null=True)
+    maximum = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('sensor', 'period', 'bucket_start')
+
+    @property
+    def average(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def __unicode__(self):
+        return "%s: %s (%ss)" % (self.bucket_start, self.sensor_id, self.period)
+
+
 class Pin(models.Model):
     """
     pin mappings class - built and tested on RPi (fixtures available) but generic 
@@ -294,7 +655,7 @@ class RPiPin(Pin):
             GPIO.output(self.pin_number, GPIO.LOW)
 
 
-class Sensor(models.Model):
+class Sensor(SyncedModel):
     """
     generic sensor class - this class is proxied with actual physical sensors which define
     their own read method for each physical sensor. 
@@ -303,6 +664,9 @@ class Sensor(models.Model):
     current_reading = models.ForeignKey("Reading", null=True, default=None, related_name="latest_sensor")
     pin = models.ForeignKey("Pin", null=True)
 
+    class Meta:
+        unique_together = ('origin', 'origin_id')
+
     def plug_into(self, pin_numbers):
         self.unplug() # remove any existing connection first
         for pin_number in pin_numbers:
@@ -353,17 +717,49 @@ class Operator(object):
     LTE = 9
     
 
+COMPARE = {
+    Operator.EQUALS: operator.eq,
+    Operator.NOT_EQUALS: operator.ne,
+    Operator.GT: operator.gt,
+    Operator.LT: operator.lt,
+    Operator.GTE: operator.ge,
+    Operator.LTE: operator.le,
+}
+
+
+class OperandType(object):
+    """
+    how the right hand side of a Condition is compared - set on save.
+    """
+    TEXT = 1
+    NUMBER = 2
+
+
 class SensorState(dict):
     """
     this is an extended dict which catches call to key lookups ( my_dict['xxx'] )
     and can delegate them to do "calculated values".
+    numeric strings (i.e. raw reading data) are stored as floats, so
+    conditions compare native numbers without parsing on every evaluation.
     """
     def __init__(self, *args, **kwargs):
-        if 'senors' in kwargs:
+        if 'sensors' in kwargs:
             self._sensors = kwargs.pop('sensors')
         else:
             self._sensors = {}
-        super(SensorState, self).__init__(*args, **kwargs)
+        super(SensorState, self).__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, six.string_types):
+            number = to_number(value)
+            if number is not None:
+                value = number
+        super(SensorState, self).__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
 
     def __getitem__(self, key):
         try:
@@ -381,6 +777,9 @@ class ConditionGroup(VeggyModel):
         (Operator.AND, 'AND'),
         (Operator.OR, 'OR'),
     ))
+    # the relay / output driven by this group - set HIGH while the group
+    # evaluates to True and LOW otherwise
+    output_pin = models.ForeignKey("RPiPin", null=True, default=None, on_delete=models.SET_NULL)
 
     def evaluate(self, sensor_state):
         """
@@ -388,6 +787,11 @@ class ConditionGroup(VeggyModel):
         of self to determine the groups overall value.
         expects a dict (like) sensor_state (see SensorState)
         """
+        metrics.CONDITION_EVALUATIONS.inc()
+        with metrics.CONDITION_SECONDS.time():
+            return self._evaluate(sensor_state)
+
+    def _evaluate(self, sensor_state):
         if self.operator == Operator.AND:
             for c in self.condition_set.all():
                 if not c.evaluate(sensor_state):
@@ -420,29 +824,43 @@ class Condition(VeggyModel):
         (Operator.LTE, '<='),
     ))
 
+    # the parsed rhs, see parse_rhs()
+    rhs_number = models.FloatField(null=True, default=None, editable=False)
+    rhs_type = models.PositiveSmallIntegerField(null=True, default=None, editable=False, choices=(
+        (OperandType.TEXT, 'text'),
+        (OperandType.NUMBER, 'number'),
+    ))
+
+    def parse_rhs(self):
+        number = to_number(self.rhs)
+        self.rhs_number = number
+        self.rhs_type = OperandType.TEXT if number is None else OperandType.NUMBER
+
+    def save(self, *args, **kwargs):
+        self.parse_rhs()
+        super(Condition, self).save(*args, **kwargs)
+
     def evaluate(self, sensor_state):
         """
         expects a dict (like) sensor_state (see SensorState)
         """
+        if self.rhs_type is None:
+            # unsaved or bulk created
+            self.parse_rhs()
+
         lhs_val = sensor_state[self.lhs]
         rhs_val = self.rhs
 
-        if all_numbers(lhs_val, rhs_val):
-            lhs_val = float(lhs_val)
-            rhs_val = float(rhs_val)
-
-        _funcs = {
-            Operator.EQUALS: lambda l,r: l == r,
-            Operator.NOT_EQUALS: lambda l,r: l != r,
-            Operator.GT: lambda l,r: l > r,
-            Operator.LT: lambda l,r: l < r,
-            Operator.GTE: lambda l,r: l >= r,
-            Operator.LTE: lambda l,r: l <= r,
-        }
-
-        func = _funcs[self.operator]
+        if self.rhs_type == OperandType.NUMBER:
+            if isinstance(lhs_val, NUMBER_TYPES):
+                rhs_val = self.rhs_number
+            elif isinstance(lhs_val, six.string_types):
+                # a plain dict - SensorState converts numeric strings up front
+                number = to_number(lhs_val)
+                if number is not None:
+                    lhs_val, rhs_val = number, self.rhs_number
 
-        return func(lhs_val, rhs_val)
+        return COMPARE[self.operator](lhs_val, rhs_val)
 
     def __unicode__(self):
         return u"%s [[operator code %s]] %s" % (self.lhs, self.operator, self.rhs)
@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import json
+
+
+class KeysetPagination(BasePagination):
+    """
+    keyset (seek) pagination, newest first.
+
+    rather than an OFFSET and a COUNT(*) each page is a single query seeking
+    past the last row of the previous page on the `keyset` columns, i.e.
+    WHERE (created_at, id) < (last_created_at, last_id) ORDER BY created_at
+    DESC, id DESC LIMIT page_size - with a matching index the cost of a page
+    is the same no matter how deep the client pages.
+    """
+    keyset = ('created_at', 'id')
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        # set for values_list() querysets whose rows are plain tuples
+        self.row_fields = getattr(queryset, '_fields', None)
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.seek(self.decode_cursor(cursor)))
+
+        queryset = queryset.order_by(*['-%s' % field for field in self.keyset])
+        rows = list(queryset[:self.page_size + 1])
+
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        values = self.get_keyset_values(self.page[-1])
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    def get_keyset_values(self, row):
+        if isinstance(row, tuple):
+            return [row[list(self.row_fields).index(field)] for field in self.keyset]
+        return [getattr(row, field) for field in self.keyset]
+
+    def seek(self, values):
+        """
+        builds the row value comparison (keyset) < (values) - expanded as
+        k1 <= v1 AND (k1 < v1 OR (k1 = v1 AND k2 < v2) ...) so the leading
+        range term can use the index on backends without row values.
+        """
+        keyset = list(zip(self.keyset, values))
+        condition = Q()
+        for i, (field, value) in enumerate(keyset):
+            term = Q(**{'%s__lt' % field: value})
+            for prev_field, prev_value in keyset[:i]:
+                term &= Q(**{prev_field: prev_value})
+            condition |= term
+
+        first_field, first_value = keyset[0]
+        return Q(**{'%s__lte' % first_field: first_value}) & condition
+
+    def encode_cursor(self, values):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if len(values) != len(self.keyset):
+                raise ValueError(cursor)
+            return [self.model._meta.get_field(field).to_python(value)
+                    for field, value in zip(self.keyset, values)]
+        except Exception:
+            raise NotFound(_('invalid cursor'))
+
+
+def estimated_count(queryset):
+    """
+    a cheap estimate of the number of rows of an unfiltered queryset - the
+    planner statistics on postgresql / mysql, the id span of the (append
+    only) table elsewhere. all of them are index or catalog lookups, no
+    table scan.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor in ('postgresql', 'mysql'):
+        if connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+        else:
+            sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        return int(row[0] or 0) if row else 0
+
+    span = queryset.model._default_manager.using(queryset.db).aggregate(first=Min('pk'), last=Max('pk'))
+    if span['first'] is None:
+        return 0
+    return span['last'] - span['first'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    admin paginator for the big history tables - rather than a COUNT(*) of
+    the whole table on every changelist an unfiltered list uses
+    estimated_count() and a filtered one counts at most count_limit rows.
+    """
+    count_limit = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            queryset = self.object_list
+            if not queryset.query.where:
+                self._count = estimated_count(queryset)
+            else:
+                self._count = queryset.order_by().values('pk')[:self.count_limit].count()
+        return self._count
+    count = property(_get_count)
@@ -0,0 +1,260 @@
+"""
+time partitioned reading history.
+
+the default database (or the timeseries one, see routers.WorkloadRouter)
+keeps the readings of the recent months (the hot partition). archive_month()
+moves a closed month into its own sqlite file,
+VEGGY_PI_PARTITION_DIR/readings-YYYY-MM.sqlite3, which is registered as the
+database alias readings_YYYY_MM. a month file can then be made read-only,
+moved away or dropped as a whole - no DELETE, no VACUUM of the main
+database.
+
+readings keep their id when they are archived, so ids stay unique across
+partitions and current readings (which sensors point at) are never moved.
+
+PartitionedReadings(start, end) is the query layer - it only touches the
+partitions overlapping the time range:
+
+    for created_at, data in PartitionedReadings(start, end).filter(sensor=s).iterator('created_at', 'data'):
+        ...
+
+only the compliance checks and the simulator read through it. the REST
+reading history and the sensor aggregate endpoint only see the hot
+partition - archived months drop out of them, which is why rollover keeps
+the last closed month(s) in the hot partition. the latest readings (and
+their ETag) are unaffected, current readings are never archived.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+import datetime
+import os
+import re
+import shutil
+import stat
+
+
+from . models import Reading, Sensor
+from . routers import PARTITION_PREFIX
+
+
+FILE_PATTERN = re.compile(r'^readings-(\d{4})-(\d{2})\.sqlite3$')
+
+
+def month_start(value):
+    """
+    the first instant (utc) of the month of a date or datetime
+    """
+    return datetime.datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def alias_for(month):
+    return '%s%04d_%02d' % (PARTITION_PREFIX, month.year, month.month)
+
+
+def path_for(month):
+    return os.path.join(settings.VEGGY_PI_PARTITION_DIR, 'readings-%04d-%02d.sqlite3' % (month.year, month.month))
+
+
+def register(month):
+    """
+    adds the database alias of a month partition, returns the alias.
+    """
+    alias = alias_for(month)
+    if alias not in connections.databases:
+        connections.databases[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path_for(month),
+        }
+    return alias
+
+
+def unregister(month):
+    """
+    closes (in this thread) and removes the alias of a month partition.
+    """
+    alias = alias_for(month)
+    if alias in connections.databases:
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+
+def months():
+    """
+    the months with a partition file, oldest first - registering any not
+    yet known to this process.
+    """
+    directory = settings.VEGGY_PI_PARTITION_DIR
+    found = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = FILE_PATTERN.match(name)
+            if match:
+                month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+                register(month)
+                found.append(month)
+    return sorted(found)
+
+
+def aliases_for(start=None, end=None):
+    """
+    the partitions overlapping [start, end), oldest first, followed by the
+    database holding the recent readings.
+    """
+    aliases = []
+    for month in months():
+        if start is not None and next_month(month) <= start:
+            continue
+        if end is not None and month >= end:
+            continue
+        aliases.append(alias_for(month))
+    aliases.append(router.db_for_read(Reading))
+    return aliases
+
+
+def create_partition(month):
+    """
+    creates the partition file with the reading table and its indexes.
+    """
+    directory = settings.VEGGY_PI_PARTITION_DIR
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    alias = register(month)
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+    if Reading._meta.db_table not in tables:
+        with connection.schema_editor() as editor:
+            editor.create_model(Reading)
+    return alias
+
+
+def archive_month(month, chunk_size=5000):
+    """
+    moves the readings of a closed month from the default database into its
+    partition, returns the number of readings copied. rerunning it after an
+    interrupted run is safe - rows already copied are skipped. only rows held
+    by the partition are deleted, so a (backdated) reading of the month
+    written while it runs stays in the default database for the next run.
+    """
+    month = month_start(month)
+    if next_month(month) > month_start(timezone.now()):
+        raise ValueError('only closed months can be archived')
+
+    alias = create_partition(month)
+    current = set(Sensor.objects.exclude(current_reading=None).values_list('current_reading_id', flat=True))
+    readings = Reading.objects.filter(
+        created_at__gte=month, created_at__lt=next_month(month),
+    ).exclude(id__in=current)
+    fields = [f.attname for f in Reading._meta.concrete_fields]
+
+    def held(first_id, last_id):
+        return set(Reading.objects.using(alias).filter(
+            id__gte=first_id, id__lte=last_id,
+        ).values_list('id', flat=True))
+
+    moved = 0
+    last_id = 0
+    with transaction.atomic(using=alias):
+        while True:
+            chunk = list(readings.filter(id__gt=last_id).order_by('id').values_list(*fields)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            # rows copied by an interrupted earlier run
+            copied = held(chunk[0][0], last_id)
+            new_rows = [Reading(**dict(zip(fields, row))) for row in chunk if row[0] not in copied]
+            Reading.objects.using(alias).bulk_create(new_rows)
+            moved += len(new_rows)
+
+    # only once the partition is committed, and only up to the last copied
+    # id - the ids the partition really holds
+    copied_up_to = last_id
+    last_id = 0
+    while True:
+        ids = list(readings.filter(
+            id__gt=last_id, id__lte=copied_up_to,
+        ).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        copied = held(ids[0], ids[-1])
+        Reading.objects.filter(id__in=[pk for pk in ids if pk in copied]).delete()
+        last_id = ids[-1]
+    return moved
+
+
+def set_readonly(month, readonly=True):
+    """
+    write protects (or unprotects) the partition file - sqlite then opens it
+    read-only.
+    """
+    month = month_start(month)
+    unregister(month)
+    mode = os.stat(path_for(month)).st_mode
+    write = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    os.chmod(path_for(month), mode & ~write if readonly else mode | stat.S_IWUSR)
+    register(month)
+
+
+def drop_month(month, archive_to=None):
+    """
+    removes a partition - the file is moved to `archive_to` if given,
+    otherwise deleted.
+    """
+    month = month_start(month)
+    unregister(month)
+    path = path_for(month)
+    if archive_to:
+        if not os.path.isdir(archive_to):
+            os.makedirs(archive_to)
+        shutil.move(path, os.path.join(archive_to, os.path.basename(path)))
+    else:
+        os.remove(path)
+
+
+class PartitionedReadings(object):
+    """
+    readings between start and end (either may be None) across the
+    partitions overlapping that range and the default database.
+    """
+    def __init__(self, start=None, end=None, filters=None):
+        self.start = start
+        self.end = end
+        self.filters = filters or {}
+        self.aliases = aliases_for(start, end)
+
+    def filter(self, **filters):
+        return PartitionedReadings(self.start, self.end, dict(self.filters, **filters))
+
+    def querysets(self):
+        """
+        one queryset per partition, oldest partition first.
+        """
+        bounds = {}
+        if self.start is not None:
+            bounds['created_at__gte'] = self.start
+        if self.end is not None:
+            bounds['created_at__lt'] = self.end
+        return [Reading.objects.using(alias).filter(**dict(bounds, **self.filters)) for alias in self.aliases]
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets())
+
+    def iterator(self, *fields):
+        """
+        values_list() rows of all partitions ordered by (created_at, id) -
+        partitions hold disjoint months, so this is a concatenation.
+        """
+        for queryset in self.querysets():
+            for row in queryset.order_by('created_at', 'id').values_list(*fields).iterator():
+                yield row
@@ -0,0 +1,264 @@
+"""
+on-demand profiling of the control loop and http requests.
+
+profiler.start(seconds) opens a profiling session - until it expires every
+controller tick and request wrapped in profiler.profile(name) runs under
+cProfile with the sql queries it issues recorded. when the session ends the
+merged stats are written to VEGGY_PI_PROFILE_DIR as <label>-<time>.prof
+(load with pstats or snakeviz) next to a <label>-<time>.sql.json summary of
+the queries per tick / request (split per condition group, see mark())
+and the most frequent statements. queries are recorded on every database
+alias, so the readings on a split install (see routers.WorkloadRouter) show
+up too. a session is written by the first unit ending after it expired, or
+at exit.
+
+while no session is active profile() and mark() cost an attribute check.
+sessions are started with SIGUSR2 (see install_signal_handler) or the
+staff-only profile view.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper
+
+from collections import defaultdict
+from contextlib import contextmanager
+import atexit
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import re
+import signal
+import threading
+import time
+
+
+# numbers and quoted strings are replaced so the same statement with
+# different parameters is counted together
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    return _LITERALS.sub('?', sql)
+
+
+class ProfileSession(object):
+    def __init__(self, seconds, label):
+        self.label = label
+        self.started = time.time()
+        self.until = self.started + seconds
+        self.profiles = []
+        self.units = []
+        self._lock = threading.Lock()
+
+    @property
+    def expired(self):
+        return time.time() >= self.until
+
+    def add(self, name, profile, elapsed, queries, marks=()):
+        queries = [{'sql': q['sql'], 'time': float(q['time']), 'db': q['db']} for q in queries]
+        sections = []
+        for i, (label, offset) in enumerate(marks):
+            end = marks[i + 1][1] if i + 1 < len(marks) else len(queries)
+            section = queries[offset:end]
+            sections.append({
+                'label': label,
+                'query_count': len(section),
+                'time': sum(q['time'] for q in section),
+            })
+
+        with self._lock:
+            self.profiles.append(profile)
+            self.units.append({'name': name, 'seconds': elapsed, 'queries': queries, 'sections': sections})
+
+    def summary(self, top=25):
+        statements = defaultdict(lambda: {'count': 0, 'time': 0.0})
+        sections = defaultdict(lambda: {'query_count': 0, 'time': 0.0})
+        for unit in self.units:
+            for section in unit['sections']:
+                totals = sections[section['label']]
+                totals['query_count'] += section['query_count']
+                totals['time'] += section['time']
+            for query in unit['queries']:
+                statement = statements[normalize_sql(query['sql'])]
+                statement['count'] += 1
+                statement['time'] += query['time']
+
+        hottest = sorted(statements.items(), key=lambda s: (s[1]['count'], s[1]['time']), reverse=True)
+        return {
+            'label': self.label,
+            'started': datetime.datetime.utcfromtimestamp(self.started).isoformat() + 'Z',
+            'units': [
+                dict(u, query_count=len(u['queries'])) for u in self.units
+            ],
+            'sections': [
+                dict(totals, label=label)
+                for label, totals in sorted(sections.items(), key=lambda s: s[1]['query_count'], reverse=True)
+            ],
+            'statements': [
+                {'sql': sql, 'count': s['count'], 'time': s['time']} for sql, s in hottest[:top]
+            ],
+        }
+
+    def write(self, directory):
+        """
+        dumps the merged cProfile stats and the sql summary, returns the
+        path of the stats file or None if nothing was profiled.
+        """
+        if not self.profiles:
+            return None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        stamp = datetime.datetime.utcfromtimestamp(self.started).strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(directory, '%s-%s' % (self.label, stamp))
+
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(base + '.prof')
+
+        with open(base + '.sql.json', 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        return base + '.prof'
+
+
+class Profiler(object):
+    def __init__(self):
+        self.session = None
+        self.last_path = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        return self.session is not None
+
+    def start(self, seconds=None, label='profile'):
+        with self._lock:
+            if self.session is None:
+                if seconds is None:
+                    seconds = settings.VEGGY_PI_PROFILE_SECONDS
+                self.session = ProfileSession(seconds, label)
+            return self.session
+
+    def finish(self):
+        """
+        ends the running session and writes its results
+        """
+        with self._lock:
+            session, self.session = self.session, None
+        if session is not None:
+            self.last_path = session.write(settings.VEGGY_PI_PROFILE_DIR)
+        return self.last_path
+
+    def begin(self, name):
+        """
+        starts profiling a unit of work (a tick, a request) if a session is
+        running, returns a handle for end() or None.
+        """
+        session = self.session
+        # nested units (i.e. a tick inside a profiled request) belong to
+        # the outermost one - cProfile can't be enabled twice per thread
+        if session is None or getattr(self._local, 'unit', None) is not None:
+            return None
+
+        if session.expired:
+            self.finish()
+            return None
+
+        unit = self._local.unit = _Unit(session, name)
+        for connection in connections.all():
+            unit.debug_cursors.append((connection, connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+            # the queries are collected by the cursors of the unit rather
+            # than read back from connection.queries_log - a bounded deque,
+            # full in a long running controller that never resets it
+            connection.make_debug_cursor = (
+                lambda cursor, connection=connection: _RecordingCursor(cursor, connection, unit.queries)
+            )
+        unit.started = time.time()
+        unit.profile.enable()
+        return unit
+
+    def end(self, unit):
+        if unit is None:
+            return
+        unit.profile.disable()
+        elapsed = time.time() - unit.started
+        for connection, debug_cursor in unit.debug_cursors:
+            del connection.make_debug_cursor
+            connection.force_debug_cursor = debug_cursor
+        self._local.unit = None
+        unit.session.add(unit.name, unit.profile, elapsed, unit.queries, unit.marks)
+        if unit.session.expired and unit.session is self.session:
+            self.finish()
+
+    def mark(self, label):
+        """
+        attributes the queries issued from here on (until the next mark) to
+        `label` - i.e. the condition group being evaluated.
+        """
+        unit = getattr(self._local, 'unit', None) if self.session is not None else None
+        if unit is not None:
+            unit.marks.append((label, len(unit.queries)))
+
+    @contextmanager
+    def profile(self, name):
+        unit = self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(unit)
+
+
+class _Unit(object):
+    __slots__ = ('session', 'name', 'profile', 'marks', 'started', 'queries', 'debug_cursors')
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.marks = []
+        self.queries = []
+        self.debug_cursors = []
+
+
+class _RecordingCursor(CursorDebugWrapper):
+    """
+    a debug cursor also handing every query it logs (with the alias of its
+    database) to the unit
+    """
+    def __init__(self, cursor, db, queries):
+        super(_RecordingCursor, self).__init__(cursor, db)
+        self.queries = queries
+
+    def execute(self, sql, params=None):
+        try:
+            return super(_RecordingCursor, self).execute(sql, params)
+        finally:
+            self.queries.append(dict(self.db.queries_log[-1], db=self.db.alias))
+
+    def executemany(self, sql, param_list):
+        try:
+            return super(_RecordingCursor, self).executemany(sql, param_list)
+        finally:
+            self.queries.append(dict(self.db.queries_log[-1], db=self.db.alias))
+
+
+profiler = Profiler()
+# the session running when the process exits
+atexit.register(profiler.finish)
+
+
+def install_signal_handler(signum=signal.SIGUSR2, seconds=None):
+    """
+    `kill -USR2 <pid>` starts a profiling session in this process - call
+    from the main thread of the controller.
+    """
+    def handler(signum, frame):
+        profiler.start(seconds, label='controller')
+    signal.signal(signum, handler)
@@ -0,0 +1,106 @@
+from __future__ import unicode_literals, division
+
+import math
+
+
+class P2Quantile(object):
+    """
+    streaming quantile estimate using the P-square algorithm (Jain & Chlamtac,
+    1985) - five markers, O(1) memory and time per sample, so percentiles of
+    arbitrarily large buckets can be computed while streaming rows.
+
+    the first `exact` samples are buffered, so small buckets get an exact
+    (interpolated) result and the markers start out from real order
+    statistics rather than the first five samples.
+    """
+    def __init__(self, q, exact=100):
+        if not 0 < q < 1:
+            raise ValueError('quantile must be between 0 and 1')
+        self.q = q
+        self.exact = max(exact, 5)
+        self.count = 0
+        self.heights = []
+        self.positions = None
+        self.fractions = [0, q / 2, q, (1 + q) / 2, 1]
+        self.desired = None
+
+    def add(self, x):
+        self.count += 1
+        heights = self.heights
+
+        if self.positions is None:
+            heights.append(x)
+            if self.count == self.exact:
+                self._init_markers()
+            return
+
+        # find the cell k the sample falls into and adjust the extremes
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+
+        positions = self.positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.fractions[i]
+
+        # move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, d)
+                heights[i] = height
+                positions[i] += d
+
+    def _init_markers(self):
+        """
+        places the five markers on the order statistics of the buffer.
+        """
+        samples = sorted(self.heights)
+        n = len(samples)
+        self.desired = [1 + (n - 1) * f for f in self.fractions]
+
+        positions = [int(round(d)) for d in self.desired]
+        for i in range(1, 5):
+            positions[i] = max(positions[i], positions[i - 1] + 1)
+        positions[4] = n
+        for i in (3, 2, 1):
+            positions[i] = min(positions[i], positions[i + 1] - 1)
+
+        self.positions = positions
+        self.heights = [samples[p - 1] for p in positions]
+
+    def _parabolic(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+
+    @property
+    def value(self):
+        if not self.count:
+            return None
+        if self.positions is None:
+            # exact - linear interpolation between the closest ranks
+            samples = sorted(self.heights)
+            rank = self.q * (self.count - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, self.count - 1)
+            return samples[lower] + (samples[upper] - samples[lower]) * (rank - lower)
+        return self.heights[2]
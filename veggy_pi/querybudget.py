@@ -0,0 +1,204 @@
+"""
+query budgets of the ORM hot paths - the number of SQL queries each of them
+issues per call must stay within its budget, whatever the size of the data
+it works on.
+
+every hot path builds synthetic data of a given size and returns the call to
+measure. check() runs it at each size, inside transactions that are rolled
+back, records the queries of one call on every database (after a warm up
+call, so one-off lazy loads aren't counted) and reports per path:
+
+ - the query count per size and whether it is over the budget,
+ - whether it grows with the size,
+ - the statements repeated within the call - the same query with different
+   parameters, the usual shape of an N+1.
+
+    report = check()
+    assert not violations(report), violations(report)
+
+run with the test suite (TestQueryBudget) or the querybudget command.
+"""
+from __future__ import unicode_literals
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import six, timezone
+
+from collections import Counter, OrderedDict
+import datetime
+
+
+from . actuators import ActuatorQueue
+from . admin import UserInputInline
+from . benchmarks import make_config_chain, make_readings
+from . controller import Controller
+from . models import Condition, ConditionGroup, Operator, Reading, RPiPin, VeggyConfiguration
+from . profiling import normalize_sql
+
+
+SIZES = (2, 10, 50)
+
+# a statement issued this many times by one call is reported
+REPEAT_THRESHOLD = 3
+
+
+class HotPath(object):
+    def __init__(self, name, setup, budget):
+        self.name = name
+        self.setup = setup
+        self.budget = budget
+
+
+HOT_PATHS = OrderedDict()
+
+
+def hot_path(budget, name=None):
+    """
+    registers setup(size) - returning the call to measure - as a hot path
+    allowed `budget` queries per call.
+    """
+    def register(setup):
+        path = HotPath(name or setup.__name__, setup, budget)
+        HOT_PATHS[path.name] = path
+        return setup
+    return register
+
+
+@hot_path(budget=2)
+def get_values(size):
+    # a chain `size` configs deep, loaded from the database
+    leaf = VeggyConfiguration.objects.get(pk=make_config_chain(size, 7).pk)
+    return lambda: leaf.get_values([], [])
+
+
+@hot_path(budget=1)
+def validate_unique_values(size):
+    leaf = make_config_chain(1, 5 + size)
+    values = VeggyConfiguration.get_unique_values(leaf.get_values([], []))
+    return lambda: VeggyConfiguration.validate_unique_values(values)
+
+
+@hot_path(budget=1)
+def controller_tick(size):
+    # `size` groups of three conditions, each driving a relay
+    for i in range(size):
+        group = ConditionGroup.objects.create(
+            operator=Operator.AND, output_pin=RPiPin.objects.create(pin_number=i, label='budget_%s' % i),
+        )
+        Condition.objects.bulk_create([
+            Condition(group=group, lhs='bench_%s' % j, operator=Operator.LT, rhs='100') for j in range(3)
+        ])
+    make_readings(3 * size, sensors=3)
+    controller = Controller(actuators=ActuatorQueue(writer=lambda pin, state: None))
+    return lambda: controller.tick(controller.read_sensors())
+
+
+@hot_path(budget=2)
+def reading_save(size):
+    sensor_id = make_readings(10 * size)[0]
+    clock = [timezone.now()]
+
+    def save():
+        clock[0] += datetime.timedelta(seconds=1)
+        Reading(sensor_id=sensor_id, created_at=clock[0], data='21.5').save()
+    return save
+
+
+@hot_path(budget=1)
+def user_input_inline(size):
+    # the rows and labels of the UserInput inline of a config with `size` values
+    config = make_config_chain(1, 5 + size)
+    inline = UserInputInline(VeggyConfiguration, admin.site)
+    request = RequestFactory().get('/')
+    request.user = get_user_model()(is_active=True, is_superuser=True)
+    return lambda: [six.text_type(obj) for obj in inline.get_queryset(request).filter(veggy_config=config)]
+
+
+def record(func):
+    """
+    the sql of the queries issued by func() - on every database, the
+    readings of a split install (see routers.WorkloadRouter) included.
+    """
+    contexts = [CaptureQueriesContext(connection) for connection in connections.all()]
+    for context in contexts:
+        context.__enter__()
+    try:
+        func()
+    finally:
+        for context in reversed(contexts):
+            context.__exit__(None, None, None)
+    return [query['sql'] for context in contexts for query in context.captured_queries]
+
+
+def repeated_statements(queries, threshold=REPEAT_THRESHOLD):
+    """
+    the [(normalized sql, count), ...] of the statements issued at least
+    `threshold` times, most frequent first.
+    """
+    counts = Counter(normalize_sql(sql) for sql in queries)
+    return sorted(
+        ((sql, count) for sql, count in counts.items() if count >= threshold),
+        key=lambda statement: (-statement[1], statement[0]),
+    )
+
+
+def measure(path, size):
+    """
+    the queries of one call of a hot path over data of the given size
+    """
+    atomics = [(alias, transaction.atomic(using=alias)) for alias in connections]
+    for alias, atomic in atomics:
+        atomic.__enter__()
+    try:
+        func = path.setup(size)
+        func()
+        queries = record(func)
+    finally:
+        for alias, atomic in reversed(atomics):
+            transaction.set_rollback(True, using=alias)
+            atomic.__exit__(None, None, None)
+    return queries
+
+
+def check(paths=None, sizes=SIZES):
+    """
+    measures the hot paths (names, default: all of them) at every size,
+    returns {name: {budget, queries: {size: count}, over_budget, grows,
+    repeated}} - repeated lists the statements repeated at the largest size.
+    """
+    sizes = sorted(sizes)
+    report = OrderedDict()
+    for name in paths or HOT_PATHS:
+        path = HOT_PATHS[name]
+        counts = OrderedDict()
+        for size in sizes:
+            queries = measure(path, size)
+            counts[size] = len(queries)
+        report[name] = {
+            'budget': path.budget,
+            'queries': counts,
+            'over_budget': max(counts.values()) > path.budget,
+            'grows': counts[sizes[-1]] > counts[sizes[0]],
+            'repeated': [{'sql': sql, 'count': count} for sql, count in repeated_statements(queries)],
+        }
+    return report
+
+
+def violations(report):
+    """
+    a message per hot path over its budget, growing with the data size or
+    repeating statements.
+    """
+    messages = []
+    for name, result in report.items():
+        counts = ', '.join('%s: %s' % item for item in result['queries'].items())
+        if result['over_budget']:
+            messages.append('%s: over its budget of %s queries (%s)' % (name, result['budget'], counts))
+        if result['grows']:
+            messages.append('%s: the query count grows with the data (%s)' % (name, counts))
+        for statement in result['repeated']:
+            messages.append('%s: possible N+1, %s x %s' % (name, statement['count'], statement['sql']))
+    return messages
@@ -0,0 +1,96 @@
+"""
+compact in-memory readings for the path between a sensor read and the
+database - the batcher, the live event broker and bulk_ingest pass these
+around and Reading model instances are only built at the bulk insert.
+"""
+from __future__ import unicode_literals
+
+from django.utils.six.moves import range
+
+from array import array
+import datetime
+
+
+from . funcs import to_timestamp, from_timestamp
+
+
+class ReadingRecord(object):
+    """
+    one reading - sensor id, created_at (an epoch timestamp or an aware
+    datetime) and the raw data. unpacks like the (sensor_id, created_at,
+    data) tuples bulk_ingest and the ingest task take.
+    """
+    __slots__ = ('sensor_id', 'created_at', 'data')
+
+    def __init__(self, sensor_id, created_at, data):
+        self.sensor_id = sensor_id
+        self.created_at = created_at
+        self.data = data
+
+    def __iter__(self):
+        yield self.sensor_id
+        yield self.created_at
+        yield self.data
+
+    def __eq__(self, other):
+        return isinstance(other, ReadingRecord) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'ReadingRecord(%r, %r, %r)' % tuple(self)
+
+    def as_event(self):
+        """
+        the payload of a live reading event (see views.reading_stream)
+        """
+        created_at = self.created_at
+        if not isinstance(created_at, datetime.datetime):
+            created_at = from_timestamp(created_at)
+        return {
+            'sensor': self.sensor_id,
+            'created_at': created_at.isoformat(),
+            'data': self.data,
+        }
+
+
+class ReadingBatch(object):
+    """
+    a column oriented batch of readings - sensor ids and epoch timestamps are
+    kept in typed arrays (8 bytes each) rather than as an int, a float and a
+    tuple object per reading. iterating yields ReadingRecords.
+    """
+    __slots__ = ('sensor_ids', 'timestamps', 'data')
+
+    def __init__(self, records=()):
+        self.sensor_ids = array(str('l'))
+        self.timestamps = array(str('d'))
+        self.data = []
+        for sensor_id, created_at, data in records:
+            self.append(sensor_id, created_at, data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return ReadingRecord(self.sensor_ids[index], self.timestamps[index], self.data[index])
+
+    def __iter__(self):
+        sensor_ids, timestamps, data = self.sensor_ids, self.timestamps, self.data
+        for i in range(len(data)):
+            yield ReadingRecord(sensor_ids[i], timestamps[i], data[i])
+
+    def append(self, sensor_id, created_at, data):
+        if isinstance(created_at, datetime.datetime):
+            created_at = to_timestamp(created_at)
+        self.sensor_ids.append(sensor_id)
+        self.timestamps.append(created_at)
+        self.data.append(data)
+
+    def to_list(self):
+        """
+        [[sensor_id, timestamp, data], ...] - the json friendly form the
+        ingest task is queued with.
+        """
+        return [list(record) for record in self]
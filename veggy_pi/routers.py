@@ -0,0 +1,78 @@
+"""
+database routers - see the DATABASE_ROUTERS setting.
+"""
+from __future__ import unicode_literals
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# database aliases of the reading history partitions (see partitions.py)
+PARTITION_PREFIX = 'readings_'
+
+
+def is_partition(alias):
+    return alias.startswith(PARTITION_PREFIX)
+
+
+class PartitionRouter(object):
+    """
+    keeps migrate off the month partitions of the reading history (their
+    table is created by partitions.create_partition) and allows the relations
+    between archived readings and the sensors in the default database.
+    """
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_partition(db):
+            return False
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_partition(obj1._state.db or '') or is_partition(obj2._state.db or ''):
+            return True
+        return None
+
+
+# the optional database for the append heavy tables
+TIMESERIES = 'timeseries'
+
+# sensors live with their readings - current readings, rollups and the
+# controller sensor state are joins between the two. the pins stay on
+# default with the condition groups driving them (select_related by the
+# controller), so Sensor.pin is the one relation between the databases
+TIMESERIES_MODELS = frozenset(['reading', 'input', 'readingrollup', 'sensor', 'synccursor'])
+
+
+class WorkloadRouter(object):
+    """
+    puts the append heavy reading history on the TIMESERIES database and
+    leaves the small, read heavy configuration and rule tables on default -
+    so ingest bursts, checkpoints and VACUUM of the history don't lock the
+    config. opt-in: does nothing unless DATABASES has a 'timeseries' entry.
+    """
+    def _db(self, model):
+        if TIMESERIES not in connections.databases or model._meta.app_label != 'veggy_pi':
+            return None
+        if model._meta.concrete_model._meta.model_name in TIMESERIES_MODELS:
+            return TIMESERIES
+        # explicitly, or a related lookup from a timeseries row (i.e.
+        # sensor.pin) would follow the row to its database
+        return DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._db(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == 'veggy_pi' and obj2._meta.app_label == 'veggy_pi':
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if TIMESERIES not in connections.databases:
+            return None
+        if app_label != 'veggy_pi':
+            return db != TIMESERIES
+        if model_name is None:
+            return None
+        return (model_name in TIMESERIES_MODELS) == (db == TIMESERIES)
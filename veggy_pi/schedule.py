@@ -0,0 +1,286 @@
+"""
+the configuration schedule - which VeggyConfiguration is active when.
+
+a configuration with a start_time and an end_time is active every day
+between the times of day of the two (in TIME_ZONE, past midnight when the
+end is earlier than the start - i.e. a night config), one without them is
+always active. when several are active the one deepest in its parent_config
+chain wins - an override of the day config beats the day config, which
+beats the main config - ties go to the newest config.
+
+ScheduleTimeline materializes the next VEGGY_PI_SCHEDULE_HOURS of that as
+sorted (start, config id) intervals, so active() is a bisect instead of a
+query and a comparison of every config per tick. the timeline is extended
+once half of the horizon has passed. changes are picked up incrementally -
+only the windows of a changed config are recomputed - right away for saves
+in this process (the post_save / post_delete receivers) and within
+VEGGY_PI_SCHEDULE_RELOAD seconds for saves in other processes.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.utils import timezone
+
+from bisect import bisect_right
+from itertools import groupby
+import datetime
+import threading
+import time
+
+
+from . funcs import from_timestamp, to_timestamp
+from . models import VeggyConfiguration
+
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def chain_depth(configs, pk):
+    """
+    the number of parents above config `pk` - configs maps the config ids
+    to (parent id, start_time, end_time).
+    """
+    depth = 0
+    seen = set([pk])
+    parent = configs[pk][0]
+    while parent in configs and parent not in seen:
+        seen.add(parent)
+        depth += 1
+        parent = configs[parent][0]
+    return depth
+
+
+def daily_windows(start_time, end_time, horizon_start, horizon_end, tz=None):
+    """
+    the [start, end) intervals (epoch timestamps) between horizon_start and
+    horizon_end in which a config with these start / end times is active.
+    """
+    if start_time is None or end_time is None:
+        return [(horizon_start, horizon_end)]
+
+    tz = tz or timezone.get_default_timezone()
+    start_of_day = timezone.localtime(start_time, tz).time()
+    end_of_day = timezone.localtime(end_time, tz).time()
+
+    windows = []
+    # the window of the day before may still be open at horizon_start
+    day = timezone.localtime(from_timestamp(horizon_start), tz).date() - ONE_DAY
+    last_day = timezone.localtime(from_timestamp(horizon_end), tz).date()
+    while day <= last_day:
+        end_day = day if end_of_day > start_of_day else day + ONE_DAY
+        start = max(horizon_start, to_timestamp(_at(day, start_of_day, tz)))
+        end = min(horizon_end, to_timestamp(_at(end_day, end_of_day, tz)))
+        if start < end:
+            windows.append((start, end))
+        day += ONE_DAY
+    return windows
+
+
+def _at(day, time_of_day, tz):
+    return timezone.make_aware(datetime.datetime.combine(day, time_of_day), tz, is_dst=False)
+
+
+class ScheduleTimeline(object):
+    """
+    the materialized schedule of one process, built on first use.
+    """
+    def __init__(self, hours=None, reload_interval=None):
+        self.hours = hours
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._configs = None
+            self._windows = {}
+            self._depths = {}
+            self._horizon = None
+            self._loaded = None
+            self._starts = []
+            self._pks = []
+
+    def active(self, now=None):
+        """
+        the id of the config active at `now` (default: the current time),
+        None if no config is.
+        """
+        timestamp = to_timestamp(now or timezone.now())
+        with self._lock:
+            if self._configs is None:
+                self._configs = self.load()
+                self._loaded = time.time()
+                self.build(timestamp)
+            else:
+                reload_interval = self.reload_interval
+                if reload_interval is None:
+                    reload_interval = settings.VEGGY_PI_SCHEDULE_RELOAD
+                if time.time() - self._loaded >= reload_interval:
+                    self.refresh()
+                horizon_start, horizon_end = self._horizon
+                if not horizon_start <= timestamp < (horizon_start + horizon_end) / 2:
+                    self.build(timestamp)
+            return self._pks[bisect_right(self._starts, timestamp) - 1]
+
+    def active_config(self, now=None):
+        """
+        the active VeggyConfiguration - resolve its values with get_values()
+        """
+        pk = self.active(now)
+        return VeggyConfiguration.objects.get(pk=pk) if pk is not None else None
+
+    def intervals(self):
+        """
+        the materialized timeline as [(start, end, config id), ...]
+        """
+        with self._lock:
+            if self._horizon is None:
+                return []
+            ends = self._starts[1:] + [self._horizon[1]]
+            return [
+                (from_timestamp(start), from_timestamp(end), pk)
+                for start, end, pk in zip(self._starts, ends, self._pks) if start < end
+            ]
+
+    @staticmethod
+    def load():
+        return dict(
+            (pk, (parent_id, start_time, end_time))
+            for pk, parent_id, start_time, end_time in VeggyConfiguration.objects.values_list(
+                'pk', 'parent_config_id', 'start_time', 'end_time',
+            )
+        )
+
+    def build(self, timestamp):
+        """
+        materializes the horizon starting at `timestamp` from scratch.
+        """
+        hours = self.hours or settings.VEGGY_PI_SCHEDULE_HOURS
+        self._horizon = (timestamp, timestamp + hours * 60 * 60)
+        self._depths = dict((pk, chain_depth(self._configs, pk)) for pk in self._configs)
+        self._windows = dict(
+            (pk, daily_windows(start_time, end_time, *self._horizon))
+            for pk, (parent_id, start_time, end_time) in self._configs.items()
+        )
+        self._merge()
+
+    def refresh(self):
+        """
+        picks up the configs changed by other processes (or bulk writes).
+        """
+        with self._lock:
+            if self._configs is None:
+                return
+            self._apply(self.load())
+            self._loaded = time.time()
+
+    def update(self, config):
+        """
+        post_save - reschedules a created or changed config.
+        """
+        with self._lock:
+            if self._configs is None:
+                return
+            configs = dict(self._configs)
+            configs[config.pk] = (config.parent_config_id, config.start_time, config.end_time)
+            self._apply(configs)
+
+    def remove(self, pk):
+        """
+        post_delete - the children of a deleted config lose their parent
+        (on_delete=SET_NULL).
+        """
+        with self._lock:
+            if self._configs is None:
+                return
+            configs = dict(
+                (other, (None if parent_id == pk else parent_id, start_time, end_time))
+                for other, (parent_id, start_time, end_time) in self._configs.items() if other != pk
+            )
+            self._apply(configs)
+
+    def _apply(self, configs):
+        """
+        recomputes the windows of the configs whose times changed, the depths
+        if a parent changed and the timeline if anything did.
+        """
+        if self._horizon is None:
+            self._configs = configs
+            return
+
+        changed = False
+        for pk in set(self._configs) - set(configs):
+            del self._windows[pk]
+            changed = True
+        for pk, (parent_id, start_time, end_time) in configs.items():
+            previous = self._configs.get(pk)
+            if previous is None or previous[1:] != (start_time, end_time):
+                self._windows[pk] = daily_windows(start_time, end_time, *self._horizon)
+                changed = True
+            if previous is None or previous[0] != parent_id:
+                changed = True
+
+        self._configs = configs
+        if changed:
+            self._depths = dict((pk, chain_depth(configs, pk)) for pk in configs)
+            self._merge()
+
+    def _merge(self):
+        """
+        sweeps the window boundaries in time order, keeping the winning
+        config of every stretch between two of them.
+        """
+        events = []
+        for pk, windows in self._windows.items():
+            for start, end in windows:
+                events.append((start, pk, 1))
+                events.append((end, pk, -1))
+        events.sort()
+
+        rank = lambda pk: (self._depths[pk], pk)
+        starts = [self._horizon[0]]
+        pks = [None]
+        open_windows = {}
+        for timestamp, group in groupby(events, key=lambda event: event[0]):
+            for timestamp, pk, delta in group:
+                open_windows[pk] = open_windows.get(pk, 0) + delta
+                if not open_windows[pk]:
+                    del open_windows[pk]
+            winner = max(open_windows, key=rank) if open_windows else None
+            if winner == pks[-1]:
+                continue
+            if starts[-1] == timestamp:
+                pks[-1] = winner
+                if len(pks) > 1 and pks[-2] == winner:
+                    starts.pop()
+                    pks.pop()
+            else:
+                starts.append(timestamp)
+                pks.append(winner)
+
+        self._starts = starts
+        self._pks = pks
+
+
+def schedule_between(start, end):
+    """
+    the [(start, end, config id), ...] intervals between two datetimes -
+    i.e. for a past range of the history.
+    """
+    hours = (to_timestamp(end) - to_timestamp(start)) / 3600.0
+    if hours <= 0:
+        return []
+    timeline = ScheduleTimeline(hours=hours)
+    timeline.active(start)
+    return timeline.intervals()
+
+
+timeline = ScheduleTimeline()
+
+
+def config_saved(sender, instance, **kwargs):
+    timeline.update(instance)
+
+
+def config_deleted(sender, instance, **kwargs):
+    timeline.remove(instance.pk)
@@ -5,6 +5,13 @@ from rest_framework import serializers
 from rest_framework.reverse import reverse
 
 import datetime
+import json
+
+try:
+    # optional faster json encoder for the fast path serializers
+    import ujson as fast_json
+except ImportError:
+    fast_json = json
 
 
 from veggy_pi.models import *
@@ -26,7 +33,105 @@ class UserSerializer(serializers.ModelSerializer):
         return {
             u'self': reverse(u'user-detail', kwargs={User.USERNAME_FIELD: username}, request=request),
         }
-    
+
+
+class SensorSerializer(serializers.ModelSerializer):
+    current_value = serializers.CharField(source=u'current_reading.data', read_only=True)
+    current_at = serializers.DateTimeField(source=u'current_reading.created_at', read_only=True)
+
+    class Meta:
+        model = Sensor
+        fields = (u'id', u'name', u'pin', u'current_reading', u'current_value', u'current_at',)
+
+
+class ReadingSerializer(serializers.ModelSerializer):
+    sensor_name = serializers.CharField(source=u'sensor.name', read_only=True)
+
+    class Meta:
+        model = Reading
+        fields = (u'id', u'sensor', u'sensor_name', u'created_at', u'data',)
+
+
+def iso_datetime(value):
+    """
+    renders a datetime the way rest_framework's DateTimeField does
+    """
+    if value is None:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ValuesSerializer(object):
+    """
+    fast path serializer for high volume endpoints - reads plain tuples with
+    values_list() and builds the JSON in one go instead of instantiating a
+    model and a set of serializer fields for every row.
+
+    `fields` is a sequence of (output name, lookup) pairs, `converters` maps
+    output names to callables for values json can't encode as is.
+    """
+    fields = ()
+    converters = {}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values_list(*[lookup for name, lookup in cls.fields])
+
+    @property
+    def data(self):
+        names = [name for name, lookup in self.fields]
+        converters = [(i, self.converters[name]) for i, name in enumerate(names) if name in self.converters]
+
+        data = []
+        for row in self.rows:
+            if converters:
+                row = list(row)
+                for i, converter in converters:
+                    row[i] = converter(row[i])
+            data.append(dict(zip(names, row)))
+        return data
+
+    def to_json(self):
+        return fast_json.dumps(self.data)
+
+
+class FastReadingSerializer(ValuesSerializer):
+    """
+    same output as ReadingSerializer for reading history and bulk responses
+    """
+    fields = (
+        (u'id', u'id'),
+        (u'sensor', u'sensor_id'),
+        (u'sensor_name', u'sensor__name'),
+        (u'created_at', u'created_at'),
+        (u'data', u'data'),
+    )
+    converters = {
+        u'created_at': iso_datetime,
+    }
+
+
+class LatestReadingSerializer(ValuesSerializer):
+    """
+    every sensor with its current reading, from a single LEFT JOIN
+    """
+    fields = (
+        (u'sensor', u'id'),
+        (u'name', u'name'),
+        (u'reading', u'current_reading_id'),
+        (u'created_at', u'current_reading__created_at'),
+        (u'data', u'current_reading__data'),
+    )
+    converters = {
+        u'created_at': iso_datetime,
+    }
+
 
 # class RPiPinSerializer(serializers.ModelSerializer):
 #     class Meta:
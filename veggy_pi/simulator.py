@@ -0,0 +1,215 @@
+"""
+replays recorded sensor history through the control loop faster than real
+time - to see what a change of the Condition / ConditionGroup rules would
+have done before deploying it (see the simulate command).
+
+the readings between start and end are streamed in (created_at, id) order,
+a chunk at a time, into a SensorState. every `interval` seconds of history
+the VirtualClock is moved to the tick and the Controller runs the full
+evaluate -> actuate pass, with the ActuatorQueue rules (min on / off times,
+switch limits) applied in virtual time and the pin writes going to a
+SimulatedGPIO instead of the hardware. nothing sleeps, nothing is written
+to the database and the live metrics and condition events are left alone.
+"""
+from __future__ import unicode_literals, division
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+
+import time
+
+
+from . actuators import ActuatorQueue
+from . controller import Controller
+from . funcs import to_timestamp
+from . models import ConditionGroup, Reading, Sensor, SensorState
+from . partitions import PartitionedReadings
+
+
+class VirtualClock(object):
+    """
+    a clock standing still until it is moved - callable like time.time.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def sleep(self, seconds):
+        # Controller.run() compatible
+        self.advance(seconds)
+
+
+class SimulatedPin(object):
+    __slots__ = ('state', 'changed_at', 'on_seconds', 'switches', 'writes')
+
+    def __init__(self, state, now):
+        self.state = state
+        self.changed_at = now
+        self.on_seconds = 0.0
+        self.switches = 0
+        self.writes = 0
+
+
+class SimulatedGPIO(object):
+    """
+    the pin states an ActuatorQueue writer would have set, with the switch
+    count and the time spent HIGH of every pin.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.pins = {}
+
+    def write(self, pin, state):
+        now = self.clock()
+        simulated = self.pins.get(pin.pin_number)
+        if simulated is None:
+            simulated = self.pins[pin.pin_number] = SimulatedPin(state, now)
+        elif simulated.state != state:
+            if simulated.state:
+                simulated.on_seconds += now - simulated.changed_at
+            simulated.state = state
+            simulated.changed_at = now
+            simulated.switches += 1
+        simulated.writes += 1
+
+    def report(self, start, end):
+        """
+        {pin number: {switches, writes, on_seconds, duty_cycle}} between
+        start and end (the first write to a pin is its initial state, not a
+        switch).
+        """
+        duration = end - start
+        report = {}
+        for pin_number, simulated in sorted(self.pins.items()):
+            on_seconds = simulated.on_seconds
+            if simulated.state:
+                on_seconds += end - simulated.changed_at
+            report[pin_number] = {
+                'switches': simulated.switches,
+                'writes': simulated.writes,
+                'on_seconds': on_seconds,
+                'duty_cycle': on_seconds / duration if duration else None,
+                'state': simulated.state,
+            }
+        return report
+
+
+def stream_readings(start, end, chunk_size=1000):
+    """
+    (timestamp, sensor_id, data) of the readings between two datetimes,
+    oldest first, across the partitions - fetched chunk_size at a time, so
+    memory use doesn't grow with the range.
+    """
+    for queryset in PartitionedReadings(start, end).querysets():
+        rows = queryset.order_by('created_at', 'id').values_list('created_at', 'id', 'sensor_id', 'data')
+        after = None
+        while True:
+            chunk = rows
+            if after is not None:
+                chunk = rows.filter(Q(created_at__gt=after[0]) | Q(created_at=after[0], id__gt=after[1]))
+            chunk = list(chunk[:chunk_size])
+            for created_at, pk, sensor_id, data in chunk:
+                yield to_timestamp(created_at), sensor_id, data
+            if len(chunk) < chunk_size:
+                break
+            after = chunk[-1][:2]
+
+
+class Replay(object):
+    """
+    replays the history between start and end through the given condition
+    groups (default: the groups driving an output), ticking every `interval`
+    seconds of history, with the sensor filters (default:
+    VEGGY_PI_SENSOR_FILTERS) applied to every reading. actuator_options are
+    passed on to the ActuatorQueue.
+    """
+    def __init__(self, start, end, interval=None, groups=None, chunk_size=1000, filters=None, **actuator_options):
+        if end <= start:
+            raise ValueError(_('the end of the replay must be after its start'))
+        self.start = start
+        self.end = end
+        self.interval = interval or settings.VEGGY_PI_CONTROLLER_INTERVAL
+        self.chunk_size = chunk_size
+
+        if groups is None:
+            groups = ConditionGroup.objects.exclude(output_pin=None).select_related('output_pin')
+        if hasattr(groups, 'prefetch_related'):
+            # the conditions are fetched once rather than on every tick
+            groups = groups.prefetch_related('condition_set')
+        self.groups = list(groups)
+
+        self.clock = VirtualClock(to_timestamp(start))
+        self.gpio = SimulatedGPIO(self.clock)
+        self.actuators = ActuatorQueue(clock=self.clock, writer=self.gpio.write, live=False, **actuator_options)
+        self.controller = Controller(groups=self.groups, actuators=self.actuators, filters=filters, live=False)
+
+    def initial_state(self):
+        """
+        the sensor state at start - the last reading of every sensor before it.
+        """
+        names = dict(Sensor.objects.values_list('pk', 'name'))
+        state = SensorState()
+        for sensor_id, name in names.items():
+            data = Reading.objects.filter(sensor_id=sensor_id, created_at__lt=self.start).order_by(
+                '-created_at', '-id',
+            ).values_list('data', flat=True).first()
+            if data is not None:
+                state[name] = self.controller.filters.sample(name, data)
+        return names, state
+
+    def run(self):
+        """
+        replays the history, returns the report.
+        """
+        started = time.time()
+        names, state = self.initial_state()
+        needed = set(condition.lhs for group in self.groups for condition in group.condition_set.all())
+
+        start, end = to_timestamp(self.start), to_timestamp(self.end)
+        tick_at = start
+        ticks = warmup = readings = 0
+        pending = None
+        history = stream_readings(self.start, self.end, self.chunk_size)
+        while tick_at < end:
+            # everything recorded up to the tick is known to it
+            while True:
+                if pending is None:
+                    pending = next(history, None)
+                    if pending is None:
+                        break
+                if pending[0] > tick_at:
+                    break
+                timestamp, sensor_id, data = pending
+                name = names.get(sensor_id, sensor_id)
+                state[name] = self.controller.filters.sample(name, data)
+                readings += 1
+                pending = None
+
+            self.clock.now = tick_at
+            if needed.issubset(state):
+                self.controller.tick(state)
+                ticks += 1
+            else:
+                # a sensor a rule needs hasn't reported yet
+                warmup += 1
+            tick_at += self.interval
+
+        elapsed = time.time() - started
+        return {
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'interval': self.interval,
+            'ticks': ticks,
+            'warmup_ticks': warmup,
+            'readings': readings,
+            'seconds': elapsed,
+            'speedup': (end - start) / elapsed if elapsed else None,
+            'pins': self.gpio.report(start, end),
+            'actuators': dict(self.actuators.stats),
+        }
@@ -0,0 +1,21 @@
+"""
+per database sqlite tuning - the PRAGMAs in VEGGY_PI_SQLITE_PRAGMAS are set
+on every new connection to the database alias they are listed under.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver (connected in VeggyPiConfig.ready)
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = settings.VEGGY_PI_SQLITE_PRAGMAS.get(connection.alias)
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in sorted(pragmas.items()):
+            cursor.execute('PRAGMA %s = %s' % (name, value))
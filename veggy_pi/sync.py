@@ -0,0 +1,270 @@
+"""
+delta sync of the local history of a controller to a central hub.
+
+every controller keeps a SyncCursor per kind of row (readings, inputs) - the
+highest local id the hub acknowledged. a push ships the rows after the
+cursor in id order as zlib compressed json batches:
+
+    {"node": "room-1",
+     "sensors": {"<id>": "<name>", ...},
+     "readings": [[id, sensor_id, created_at, data], ...],
+     "inputs": [[id, sensor_name, created_at, value], ...]}
+
+the hub (see ingest_batch / the sync view) writes a batch in one transaction
+with bulk inserts, skips rows it already holds - rows are unique by
+(origin, origin_id), so a batch re-sent after a lost acknowledgement is
+harmless - and answers with the highest id it now holds per kind. on
+(re)connect resume() aligns the cursors with what the hub actually has, so
+only the gap is backfilled.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import six
+from django.utils.six.moves.urllib.error import HTTPError
+from django.utils.six.moves.urllib.parse import urlencode
+from django.utils.six.moves.urllib.request import Request, urlopen
+from django.utils.translation import ugettext_lazy as _
+
+import json
+import zlib
+
+
+from . ingest import input_normalizer, parse_timestamp
+from . models import Input, Reading, Sensor, SyncCursor
+
+
+KINDS = ('readings', 'inputs')
+
+TOKEN_HEADER = 'X-Veggy-Pi-Token'
+
+
+class SyncError(Exception):
+    pass
+
+
+def encode(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def decode(body, max_size=None):
+    """
+    inflates and parses a batch, refusing anything that inflates to more
+    than max_size bytes (VEGGY_PI_SYNC_MAX_BYTES).
+    """
+    max_size = max_size or settings.VEGGY_PI_SYNC_MAX_BYTES
+    try:
+        inflater = zlib.decompressobj()
+        raw = inflater.decompress(body, max_size)
+        if inflater.unconsumed_tail:
+            raise ValueError(_('batch is larger than %s bytes') % max_size)
+        return json.loads(raw.decode('utf-8'))
+    except (zlib.error, UnicodeDecodeError) as ex:
+        raise ValueError('%s' % ex)
+
+
+def local_rows(kind, after, limit):
+    """
+    the next `limit` local (not synced in) rows after id `after`.
+    """
+    if kind == 'readings':
+        rows = Reading.objects.filter(origin='', id__gt=after).values_list('id', 'sensor_id', 'created_at', 'data')
+    else:
+        rows = Input.objects.filter(origin='', id__gt=after).values_list('id', 'sensor_name', 'created_at', 'value')
+    return [[pk, key, created_at.isoformat(), value] for pk, key, created_at, value in rows.order_by('id')[:limit]]
+
+
+def build_batch(node, cursors, limit):
+    """
+    the next batch after the given {kind: last_id} cursors, None once there
+    is nothing left to send.
+    """
+    payload = {'node': node}
+    empty = True
+    for kind in KINDS:
+        payload[kind] = local_rows(kind, cursors.get(kind, 0), limit)
+        empty = empty and not payload[kind]
+    if empty:
+        return None
+
+    sensor_ids = set(row[1] for row in payload['readings'])
+    payload['sensors'] = dict(
+        ('%s' % pk, name) for pk, name in Sensor.objects.filter(pk__in=sensor_ids).values_list('pk', 'name')
+    ) if sensor_ids else {}
+    return payload
+
+
+def high_water_marks(node):
+    """
+    the highest id of `node` the hub holds per kind.
+    """
+    return dict(
+        (kind, model.objects.filter(origin=node).order_by('-origin_id').values_list('origin_id', flat=True).first() or 0)
+        for kind, model in (('readings', Reading), ('inputs', Input))
+    )
+
+
+def _origin_sensors(node, sensors):
+    """
+    maps the sensor ids of `node` to hub sensors, creating the missing ones.
+    """
+    origin_ids = set(int(pk) for pk in sensors)
+    if not origin_ids:
+        return {}
+
+    existing = dict(Sensor.objects.filter(origin=node, origin_id__in=origin_ids).values_list('origin_id', 'pk'))
+    missing = origin_ids - set(existing)
+    if missing:
+        Sensor.objects.bulk_create([
+            Sensor(name=sensors['%s' % pk], origin=node, origin_id=pk) for pk in sorted(missing)
+        ])
+        existing = dict(Sensor.objects.filter(origin=node, origin_id__in=origin_ids).values_list('origin_id', 'pk'))
+    return existing
+
+
+def _timestamp(value):
+    timestamp = parse_timestamp(value)
+    if timestamp is None:
+        raise ValueError(_('invalid timestamp %r') % (value,))
+    return timestamp
+
+
+def _new_rows(model, node, rows):
+    """
+    the rows (sorted by origin id) the hub doesn't hold yet - one range query.
+    """
+    rows = sorted(rows, key=lambda row: row[0])
+    if not rows:
+        return rows
+    held = set(model.objects.filter(
+        origin=node, origin_id__gte=rows[0][0], origin_id__lte=rows[-1][0],
+    ).values_list('origin_id', flat=True))
+    return [row for row in rows if row[0] not in held]
+
+
+def ingest_batch(payload):
+    """
+    hub side - writes a decoded batch, returns the high-water marks of the
+    sending node and the number of rows created / skipped as duplicates.
+    """
+    node = payload.get('node') if isinstance(payload, dict) else None
+    if not node or not isinstance(node, six.string_types) or len(node) > 64:
+        raise ValueError(_('a batch needs the name of the node it came from'))
+
+    try:
+        with transaction.atomic(using=router.db_for_write(Reading)):
+            sensors = _origin_sensors(node, payload.get('sensors') or {})
+
+            readings = payload.get('readings') or []
+            new_readings = _new_rows(Reading, node, readings)
+            Reading.objects.bulk_create([
+                Reading(origin=node, origin_id=pk, sensor_id=sensors[sensor_id],
+                        created_at=_timestamp(created_at), data=data)
+                for pk, sensor_id, created_at, data in new_readings
+            ], batch_size=500)
+            Reading.objects.update_current_readings(set(sensors[row[1]] for row in new_readings))
+
+            inputs = payload.get('inputs') or []
+            new_inputs = _new_rows(Input, node, inputs)
+            Input.objects.bulk_create(input_normalizer.normalize([
+                Input(origin=node, origin_id=pk, sensor_name=sensor_name,
+                      created_at=_timestamp(created_at), value=value)
+                for pk, sensor_name, created_at, value in new_inputs
+            ]), batch_size=500)
+    except (KeyError, TypeError, ValueError) as ex:
+        raise ValueError(_('malformed batch: %s') % ex)
+
+    created = len(new_readings) + len(new_inputs)
+    return {
+        'node': node,
+        'acked': high_water_marks(node),
+        'created': created,
+        'duplicates': len(readings) + len(inputs) - created,
+    }
+
+
+def http_transport(method, url, body=None, headers=None):
+    """
+    returns the (status, body) of a request to the hub.
+    """
+    request = Request(url, data=body, headers=headers or {})
+    request.get_method = lambda: method
+    try:
+        response = urlopen(request, timeout=settings.VEGGY_PI_SYNC_TIMEOUT)
+        return response.getcode(), response.read()
+    except HTTPError as ex:
+        return ex.code, ex.read()
+
+
+class SyncClient(object):
+    """
+    controller side - pushes the local history to the hub at `url` (the
+    sync view, i.e. http://hub:8000/veggy_pi/api/v1/sync/).
+    """
+    def __init__(self, url=None, node=None, token=None, batch_size=None, transport=None):
+        self.url = url or settings.VEGGY_PI_SYNC_HUB_URL
+        self.node = node or settings.VEGGY_PI_SYNC_NODE
+        self.token = token or settings.VEGGY_PI_SYNC_TOKEN
+        self.batch_size = batch_size or settings.VEGGY_PI_SYNC_BATCH_SIZE
+        self.transport = transport or http_transport
+        if not self.url or not self.node:
+            raise SyncError('VEGGY_PI_SYNC_HUB_URL and VEGGY_PI_SYNC_NODE are required')
+
+    def cursors(self):
+        cursors = dict((kind, 0) for kind in KINDS)
+        cursors.update(SyncCursor.objects.filter(hub=self.url).values_list('kind', 'last_id'))
+        return cursors
+
+    def save_cursors(self, acked, previous=None):
+        for kind in KINDS:
+            last_id = acked.get(kind, 0)
+            if previous is not None and previous.get(kind) == last_id:
+                continue
+            if not SyncCursor.objects.filter(hub=self.url, kind=kind).update(last_id=last_id):
+                SyncCursor.objects.create(hub=self.url, kind=kind, last_id=last_id)
+
+    def request(self, method, url, body=None, headers=None):
+        headers = dict(headers or {}, **{TOKEN_HEADER: self.token or ''})
+        status, body = self.transport(method, url, body, headers)
+        if status != 200:
+            raise SyncError('hub answered %s: %s' % (status, body[:200]))
+        return json.loads(body.decode('utf-8'))
+
+    def resume(self):
+        """
+        sets the cursors to what the hub holds of this node - after a lost
+        acknowledgement, a restored hub or a reset cursor only the gap is
+        sent again.
+        """
+        acked = self.request('GET', '%s?%s' % (self.url, urlencode({'node': self.node})))['acked']
+        self.save_cursors(acked)
+        return acked
+
+    def send(self, payload):
+        return self.request('POST', self.url, encode(payload), {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'deflate',
+        })
+
+    def push(self, max_batches=None):
+        """
+        sends batches until everything is acknowledged (or max_batches were
+        sent), returns the number of batches sent.
+        """
+        cursors = self.cursors()
+        sent = 0
+        while max_batches is None or sent < max_batches:
+            payload = build_batch(self.node, cursors, self.batch_size)
+            if payload is None:
+                break
+            acked = self.send(payload)['acked']
+            for kind in KINDS:
+                if payload[kind] and acked.get(kind, 0) < payload[kind][-1][0]:
+                    raise SyncError('hub did not store the %s up to %s' % (kind, payload[kind][-1][0]))
+            self.save_cursors(acked, cursors)
+            cursors = acked
+            sent += 1
+            if all(len(payload[kind]) < self.batch_size for kind in KINDS):
+                break
+        return sent
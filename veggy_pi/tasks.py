@@ -0,0 +1,163 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.db.models import Count, Sum, Min, Max
+from django.utils import timezone
+
+from celery import shared_task
+
+import datetime
+import time
+
+
+from . funcs import from_timestamp
+from . models import Reading, ReadingRollup, Sensor, AsFloat
+from . records import ReadingBatch
+
+
+def rollup_keys(records, period):
+    """
+    returns the unique (sensor_id, bucket_start) pairs touched by a batch of
+    (sensor_id, timestamp, data) records - bucket_start is an epoch timestamp
+    aligned to the rollup period.
+    """
+    keys = set()
+    for sensor_id, created_at, data in records:
+        bucket = int(float(created_at) // period * period)
+        keys.add((sensor_id, bucket))
+    return sorted(keys)
+
+
+@shared_task(ignore_result=True)
+def ingest_readings(records):
+    """
+    persists a batch of (sensor_id, timestamp, data) records through the bulk
+    ingest path and queues a single rollup update for all of the buckets the
+    batch touched.
+    """
+    Reading.objects.bulk_ingest(records)
+
+    keys = rollup_keys(records, settings.VEGGY_PI_ROLLUP_PERIOD)
+    if keys:
+        update_rollups.delay(keys)
+    return len(records)
+
+
+@shared_task(ignore_result=True)
+def update_rollups(keys, period=None):
+    """
+    re-aggregates the rollup rows for the given (sensor_id, bucket_start)
+    pairs from the raw readings - duplicate keys are coalesced so each bucket
+    is only computed once per call.
+    """
+    period = period or settings.VEGGY_PI_ROLLUP_PERIOD
+
+    for sensor_id, bucket in sorted(set(tuple(key) for key in keys)):
+        bucket_start = from_timestamp(bucket)
+        bucket_end = bucket_start + datetime.timedelta(seconds=period)
+
+        values = Reading.objects.filter(
+            sensor_id=sensor_id,
+            created_at__gte=bucket_start,
+            created_at__lt=bucket_end,
+        ).aggregate(
+            count=Count('id'),
+            total=Sum(AsFloat('data')),
+            minimum=Min(AsFloat('data')),
+            maximum=Max(AsFloat('data')),
+        )
+        values['total'] = values['total'] or 0
+
+        ReadingRollup.objects.update_or_create(
+            sensor_id=sensor_id,
+            period=period,
+            bucket_start=bucket_start,
+            defaults=values,
+        )
+    return len(keys)
+
+
+@shared_task(ignore_result=True)
+def purge_readings(days=None, chunk_size=1000):
+    """
+    deletes raw readings older than `days` (defaults to the
+    VEGGY_PI_READING_RETENTION_DAYS setting) in chunks so the database is
+    never locked for long. readings which are still the current_reading of a
+    sensor are kept - deleting them would cascade to the sensor.
+    """
+    days = days or settings.VEGGY_PI_READING_RETENTION_DAYS
+    if not days:
+        return 0
+
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    current = Sensor.objects.exclude(current_reading=None).values_list('current_reading_id', flat=True)
+
+    deleted = 0
+    while True:
+        ids = list(
+            Reading.objects.filter(created_at__lt=cutoff)
+            .exclude(id__in=list(current))
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        Reading.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if len(ids) < chunk_size:
+            break
+    return deleted
+
+
+class ReadingBatcher(object):
+    """
+    collects readings in memory and hands them to the ingest task in batches,
+    so the sensing loop only ever appends to a ReadingBatch and never waits
+    on the database. a batch is sent once it holds `batch_size` readings or its
+    oldest reading is `max_age` seconds old, whichever comes first - the loop
+    calls tick() on every pass, so the age limit holds when readings stop.
+    """
+    def __init__(self, batch_size=None, max_age=None, task=None, clock=time.time):
+        self.batch_size = batch_size or settings.VEGGY_PI_INGEST_BATCH_SIZE
+        self.max_age = max_age if max_age is not None else settings.VEGGY_PI_INGEST_BATCH_AGE
+        self.task = task or ingest_readings
+        self.clock = clock
+        self._records = ReadingBatch()
+        self._started = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, sensor_id, data, created_at=None):
+        now = self.clock()
+        if created_at is None:
+            created_at = now
+
+        if not self._records:
+            self._started = now
+        self._records.append(sensor_id, created_at, data)
+
+        if len(self._records) >= self.batch_size:
+            self.flush()
+        else:
+            self.tick(now)
+
+    def tick(self, now=None):
+        """
+        sends the batch if its oldest reading is `max_age` seconds old,
+        returns the batch size.
+        """
+        if now is None:
+            now = self.clock()
+        if self._records and now - self._started >= self.max_age:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        sends whatever has been collected so far, returns the batch size.
+        """
+        if not self._records:
+            return 0
+        records, self._records = self._records, ReadingBatch()
+        self.task.delay(records.to_list())
+        return len(records)
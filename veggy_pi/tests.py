@@ -1,4 +1,12 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
 
 from . funcs import (
     is_number,
@@ -9,19 +17,64 @@ from . models import (
     Condition,
     ConditionGroup,
     Operator,
+    OperandType,
     SensorState,
     VeggyConfiguration,
     ConfigurationOption,
     UserInput,
     Pin,
+    RPiPin,
     DHT22Sensor,
+    Sensor,
+    Reading,
+    ReadingRollup,
+    Input,
+    SyncCursor,
+    )
+
+from . broker import Broker, broker
+from . cache import latest_readings as latest_readings_cache
+from . benchmarks import bench_hotpaths, bench_records, compare, file_databases
+from . routers import WorkloadRouter
+from . schedule import ScheduleTimeline, timeline as schedule_timeline
+from . import compliance
+from . import querybudget
+from . import config_io
+from . simulator import Replay, stream_readings
+from . pagination import EstimatedCountPaginator, estimated_count
+from . filters import ExponentialSmoothing, Median, MovingAverage, OutlierRejection, SensorFilters
+from . import metrics
+from . profiling import profiler
+from . quantiles import P2Quantile
+from . records import ReadingBatch, ReadingRecord
+from . sync import SyncClient, build_batch, encode, ingest_batch
+from . ingest import InputNormalizer, input_normalizer
+from . import partitions
+from . serializers import ReadingSerializer, FastReadingSerializer
+from . actuators import ActuatorQueue, GPIOWriter
+from . controller import Controller
+
+from . tasks import (
+    ingest_readings,
+    purge_readings,
+    ReadingBatcher,
     )
 
 from www.settings import TIME_ZONE
 
+from django.utils import timezone
 
-from datetime import datetime
+
+from datetime import datetime, timedelta
+import json
+import os
+import pstats
 import pytz
+import random
+import subprocess
+import sys
+import tempfile
+import time
 
 
 class TestPureFunctions(TestCase):
@@ -65,6 +118,26 @@ class TestCondition(TestCase):
         self.assertFalse(c1.evaluate(SensorState(SENSOR_1='13')))
         self.assertTrue(c2.evaluate(SensorState(SENSOR_2='jack daniels')))
 
+    def test_rhs_parsed_on_save(self):
+        c1 = Condition.objects.create(lhs='SENSOR_1', rhs='21.5', operator=Operator.GTE)
+        c2 = Condition.objects.create(lhs='SENSOR_2', rhs='on', operator=Operator.EQUALS)
+        c1 = Condition.objects.get(pk=c1.pk)
+
+        self.assertEqual((c1.rhs_type, c1.rhs_number), (OperandType.NUMBER, 21.5))
+        self.assertEqual((c2.rhs_type, c2.rhs_number), (OperandType.TEXT, None))
+        self.assertTrue(c1.evaluate(SensorState(SENSOR_1='22')))
+        self.assertTrue(c1.evaluate({'SENSOR_1': '22'}))
+        self.assertFalse(c1.evaluate(SensorState(SENSOR_1='9')))
+        self.assertTrue(c2.evaluate(SensorState(SENSOR_2='on')))
+
+    def test_sensor_state_stores_numbers(self):
+        state = SensorState([('TEMP', '21.5')], RH=60, STATUS='ok')
+        state['PH'] = '6.1'
+        self.assertEqual(state['TEMP'], 21.5)
+        self.assertEqual(state['PH'], 6.1)
+        self.assertEqual(state['STATUS'], 'ok')
+        self.assertEqual(SensorState(sensors={'VPD': lambda: 1.2})['VPD'], 1.2)
+
 
 class TestConditionGroup(TestCase):
     def setUp(self):
@@ -291,6 +364,21 @@ class TestVeggyConfiguration(TestCase):
         exception = ex.exception
         self.assertEquals(exception.args, (u'%s must be in range %s' % (float(self.user_min_ph.value), self.ph_range),))
     
+    def test_ph_range_validation(self):
+        """
+        a min_ph below the max_ph is valid, one above it isn't.
+        """
+        UserInput.objects.filter(veggy_config=self.main_config, variable=self.min_ph).update(value=u'5')
+        UserInput.objects.filter(veggy_config=self.main_config, variable=self.max_ph).update(value=u'7')
+        values = self.main_config.get_values([], [])
+        self.main_config.validate_unique_values(self.main_config.get_unique_values(values))
+
+        UserInput.objects.filter(veggy_config=self.main_config, variable=self.max_ph).update(value=u'4')
+        values = self.main_config.get_values([], [])
+        with self.assertRaises(ValueError) as ex:
+            self.main_config.validate_unique_values(self.main_config.get_unique_values(values))
+        self.assertEquals(ex.exception.args, (u'5.0 must not be greater than 4.0',))
+
     def test_temp_input_with_invalid_format(self):
         self.user_temp_format.value = u'inexistant'
         self.user_temp_format.save()
@@ -327,3 +415,1458 @@ class TestVeggyConfiguration(TestCase):
         VeggyConfiguration.objects.all().delete()
         UserInput.objects.all().delete()
         ConfigurationOption.objects.all().delete()
+
+
+class TestSchedule(TestCase):
+    def setUp(self):
+        self.now = datetime(2026, 10, 19, 0, 0, 0, 0, pytz.UTC)
+        at = lambda hour: datetime(2026, 1, 1, hour, 0, 0, 0, pytz.UTC)
+        self.main_config = VeggyConfiguration.objects.create(label=u'main_config')
+        self.day_config = VeggyConfiguration.objects.create(
+            label=u'day_config', parent_config=self.main_config, start_time=at(6), end_time=at(18))
+        self.night_config = VeggyConfiguration.objects.create(
+            label=u'night_config', parent_config=self.main_config, start_time=at(18), end_time=at(6))
+        self.override_config = VeggyConfiguration.objects.create(
+            label=u'override_config', parent_config=self.day_config, start_time=at(12), end_time=at(13))
+        self.timeline = ScheduleTimeline(hours=48, reload_interval=3600)
+
+    def tearDown(self):
+        schedule_timeline.clear()
+
+    def active(self, hours):
+        return self.timeline.active(self.now + timedelta(hours=hours))
+
+    def test_active(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.active(3), self.night_config.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.active(8), self.day_config.pk)
+            self.assertEqual(self.active(12.5), self.override_config.pk)
+            self.assertEqual(self.active(13), self.day_config.pk)
+            self.assertEqual(self.active(23), self.night_config.pk)
+
+        labels = [(start.hour, pk) for start, end, pk in self.timeline.intervals()[:5]]
+        self.assertEqual(labels, [
+            (3, self.night_config.pk), (6, self.day_config.pk), (12, self.override_config.pk),
+            (13, self.day_config.pk), (18, self.night_config.pk),
+        ])
+
+    def test_horizon_extended(self):
+        self.active(0)
+        self.assertEqual(self.active(28), self.night_config.pk)
+        self.assertEqual(self.active(24 * 10 + 12.5), self.override_config.pk)
+        self.assertEqual(self.timeline.intervals()[0][0], self.now + timedelta(hours=24 * 10 + 12.5))
+
+    def test_no_config_active(self):
+        self.main_config.delete()
+        self.assertEqual(self.active(3), self.night_config.pk)
+        self.night_config.delete()
+        self.timeline.clear()
+        self.assertIsNone(self.active(3))
+
+    def test_rescheduled_on_save(self):
+        schedule_timeline.active(self.now)
+        self.day_config.end_time = datetime(2026, 1, 1, 10, 0, 0, 0, pytz.UTC)
+        self.day_config.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(schedule_timeline.active(self.now + timedelta(hours=9)), self.day_config.pk)
+            self.assertEqual(schedule_timeline.active(self.now + timedelta(hours=11)), self.main_config.pk)
+            self.assertEqual(schedule_timeline.active(self.now + timedelta(hours=12.5)), self.override_config.pk)
+
+    def test_rescheduled_on_delete(self):
+        schedule_timeline.active(self.now)
+        self.day_config.delete()
+        # the override lost its parent and now ties with the main config
+        self.assertEqual(schedule_timeline.active(self.now + timedelta(hours=8)), self.main_config.pk)
+        self.assertEqual(schedule_timeline.active(self.now + timedelta(hours=12.5)), self.override_config.pk)
+
+    def test_refresh(self):
+        self.active(0)
+        VeggyConfiguration.objects.filter(pk=self.override_config.pk).update(parent_config=self.main_config)
+        self.assertEqual(self.active(12.5), self.override_config.pk)
+        VeggyConfiguration.objects.filter(pk=self.override_config.pk).delete()
+        self.assertEqual(self.active(12.5), self.override_config.pk)
+        self.timeline.refresh()
+        self.assertEqual(self.active(12.5), self.day_config.pk)
+
+
+class TestCompliance(TestCase):
+    def setUp(self):
+        self.t0 = datetime(2026, 10, 18, 0, 0, 0, 0, pytz.UTC)
+        self.main_config = VeggyConfiguration.objects.create(label=u'main_config')
+        self.options = {}
+        for label, value in ((u'temp_format', u'celcius'), (u'min_temp', u'20'), (u'max_temp', u'28'), (u'max_ph', u'7')):
+            self.options[label] = ConfigurationOption.objects.create(option_label=label)
+            UserInput.objects.create(veggy_config=self.main_config, variable=self.options[label], value=value)
+
+        # 22 for an hour, then 30 (too hot) and 18 (too cold) for half an
+        # hour each and 25 for the last hour - one reading a minute
+        self.sensor = Sensor.objects.create(name=u'TEMP')
+        values = [u'22'] * 60 + [u'30'] * 30 + [u'18'] * 30 + [u'25'] * 60
+        Reading.objects.bulk_ingest(
+            (self.sensor.pk, self.t0 + timedelta(minutes=i), value) for i, value in enumerate(values)
+        )
+        self.end = self.t0 + timedelta(hours=3)
+
+    def check(self, **kwargs):
+        results = compliance.check_compliance(self.t0, self.end, sensors={u'temp': u'TEMP', u'ph': u'PH'}, **kwargs)
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_violations(self):
+        result = self.check()
+        self.assertEqual(result[u'metric'], u'temp')
+        self.assertEqual(result[u'out_of_range_seconds'], 3600)
+        self.assertEqual([(v[u'start'], v[u'end'], v[u'kind'], v[u'config']) for v in result[u'violations']], [
+            (self.t0 + timedelta(minutes=60), self.t0 + timedelta(minutes=90), u'high', self.main_config.pk),
+            (self.t0 + timedelta(minutes=90), self.t0 + timedelta(minutes=120), u'low', self.main_config.pk),
+        ])
+
+    def test_chunks(self):
+        # runs spanning several chunks come out whole
+        self.assertEqual(self.check(chunk=7 * 60)[u'violations'], self.check()[u'violations'])
+
+    def test_max_gap(self):
+        Reading.objects.filter(
+            created_at__gt=self.t0 + timedelta(minutes=60), created_at__lt=self.t0 + timedelta(minutes=90),
+        ).exclude(latest_sensor=self.sensor).delete()
+        self.assertEqual(self.check(max_gap=15 * 60)[u'out_of_range_seconds'], 15 * 60 + 30 * 60)
+
+    def test_temp_format(self):
+        UserInput.objects.filter(variable=self.options[u'temp_format']).update(value=u'farenheit')
+        UserInput.objects.filter(variable=self.options[u'min_temp']).update(value=u'68')
+        UserInput.objects.filter(variable=self.options[u'max_temp']).update(value=u'82.4')
+        low, high = compliance.resolve_thresholds(self.main_config)[u'temp']
+        self.assertAlmostEqual(low, 20)
+        self.assertAlmostEqual(high, 28)
+        self.assertEqual(self.check()[u'out_of_range_seconds'], 3600)
+
+    def test_scheduled_config(self):
+        # from 01:00 to 02:00 a child config allows up to 35 degrees
+        night_config = VeggyConfiguration.objects.create(
+            label=u'night_config', parent_config=self.main_config,
+            start_time=self.t0 + timedelta(hours=1), end_time=self.t0 + timedelta(hours=2),
+        )
+        UserInput.objects.create(veggy_config=night_config, variable=self.options[u'max_temp'], value=u'35')
+        result = self.check()
+        self.assertEqual([(v[u'kind'], v[u'config'], v[u'seconds']) for v in result[u'violations']], [
+            (u'low', night_config.pk, 1800),
+        ])
+
+    def test_non_numeric_readings(self):
+        Reading.objects.bulk_ingest([
+            (self.sensor.pk, self.t0 + timedelta(minutes=10, seconds=30), u'on'),
+            (self.sensor.pk, self.t0 + timedelta(minutes=75, seconds=30), u'ok'),
+        ])
+        # neither is out of range, the second one interrupts the run
+        self.assertEqual(self.check()[u'out_of_range_seconds'], 3600 - 30)
+
+    def test_only_out_of_range_rows_fetched(self):
+        start, end = compliance.to_timestamp(self.t0), compliance.to_timestamp(self.end)
+        rows = compliance.out_of_range(self.sensor.pk, start, end, 15 * 60, 20, 28)
+        self.assertEqual(len(rows), 60)
+        self.assertEqual(rows[0], (start + 3600, start + 3660, 30))
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True, VEGGY_PI_ROLLUP_PERIOD=3600)
+class TestReadingIngest(TestCase):
+    def setUp(self):
+        self.s1 = Sensor.objects.create(name=u'tent_temp')
+        self.s2 = Sensor.objects.create(name=u'tent_rh')
+        self.t0 = datetime(2016, 6, 20, 12, 0, 0, 0, pytz.UTC)
+
+    def test_bulk_ingest_moves_current_reading(self):
+        records = [
+            (self.s1.pk, self.t0 + timedelta(seconds=10), u'21.5'),
+            (self.s1.pk, self.t0, u'21.0'),
+            (self.s2.pk, self.t0, u'55'),
+        ]
+        self.assertEqual(Reading.objects.bulk_ingest(records), 3)
+
+        self.s1.refresh_from_db()
+        self.s2.refresh_from_db()
+        self.assertEqual(self.s1.current_reading.data, u'21.5')
+        self.assertEqual(self.s1.current_reading.created_at, self.t0 + timedelta(seconds=10))
+        self.assertEqual(self.s2.current_reading.data, u'55')
+
+    def test_ingest_task_updates_rollups(self):
+        ts = 1466424000  # 2016-06-20 12:00 utc
+        ingest_readings([
+            [self.s1.pk, ts + 60, u'20'],
+            [self.s1.pk, ts + 120, u'24'],
+            [self.s1.pk, ts + 3600, u'30'],
+        ])
+        rollups = ReadingRollup.objects.filter(sensor=self.s1).order_by('bucket_start')
+        self.assertEqual(rollups.count(), 2)
+        self.assertEqual(rollups[0].bucket_start, self.t0)
+        self.assertEqual(rollups[0].count, 2)
+        self.assertEqual(rollups[0].minimum, 20)
+        self.assertEqual(rollups[0].maximum, 24)
+        self.assertEqual(rollups[0].average, 22)
+
+    def test_purge_keeps_current_reading(self):
+        old = self.t0 - timedelta(days=30)
+        Reading.objects.bulk_ingest([(self.s1.pk, old + timedelta(seconds=i), u'%s' % i) for i in range(5)])
+        Reading.objects.bulk_ingest([(self.s2.pk, old, u'50')])
+        Reading.objects.bulk_ingest([(self.s1.pk, timezone.now(), u'99')])
+
+        self.assertEqual(purge_readings(days=7, chunk_size=2), 5)
+        self.assertEqual(Reading.objects.count(), 2)
+        self.assertTrue(Sensor.objects.filter(pk=self.s2.pk).exists())
+
+    def test_batcher_flushes_on_size_and_age(self):
+        sent = []
+
+        class FakeTask(object):
+            def delay(self, records):
+                sent.append(records)
+
+        clock = [0.0]
+        batcher = ReadingBatcher(batch_size=3, max_age=5, task=FakeTask(), clock=lambda: clock[0])
+        batcher.add(self.s1.pk, u'1')
+        batcher.add(self.s1.pk, u'2')
+        self.assertEqual(sent, [])
+        batcher.add(self.s1.pk, u'3')
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(len(sent[0]), 3)
+
+        batcher.add(self.s1.pk, u'4')
+        clock[0] = 6.0
+        batcher.add(self.s1.pk, u'5', created_at=self.t0)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sent[1][1][1], 1466424000)
+        self.assertEqual(batcher.flush(), 0)
+
+        # no more readings come in - the partial batch still goes out
+        batcher.add(self.s1.pk, u'6')
+        clock[0] = 10.0
+        self.assertEqual(batcher.tick(), 0)
+        clock[0] = 11.0
+        self.assertEqual(batcher.tick(), 1)
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(batcher.tick(), 0)
+
+
+class TestInputNormalizer(TestCase):
+    def setUp(self):
+        self.sensor = Sensor.objects.create(name=u'TEMP')
+        input_normalizer.clear()
+
+    def test_normalized_on_save(self):
+        temp = Input.objects.create(sensor_name=u'TEMP', value=u'21.5')
+        self.assertEqual((temp.sensor_id, temp.value_number, temp.normalized), (self.sensor.pk, 21.5, True))
+        switch = Input.objects.create(sensor_name=u'SWITCH', value=u'on')
+        self.assertEqual((switch.sensor_id, switch.value_number, switch.normalized), (None, None, True))
+        self.assertEqual(list(Input.objects.filter(sensor=self.sensor, value_number__gt=20)), [temp])
+
+        # i.e. edited in the admin
+        temp.sensor_name, temp.value = u'SWITCH', u'off'
+        temp.save()
+        temp.refresh_from_db()
+        self.assertEqual((temp.sensor_id, temp.value_number), (None, None))
+
+    def test_cache(self):
+        normalizer = InputNormalizer()
+        with self.assertNumQueries(1):
+            normalizer.normalize([Input(sensor_name=u'TEMP', value=u'1'), Input(sensor_name=u'RH', value=u'2')])
+        with self.assertNumQueries(0):
+            normalizer.normalize([Input(sensor_name=u'TEMP', value=u'1')])
+        # names without a sensor are looked up again
+        with self.assertNumQueries(1):
+            normalizer.normalize([Input(sensor_name=u'RH', value=u'2')])
+
+    def test_cache_cleared_on_rename(self):
+        input_normalizer.normalize([Input(sensor_name=u'TEMP', value=u'1')])
+        Reading(sensor=self.sensor, data=u'21').save()
+        with self.assertNumQueries(0):
+            input_normalizer.normalize([Input(sensor_name=u'TEMP', value=u'1')])
+
+        self.sensor.name = u'TEMP_OLD'
+        self.sensor.save()
+        Sensor.objects.create(name=u'TEMP')
+        self.assertNotEqual(input_normalizer.normalize([Input(sensor_name=u'TEMP', value=u'1')])[0].sensor_id,
+                            self.sensor.pk)
+
+    def test_backfill(self):
+        Input.objects.bulk_create([Input(sensor_name=u'TEMP', value=u'%s' % i) for i in range(25)])
+        self.assertEqual(Input.objects.filter(normalized=False).count(), 25)
+
+        # an interrupted backfill carries on where it stopped
+        self.assertEqual(input_normalizer.backfill(chunk_size=10, max_chunks=1), 10)
+        self.assertEqual(Input.objects.filter(normalized=False).count(), 15)
+        out = StringIO()
+        call_command(u'normalize_inputs', chunk_size=10, stdout=out)
+        self.assertIn(u'15 inputs normalized', out.getvalue())
+        self.assertEqual(input_normalizer.backfill(), 0)
+        self.assertEqual(Input.objects.filter(sensor=self.sensor, value_number__gte=20).count(), 5)
+
+    def test_synced_inputs(self):
+        result = ingest_batch({
+            u'node': u'room-1',
+            u'sensors': {u'7': u'TEMP'},
+            u'readings': [[1, 7, u'2026-10-18T00:00:00+00:00', u'21']],
+            u'inputs': [[1, u'TEMP', u'2026-10-18T00:00:00+00:00', u'21']],
+        })
+        self.assertEqual(result[u'created'], 2)
+        synced = Input.objects.get(origin=u'room-1')
+        # the sensor of the node, not the local one of the same name
+        self.assertEqual(synced.sensor, Sensor.objects.get(origin=u'room-1'))
+        self.assertEqual(synced.value_number, 21)
+
+
+class TestReadingRecords(TestCase):
+    def test_batch_round_trip(self):
+        t0 = datetime(2016, 6, 20, 12, 0, 0, 0, pytz.UTC)
+        batch = ReadingBatch([(1, t0, u'21.5'), (2, 1466424001.5, u'60')])
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch[0], ReadingRecord(1, 1466424000.0, u'21.5'))
+        self.assertEqual(batch.to_list(), [[1, 1466424000.0, u'21.5'], [2, 1466424001.5, u'60']])
+
+        sensor_id, created_at, data = batch[1]
+        self.assertEqual((sensor_id, created_at, data), (2, 1466424001.5, u'60'))
+        self.assertEqual(batch[1].as_event()[u'created_at'], u'2016-06-20T12:00:01.500000+00:00')
+
+    def test_bulk_ingest_builds_models_per_chunk(self):
+        sensor = Sensor.objects.create(name=u'tent_temp')
+        batch = ReadingBatch((sensor.pk, 1466424000 + i, u'%s' % i) for i in range(5))
+        with self.assertNumQueries(4):
+            self.assertEqual(Reading.objects.bulk_ingest(batch, batch_size=2), 5)
+        self.assertEqual(Sensor.objects.get(pk=sensor.pk).current_reading.data, u'4')
+
+    def test_records_are_smaller_than_models(self):
+        result = bench_records(rows=200)
+        self.assertLess(result[u'batch_bytes_per_reading'], result[u'record_bytes_per_reading'])
+        self.assertLess(result[u'record_bytes_per_reading'], result[u'model_bytes_per_reading'])
+
+
+class TestActuatorQueue(TestCase):
+    def setUp(self):
+        self.relay = RPiPin(pin_number=11, label=u'gpio_17')
+        self.fan = RPiPin(pin_number=13, label=u'gpio_27')
+        self.clock = [0.0]
+        self.writes = []
+        self.queue = ActuatorQueue(
+            min_on=10, min_off=5, max_switches=3, window=60,
+            clock=lambda: self.clock[0],
+            writer=lambda pin, state: self.writes.append((pin.pin_number, state)),
+        )
+
+    def test_last_writer_wins_within_tick(self):
+        self.queue.submit(self.relay, True)
+        self.queue.submit(self.fan, True)
+        self.queue.submit(self.relay, False)
+        self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(self.writes, [(13, True), (11, False)])
+        self.assertEqual(self.queue.stats['coalesced'], 1)
+        self.assertEqual(self.queue.suppressed, 1)
+
+    def test_unchanged_and_min_time(self):
+        self.queue.submit(self.relay, True)
+        self.queue.flush()
+        self.queue.submit(self.relay, True)
+        self.queue.flush()
+        self.assertEqual(self.queue.stats['unchanged'], 1)
+
+        self.clock[0] = 9
+        self.queue.submit(self.relay, False)
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.queue.stats['min_time'], 1)
+
+        self.clock[0] = 10
+        self.queue.submit(self.relay, False)
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertFalse(self.queue.state(11))
+
+    def test_max_switching_rate(self):
+        queue = ActuatorQueue(min_on=0, min_off=0, max_switches=3, window=60, clock=lambda: self.clock[0],
+                              writer=lambda pin, state: self.writes.append((pin.pin_number, state)))
+        for i in range(6):
+            self.clock[0] = i
+            queue.submit(self.relay, i % 2 == 0)
+            queue.flush()
+        self.assertEqual(len(self.writes), 3)
+        self.assertEqual(queue.stats['rate_limited'], 2)
+        self.assertEqual(queue.suppressed, 3)
+
+        self.clock[0] = 61
+        queue.submit(self.relay, False)
+        self.assertEqual(queue.flush(), 1)
+
+    def test_gpio_writer_sets_up_pins_on_first_write(self):
+        calls = []
+
+        class FakePin(object):
+            def __init__(self, pin_number):
+                self.pin_number = pin_number
+
+            def setup(self):
+                calls.append(u'setup')
+
+            def set_mode(self, mode):
+                calls.append((self.pin_number, mode))
+
+            def set_output(self, out=False):
+                calls.append((self.pin_number, out))
+
+        writer = GPIOWriter()
+        writer(FakePin(11), True)
+        writer(FakePin(11), False)
+        # a pin of a group added while the loop runs
+        writer(FakePin(13), True)
+        self.assertEqual(calls, [
+            u'setup', (11, u'output'), (11, True), (11, False), (13, u'output'), (13, True),
+        ])
+
+
+class TestController(TestCase):
+    def test_groups_sharing_a_relay_write_once(self):
+        relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        heat = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        frost = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'20', group=heat)
+        Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'2', group=frost)
+
+        writes = []
+        queue = ActuatorQueue(writer=lambda pin, state: writes.append((pin.pin_number, state)))
+        controller = Controller(actuators=queue)
+
+        self.assertEqual(controller.tick(SensorState(TEMP=15)), 1)
+        self.assertEqual(controller.tick(SensorState(TEMP=15)), 0)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(queue.stats['submitted'], 4)
+
+    def test_condition_edits_picked_up(self):
+        relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        condition = Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'20', group=group)
+        controller = Controller(actuators=ActuatorQueue(writer=lambda pin, state: None))
+        controller.tick(SensorState(TEMP=15))
+        self.assertTrue(controller.states[group.pk])
+
+        condition.rhs = u'10'
+        condition.save()
+        controller.tick(SensorState(TEMP=15))
+        # the prefetched conditions hold until the reload interval has passed
+        self.assertTrue(controller.states[group.pk])
+
+        controller.reload_interval = 0
+        controller.tick(SensorState(TEMP=15))
+        self.assertFalse(controller.states[group.pk])
+
+    def test_run_reads_current_sensor_values(self):
+        relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'20', group=group)
+        sensor = Sensor.objects.create(name=u'TEMP')
+        Reading.objects.create(sensor=sensor, data=u'15')
+
+        out = StringIO()
+        call_command(u'run_controller', ticks=2, interval=0, dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), u'pin 11 -> HIGH\n')
+
+    def test_slim_settings_skip_web_stack(self):
+        script = (
+            u'import django, sys; django.setup(); import veggy_pi.controller; '
+            u'print(",".join(m for m in ("rest_framework", "celery", "django.contrib.admin") if m in sys.modules))'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=u'www.settings_controller')
+        output = subprocess.check_output([sys.executable, u'-c', script], cwd=settings.BASE_DIR, env=env)
+        self.assertEqual(output.strip(), b'')
+
+
+class TestSimulator(TestCase):
+    def setUp(self):
+        self.t0 = datetime(2026, 10, 18, 0, 0, 0, 0, pytz.UTC)
+        self.relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        self.group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=self.relay)
+        self.condition = Condition.objects.create(lhs=u'TEMP', operator=Operator.GT, rhs=u'25', group=self.group)
+
+        # 20 and 30 degrees, switching every 10 minutes for two hours
+        self.sensor = Sensor.objects.create(name=u'TEMP')
+        Reading.objects.bulk_ingest(
+            (self.sensor.pk, self.t0 + timedelta(minutes=10 * i), u'30' if i % 2 else u'20') for i in range(12)
+        )
+        self.end = self.t0 + timedelta(hours=2)
+
+    def test_replay(self):
+        report = Replay(self.t0, self.end, interval=60).run()
+        self.assertEqual(report[u'ticks'], 120)
+        self.assertEqual(report[u'readings'], 12)
+        pin = report[u'pins'][11]
+        self.assertEqual(pin[u'switches'], 11)
+        self.assertEqual(pin[u'on_seconds'], 3600)
+        self.assertEqual(pin[u'duty_cycle'], 0.5)
+        self.assertTrue(pin[u'state'])
+        self.assertGreater(report[u'speedup'], 100)
+
+    def test_actuator_rules_in_virtual_time(self):
+        report = Replay(self.t0, self.end, interval=60, min_on=1200, min_off=1200).run()
+        # on at 00:30, off at 01:00, on at 01:30 - the other changes come
+        # within 20 minutes of the last switch
+        self.assertEqual(report[u'pins'][11][u'switches'], 3)
+        self.assertEqual(report[u'actuators'][u'min_time'], 40)
+
+    def test_warmup_and_initial_state(self):
+        report = Replay(self.t0 - timedelta(minutes=5), self.t0 + timedelta(minutes=15), interval=60).run()
+        self.assertEqual(report[u'warmup_ticks'], 5)
+        # the replay starting at 00:15 knows the reading of 00:10
+        report = Replay(self.t0 + timedelta(minutes=15), self.t0 + timedelta(minutes=18), interval=60).run()
+        self.assertEqual(report[u'warmup_ticks'], 0)
+        self.assertEqual(report[u'pins'][11][u'duty_cycle'], 1)
+
+    def test_replay_leaves_live_metrics_alone(self):
+        path = os.path.join(tempfile.mkdtemp(), u'veggy_pi.prom')
+        ticks = metrics.TICK_SECONDS.count
+        writes = metrics.GPIO_WRITES.value
+        evaluations = metrics.CONDITION_EVALUATIONS.value
+        subscription = broker.subscribe()
+        self.addCleanup(broker.unsubscribe, subscription)
+        with override_settings(VEGGY_PI_METRICS_TEXTFILE=path, VEGGY_PI_METRICS_INTERVAL=0):
+            Replay(self.t0, self.end, interval=60).run()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(subscription.get(timeout=0), None)
+        self.assertEqual(metrics.TICK_SECONDS.count, ticks)
+        self.assertEqual(metrics.GPIO_WRITES.value, writes)
+        self.assertEqual(metrics.CONDITION_EVALUATIONS.value, evaluations)
+
+    def test_stream_readings(self):
+        other = Sensor.objects.create(name=u'RH')
+        Reading.objects.bulk_ingest((other.pk, self.t0 + timedelta(minutes=10 * i), u'50') for i in range(12))
+        with self.assertNumQueries(9):
+            rows = list(stream_readings(self.t0, self.end, chunk_size=3))
+        self.assertEqual(len(rows), 24)
+        self.assertEqual(rows, sorted(rows, key=lambda row: row[0]))
+        self.assertEqual(len(set(rows)), 24)
+
+    def test_command_rolls_back_rules(self):
+        fixture = tempfile.NamedTemporaryFile(suffix=u'.json', delete=False)
+        self.addCleanup(os.remove, fixture.name)
+        fixture.write(json.dumps([{
+            u'model': u'veggy_pi.condition', u'pk': self.condition.pk,
+            u'fields': {u'lhs': u'TEMP', u'operator': Operator.GT, u'rhs': u'35', u'group': self.group.pk},
+        }]).encode(u'utf-8'))
+        fixture.close()
+
+        out = StringIO()
+        call_command(u'simulate', start=self.t0.isoformat(), end=self.end.isoformat(), interval=60,
+                     rules=[fixture.name], stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report[u'pins'][u'11'][u'duty_cycle'], 0)
+        self.condition.refresh_from_db()
+        self.assertEqual(self.condition.rhs, u'25')
+
+
+class TestFilters(TestCase):
+    def test_moving_average(self):
+        average = MovingAverage(size=3)
+        self.assertEqual([average(v) for v in (3, 6, 9, 12, 3)], [3, 4.5, 6, 9, 8])
+
+    def test_ema(self):
+        ema = ExponentialSmoothing(alpha=0.5)
+        self.assertEqual([ema(v) for v in (10, 20, 20, 0)], [10, 15, 17.5, 8.75])
+        with self.assertRaises(ValueError):
+            ExponentialSmoothing(alpha=0)
+
+    def test_median(self):
+        median = Median(size=3)
+        self.assertEqual([median(v) for v in (5, 1, 9, 2, 100, 3, 3)], [5, 3, 5, 2, 9, 3, 3])
+        self.assertEqual(len(median.ordered), 3)
+
+    def test_outlier_rejection(self):
+        outliers = OutlierRejection(size=6, threshold=3)
+        values = [outliers(v) for v in (21, 21.2, 20.9, 21.1, 85, 21, -40, 21.2)]
+        self.assertEqual(values, [21, 21.2, 20.9, 21.1, 21.1, 21, 21, 21.2])
+
+        # a real change of level is accepted after `size` rejections
+        values = [outliers(30) for i in range(8)]
+        self.assertEqual(values[:6], [21.2] * 6)
+        self.assertEqual(values[6:], [30, 30])
+
+    def test_sensor_filters(self):
+        filters = SensorFilters({u'TEMP': [{u'filter': u'median', u'size': 3}, {u'filter': u'ema', u'alpha': 0.5}]})
+        self.assertEqual([filters.sample(u'TEMP', v) for v in (u'20', u'22', u'90')], [20, 20.5, 21.25])
+        self.assertEqual(filters.sample(u'RH', u'55'), u'55')
+        self.assertEqual(filters.sample(u'TEMP', u'off'), u'off')
+        with self.assertRaises(ValueError):
+            SensorFilters({u'TEMP': [{u'filter': u'kalman'}]}).sample(u'TEMP', 1)
+
+    def test_controller_samples_new_readings_once(self):
+        sensor = Sensor.objects.create(name=u'TEMP')
+        Reading.objects.bulk_ingest([(sensor.pk, timezone.now(), u'20')])
+        controller = Controller(groups=[], filters=SensorFilters({u'TEMP': [{u'filter': u'ema', u'alpha': 0.5}]}))
+        self.assertEqual(controller.read_sensors()[u'TEMP'], 20)
+        Reading.objects.bulk_ingest([(sensor.pk, timezone.now() + timedelta(seconds=1), u'30')])
+        self.assertEqual(controller.read_sensors()[u'TEMP'], 25)
+        self.assertEqual(controller.read_sensors()[u'TEMP'], 25)
+
+    def test_fewer_switches(self):
+        t0 = datetime(2026, 10, 18, 0, 0, 0, 0, pytz.UTC)
+        relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        Condition.objects.create(lhs=u'TEMP', operator=Operator.GT, rhs=u'25', group=group)
+
+        # slowly warming up from 23 to 27 degrees with +-0.8 of noise
+        rng = random.Random(7)
+        sensor = Sensor.objects.create(name=u'TEMP')
+        Reading.objects.bulk_ingest(
+            (sensor.pk, t0 + timedelta(seconds=5 * i), u'%.2f' % (23 + i / 100.0 + rng.uniform(-0.8, 0.8)))
+            for i in range(400)
+        )
+        end = t0 + timedelta(seconds=2000)
+        raw = Replay(t0, end, interval=5, filters=SensorFilters({})).run()
+        filtered = Replay(t0, end, interval=5, filters=SensorFilters({
+            u'TEMP': [{u'filter': u'median', u'size': 5}, {u'filter': u'ema', u'alpha': 0.1}],
+        })).run()
+        self.assertGreater(raw[u'pins'][11][u'switches'], 10)
+        self.assertLessEqual(filtered[u'pins'][11][u'switches'], 3)
+
+
+class TestAdmin(TestCase):
+    def setUp(self):
+        get_user_model().objects.create_superuser(u'admin', u'admin@example.com', u'secret')
+        self.client.login(username=u'admin', password=u'secret')
+        sensors = [Sensor.objects.create(name=u'sensor_%s' % i) for i in range(5)]
+        start = timezone.now() - timedelta(hours=1)
+        Reading.objects.bulk_ingest(
+            (sensors[i % 5].pk, start + timedelta(seconds=i), u'%s' % i) for i in range(250)
+        )
+
+    def changelist(self, model, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(u'admin:veggy_pi_%s_changelist' % model), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query[u'sql'] for query in queries]
+
+    def test_reading_changelist(self):
+        response, queries = self.changelist(u'reading')
+        self.assertEqual(response.context[u'cl'].result_count, 250)
+        self.assertEqual(len(response.context[u'cl'].result_list), 100)
+        # no COUNT(*) of the table and no query per row for the sensors
+        self.assertFalse([sql for sql in queries if u'COUNT(' in sql and u'veggy_pi_reading' in sql])
+        self.assertFalse([sql for sql in queries if u'FROM "veggy_pi_sensor" WHERE "veggy_pi_sensor"."id" =' in sql])
+        self.assertTrue([sql for sql in queries if u'ORDER BY "veggy_pi_reading"."created_at" DESC, "veggy_pi_reading"."id" DESC' in sql])
+
+    def test_filtered_count_is_capped(self):
+        paginator = EstimatedCountPaginator(Reading.objects.filter(data__startswith=u'1'), 10)
+        paginator.count_limit = 50
+        self.assertEqual(paginator.count, 50)
+        paginator = EstimatedCountPaginator(Reading.objects.filter(data=u'1'), 10)
+        self.assertEqual(paginator.count, 1)
+
+    def test_estimated_count(self):
+        self.assertEqual(estimated_count(Reading.objects.all()), 250)
+        Reading.objects.all().delete()
+        self.assertEqual(estimated_count(Reading.objects.all()), 0)
+
+    def test_other_changelists(self):
+        for model in (u'sensor', u'input', u'readingrollup', u'conditiongroup', u'veggyconfiguration',
+                      u'configurationoption', u'rpipin', u'synccursor'):
+            self.changelist(model)
+
+
+class TestReadingApi(TestCase):
+    def setUp(self):
+        self.s1 = Sensor.objects.create(name=u'tent_temp')
+        self.s2 = Sensor.objects.create(name=u'tent_rh')
+        self.t0 = datetime(2016, 6, 20, 12, 0, 0, 0, pytz.UTC)
+        records = []
+        for i in range(25):
+            # pairs of readings share a timestamp to exercise the id tie breaker
+            records.append((self.s1.pk, self.t0 + timedelta(seconds=i // 2), u'%s' % i))
+            records.append((self.s2.pk, self.t0 + timedelta(seconds=i), u'%s' % (50 + i)))
+        Reading.objects.bulk_ingest(records)
+        self.url = reverse(u'reading-list')
+
+    def collect(self, url):
+        ids = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(r[u'id'] for r in response.data[u'results'])
+            url = response.data[u'next']
+        return ids
+
+    def test_pages_walk_every_reading_once(self):
+        ids = self.collect(self.url + u'?page_size=7')
+        expected = list(Reading.objects.order_by(u'-created_at', u'-id').values_list(u'id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_filter_by_sensor_and_window(self):
+        url = u'%s?sensor=%s&since=%s&until=%s&page_size=4' % (
+            self.url, self.s1.pk,
+            (self.t0 + timedelta(seconds=2)).isoformat().replace(u'+', u'%2B'),
+            (self.t0 + timedelta(seconds=5)).isoformat().replace(u'+', u'%2B'),
+        )
+        ids = self.collect(url)
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(set(Reading.objects.filter(id__in=ids).values_list(u'sensor_id', flat=True)), set([self.s1.pk]))
+
+    def test_invalid_filters_and_cursor(self):
+        self.assertEqual(self.client.get(self.url + u'?since=yesterday').status_code, 400)
+        self.assertEqual(self.client.get(self.url + u'?sensor=tent').status_code, 400)
+        self.assertEqual(self.client.get(self.url + u'?cursor=garbage').status_code, 404)
+
+    def test_history_matches_model_serializer(self):
+        url = reverse(u'reading-history') + u'?sensor=%s&page_size=10' % self.s2.pk
+        rows = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            payload = json.loads(response.content.decode(u'utf-8'))
+            rows.extend(payload[u'results'])
+            url = payload[u'next']
+
+        queryset = Reading.objects.filter(sensor=self.s2).order_by(u'-created_at', u'-id')
+        expected = json.loads(json.dumps(ReadingSerializer(queryset, many=True).data))
+        self.assertEqual(rows, expected)
+        self.assertEqual(FastReadingSerializer(FastReadingSerializer.values(queryset)).data, expected)
+
+    def test_sensor_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse(u'sensor-list'))
+        results = dict((r[u'name'], r) for r in response.data[u'results'])
+        self.assertEqual(results[u'tent_temp'][u'current_value'], u'24')
+        self.assertEqual(results[u'tent_rh'][u'current_value'], u'74')
+
+
+class TestLatestReadings(TestCase):
+    def setUp(self):
+        latest_readings_cache.clear()
+        self.s1 = Sensor.objects.create(name=u'tent_temp')
+        self.s2 = Sensor.objects.create(name=u'tent_rh')
+        Reading.objects.bulk_ingest([(self.s1.pk, timezone.now(), u'24.5')])
+        self.url = reverse(u'latest-readings')
+
+    def test_latest_values_and_etag(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        payload = json.loads(response.content.decode(u'utf-8'))
+        self.assertEqual([p[u'data'] for p in payload], [u'24.5', None])
+
+        etag = response[u'ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # unchanged data without a conditional header is served from the cache
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_reading_changes_etag(self):
+        etag = self.client.get(self.url)[u'ETag']
+        Reading.objects.bulk_ingest([(self.s2.pk, timezone.now(), u'60')])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response[u'ETag'], etag)
+        payload = json.loads(response.content.decode(u'utf-8'))
+        self.assertEqual([p[u'data'] for p in payload], [u'24.5', u'60'])
+
+    def test_sensor_changes_change_etag(self):
+        etags = [self.client.get(self.url)[u'ETag']]
+        self.s2.name = u'tent_humidity'
+        self.s2.save()
+        etags.append(self.client.get(self.url)[u'ETag'])
+        s3 = Sensor.objects.create(name=u'tent_ph')
+        etags.append(self.client.get(self.url)[u'ETag'])
+        s3.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(etags)), 3)
+        # the same sensors as before the create
+        self.assertEqual(response[u'ETag'], etags[1])
+        payload = json.loads(response.content.decode(u'utf-8'))
+        self.assertEqual([p[u'name'] for p in payload], [u'tent_temp', u'tent_humidity'])
+
+
+class TestBroker(TestCase):
+    def test_fan_out_coalesce_and_drop(self):
+        events = Broker()
+        fast = events.subscribe(maxsize=2)
+        slow = events.subscribe(maxsize=2)
+
+        events.publish(u'reading', 1, u'a')
+        self.assertEqual(fast.get(timeout=0), (u'reading', u'a'))
+
+        events.publish(u'reading', 1, u'b')
+        events.publish(u'reading', 2, u'c')
+        events.publish(u'reading', 3, u'd')
+        # the slow client never consumed - sensor 1 was coalesced (a -> b)
+        # and then dropped as the oldest key to make room for sensor 3
+        self.assertEqual(slow.coalesced, 1)
+        self.assertEqual(slow.dropped, 1)
+        self.assertEqual(slow.get(timeout=0), (u'reading', u'c'))
+        self.assertEqual(slow.get(timeout=0), (u'reading', u'd'))
+        self.assertEqual(slow.get(timeout=0), None)
+
+        events.unsubscribe(slow)
+        events.publish(u'reading', 1, u'e')
+        self.assertEqual(len(slow), 0)
+
+    @override_settings(VEGGY_PI_STREAM_KEEPALIVE=0)
+    def test_stream_pushes_readings(self):
+        s1 = Sensor.objects.create(name=u'tent_temp')
+        s2 = Sensor.objects.create(name=u'tent_rh')
+        response = self.client.get(reverse(u'reading-stream') + u'?sensor=%s' % s1.pk)
+        self.assertEqual(response[u'Content-Type'], u'text/event-stream')
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b'retry: 2000\n\n')
+
+        Reading.objects.bulk_ingest([(s2.pk, timezone.now(), u'60'), (s1.pk, timezone.now(), u'24.5')])
+        chunk = next(stream).decode(u'utf-8')
+        self.assertTrue(chunk.startswith(u'event: reading\n'))
+        self.assertEqual(json.loads(chunk.split(u'data: ')[1])[u'data'], u'24.5')
+        self.assertEqual(next(stream), b': keepalive\n\n')
+
+        response.close()
+        self.assertEqual(broker._subscriptions, [])
+
+    def test_stream_closed_unread(self):
+        # i.e. HEAD, or a client gone before the first chunk
+        self.client.head(reverse(u'reading-stream')).close()
+        self.client.get(reverse(u'reading-stream')).close()
+        self.assertEqual(broker._subscriptions, [])
+
+
+class TestBulkUpload(TestCase):
+    def setUp(self):
+        self.s1 = Sensor.objects.create(name=u'esp_temp')
+        self.user = get_user_model().objects.create_superuser(u'esp', u'esp@localhost', u'esp')
+        self.url = reverse(u'reading-bulk')
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type=u'application/json')
+
+    def test_per_record_status(self):
+        self.client.force_login(self.user)
+        response = self.post([
+            [self.s1.pk, 1466424000, 21.5],
+            [self.s1.pk, u'2016-06-20T12:00:10Z', u'21.7'],
+            [self.s1.pk + 100, 1466424000, 20],
+            [self.s1.pk, u'yesterday', 20],
+            [self.s1.pk, 1466424000],
+            # out of range of time_t
+            [self.s1.pk, 1e20, 20],
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[u'accepted'], 2)
+        self.assertEqual(response.data[u'rejected'], 4)
+        self.assertEqual(response.data[u'status'], [
+            u'ok', u'ok', u'unknown sensor', u'invalid timestamp', u'expected [sensor, timestamp, value]',
+            u'invalid timestamp',
+        ])
+
+        self.s1.refresh_from_db()
+        self.assertEqual(self.s1.current_reading.data, u'21.7')
+        self.assertEqual(self.s1.current_reading.created_at, datetime(2016, 6, 20, 12, 0, 10, 0, pytz.UTC))
+
+    def test_rejects_bad_payload_and_anonymous(self):
+        self.assertIn(self.post([[self.s1.pk, 1466424000, 1]]).status_code, (401, 403))
+        self.client.force_login(self.user)
+        self.assertEqual(self.post({u'readings': 5}).status_code, 400)
+        with override_settings(VEGGY_PI_BULK_UPLOAD_MAX=1):
+            self.assertEqual(self.post([[self.s1.pk, 1466424000, 1]] * 2).status_code, 400)
+        self.assertEqual(Reading.objects.count(), 0)
+
+
+class TestWindowAggregate(TestCase):
+    def setUp(self):
+        self.s1 = Sensor.objects.create(name=u'tent_temp')
+        self.s2 = Sensor.objects.create(name=u'tent_rh')
+        self.t0 = datetime(2016, 6, 20, 12, 0, 0, 0, pytz.UTC)
+        records = []
+        for i in range(30):
+            records.append((self.s1.pk, self.t0 + timedelta(minutes=7 * i), u'%s' % i))
+            records.append((self.s2.pk, self.t0 + timedelta(minutes=7 * i), u'%s' % (100 - i)))
+        Reading.objects.bulk_ingest(records)
+
+    def test_p2_quantile(self):
+        rng = random.Random(42)
+        samples = [rng.gauss(20, 3) for i in range(20000)]
+        sketch = P2Quantile(0.95)
+        for x in samples:
+            sketch.add(x)
+        samples.sort()
+        self.assertAlmostEqual(sketch.value, samples[int(0.95 * len(samples))], delta=0.1)
+
+        small = P2Quantile(0.5)
+        for x in (3, 1, 2):
+            small.add(x)
+        self.assertEqual(small.value, 2)
+
+    def test_hourly_buckets(self):
+        with self.assertNumQueries(1):
+            buckets = Reading.objects.filter(sensor=self.s1).window_aggregate(3600, (u'min', u'max', u'avg', u'count'))
+        self.assertEqual([b[u'bucket'] for b in buckets], [self.t0 + timedelta(hours=h) for h in range(4)])
+        self.assertEqual([b[u'count'] for b in buckets], [9, 9, 8, 4])
+        self.assertEqual(buckets[1][u'min'], 9)
+        self.assertEqual(buckets[1][u'max'], 17)
+        self.assertEqual(buckets[1][u'avg'], 13)
+
+    def test_percentiles_stream_per_sensor(self):
+        with self.assertNumQueries(2):
+            buckets = Reading.objects.all().window_aggregate(3600, (u'max', u'p50'))
+        self.assertEqual(len(buckets), 8)
+        self.assertEqual([(b[u'sensor'], b[u'p50']) for b in buckets[:2]], [(self.s1.pk, 4), (self.s1.pk, 13)])
+        self.assertEqual(buckets[4][u'sensor'], self.s2.pk)
+        self.assertEqual(buckets[4][u'max'], 100)
+
+        with self.assertRaises(ValueError):
+            Reading.objects.window_aggregate(3600, (u'stddev',))
+
+    def test_endpoint(self):
+        url = reverse(u'sensor-aggregate', args=[self.s1.pk])
+        response = self.client.get(url + u'?interval=7200&funcs=min,p95&since=2016-06-20T14:00:00Z')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [
+            {u'bucket': u'2016-06-20T14:00:00Z', u'min': 18.0, u'p95': response.data[0][u'p95']},
+        ])
+        self.assertTrue(27 <= response.data[0][u'p95'] <= 29)
+        self.assertEqual(self.client.get(url + u'?funcs=mode').status_code, 400)
+
+
+class TestBenchmarks(TestCase):
+    def test_hotpaths_suite(self):
+        results = bench_hotpaths(depth=3, options=7, conditions=4, sensors=2, readings=40, iterations=3)
+        self.assertEqual(results[u'dataset'][u'depth'], 3)
+        self.assertEqual(results[u'get_values'][u'queries_per_op'], 1)
+        self.assertEqual(results[u'validate_unique_values'][u'queries_per_op'], 1)
+        self.assertEqual(results[u'condition_group_evaluate'][u'queries_per_op'], 1)
+        self.assertEqual(results[u'history_page'][u'queries_per_op'], 1)
+        for name in (u'get_unique_values', u'reading_save', u'reading_bulk_ingest_100'):
+            self.assertTrue(results[name][u'ops_per_sec'] > 0)
+            self.assertTrue(results[name][u'p50_ms'] <= results[name][u'p99_ms'])
+
+    def test_compare_with_baseline(self):
+        baseline = {u'hotpaths': {u'get_values': {u'ops_per_sec': 100.0, u'p50_ms': 1.0}}, u'ingest': {u'rows': 5}}
+        current = {u'hotpaths': {u'get_values': {u'ops_per_sec': 85.0, u'p50_ms': 2.0}}, u'ingest': {u'rows': 5}}
+
+        changes, regressed = compare(current, baseline, tolerance=0.1)
+        self.assertEqual(changes, [(u'hotpaths.get_values.ops_per_sec', 100.0, 85.0, -0.15)])
+        self.assertTrue(regressed)
+        self.assertFalse(compare(current, baseline, tolerance=0.2)[1])
+
+
+class TestMetrics(TestCase):
+    def test_text_format(self):
+        registry = metrics.Registry()
+        requests = metrics.Counter(u'test_requests_total', u'requests', [u'method'], registry=registry)
+        latency = metrics.Histogram(u'test_seconds', u'latency', buckets=(0.1, 1), registry=registry)
+        temperature = metrics.Gauge(u'test_temperature', u'temperature', registry=registry)
+
+        requests.labels(u'GET').inc()
+        requests.labels(u'GET').inc(2)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        temperature.set(21.5)
+
+        self.assertEqual(registry.render(), u"\n".join([
+            u'# HELP test_requests_total requests',
+            u'# TYPE test_requests_total counter',
+            u'test_requests_total{method="GET"} 3',
+            u'# HELP test_seconds latency',
+            u'# TYPE test_seconds histogram',
+            u'test_seconds_bucket{le="0.1"} 1',
+            u'test_seconds_bucket{le="1"} 2',
+            u'test_seconds_bucket{le="+Inf"} 3',
+            u'test_seconds_sum 5.55',
+            u'test_seconds_count 3',
+            u'# HELP test_temperature temperature',
+            u'# TYPE test_temperature gauge',
+            u'test_temperature 21.5',
+        ]) + u"\n")
+
+        with self.assertRaises(ValueError):
+            requests.labels(u'GET', u'extra')
+
+    def test_endpoint_reports_hot_paths(self):
+        sensor = Sensor.objects.create(name=u'tent_temp')
+        ingested = metrics.READINGS_INGESTED.value
+        Reading.objects.bulk_ingest([(sensor.pk, timezone.now(), u'21')] * 3)
+        self.assertEqual(metrics.READINGS_INGESTED.value, ingested + 3)
+
+        self.client.get(reverse(u'latest-readings'))
+        response = self.client.get(u'/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode(u'utf-8')
+        self.assertIn(u'veggy_pi_http_requests_total{method="GET",status="200"}', body)
+        self.assertIn(u'veggy_pi_readings_ingested_total %d' % (ingested + 3), body)
+
+    def test_controller_writes_textfile(self):
+        path = os.path.join(tempfile.mkdtemp(), u'veggy_pi.prom')
+        queue = ActuatorQueue(writer=lambda pin, state: None)
+        with override_settings(VEGGY_PI_METRICS_TEXTFILE=path):
+            Controller(groups=[], actuators=queue).tick(SensorState())
+        with open(path) as f:
+            self.assertIn(u'veggy_pi_controller_tick_seconds_count', f.read())
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(VEGGY_PI_PROFILE_DIR=self.directory)
+        self.settings.enable()
+
+    def tearDown(self):
+        profiler.session = None
+        profiler.last_path = None
+        self.settings.disable()
+
+    def test_tick_stats_and_queries_per_group(self):
+        relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+        group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+        Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'20', group=group)
+        # a group without prefetched conditions queries them per evaluate
+        controller = Controller(groups=[group], actuators=ActuatorQueue(writer=lambda pin, state: None))
+
+        controller.tick(SensorState(TEMP=15))
+        self.assertIsNone(profiler.last_path)
+
+        # a long running process never resets its (bounded) query log
+        connection.queries_log.extend([{u'sql': u'SELECT 1', u'time': u'0.000'}] * connection.queries_log.maxlen)
+        profiler.start(60, label=u'test')
+        controller.tick(SensorState(TEMP=15))
+        controller.tick(SensorState(TEMP=25))
+        path = profiler.finish()
+        self.assertFalse(profiler.active)
+
+        stats = pstats.Stats(path)
+        self.assertTrue(any(name == u'evaluate' for _, _, name in stats.stats))
+
+        with open(path.replace(u'.prof', u'.sql.json')) as f:
+            summary = json.load(f)
+        self.assertEqual([u['name'] for u in summary[u'units']], [u'tick', u'tick'])
+        section = summary[u'sections'][0]
+        self.assertEqual(section[u'label'], u'condition group %s' % group.pk)
+        self.assertEqual(section[u'query_count'], 2)
+        self.assertIn(u'"veggy_pi_condition"', summary[u'statements'][0][u'sql'])
+        self.assertEqual(summary[u'statements'][0][u'count'], 2)
+
+    def test_session_expires(self):
+        profiler.start(0, label=u'test')
+        with profiler.profile(u'work'):
+            pass
+        self.assertFalse(profiler.active)
+        # nothing ran inside the session, so nothing is written
+        self.assertIsNone(profiler.last_path)
+
+    def test_written_on_expiry(self):
+        session = profiler.start(60, label=u'test')
+        with profiler.profile(u'work'):
+            session.until = time.time()
+        # no later unit is needed to write it
+        self.assertFalse(profiler.active)
+        self.assertTrue(os.path.exists(profiler.last_path))
+
+    def test_queries_of_every_database(self):
+        with file_databases(split=True):
+            sensor = Sensor.objects.create(name=u'TEMP')
+            profiler.start(60, label=u'test')
+            with profiler.profile(u'work'):
+                list(Condition.objects.all())
+                list(Reading.objects.filter(sensor=sensor))
+            path = profiler.finish()
+        with open(path.replace(u'.prof', u'.sql.json')) as f:
+            queries = json.load(f)[u'units'][0][u'queries']
+        self.assertEqual([query[u'db'] for query in queries], [u'default', u'timeseries'])
+
+    def test_view_profiles_requests(self):
+        url = reverse(u'profile')
+        self.assertEqual(self.client.post(url, {u'seconds': 60}).status_code, 302)
+
+        get_user_model().objects.create_user(u'admin', password=u'secret', is_staff=True)
+        self.client.login(username=u'admin', password=u'secret')
+        self.assertTrue(self.client.post(url, {u'seconds': 60}).json()[u'active'])
+        self.client.get(reverse(u'latest-readings'))
+
+        path = profiler.finish()
+        with open(path.replace(u'.prof', u'.sql.json')) as f:
+            names = [u['name'] for u in json.load(f)[u'units']]
+        self.assertIn(u'GET %s' % reverse(u'latest-readings'), names)
+
+
+@override_settings(VEGGY_PI_SYNC_TOKEN=u'secret')
+class TestSync(TestCase):
+    """
+    the controller and the hub share the test database - local rows have no
+    origin, so what the hub ingests is never sent again.
+    """
+    def setUp(self):
+        self.sensor = Sensor.objects.create(name=u'tent_temp')
+        self.t0 = datetime(2016, 6, 20, 12, 0, 0, 0, pytz.UTC)
+        Reading.objects.bulk_ingest([(self.sensor.pk, self.t0 + timedelta(seconds=i), u'%s' % i) for i in range(5)])
+        for i in range(3):
+            Input.objects.create(sensor_name=u'tent_temp', value=u'%s' % i)
+        self.url = reverse(u'sync')
+
+    def transport(self, method, url, body, headers):
+        meta = dict((u'HTTP_' + name.upper().replace(u'-', u'_'), value)
+                    for name, value in headers.items() if name != u'Content-Type')
+        if method == u'GET':
+            response = self.client.get(url, **meta)
+        else:
+            response = self.client.post(url, body, content_type=headers[u'Content-Type'], **meta)
+        return response.status_code, response.content
+
+    def sync_client(self, **kwargs):
+        return SyncClient(url=self.url, node=u'room-1', token=u'secret', transport=self.transport, **kwargs)
+
+    def hub_readings(self):
+        return Reading.objects.filter(origin=u'room-1')
+
+    def test_push_in_batches(self):
+        client = self.sync_client(batch_size=2)
+        self.assertEqual(client.resume(), {u'readings': 0, u'inputs': 0})
+        self.assertEqual(client.push(), 3)
+        self.assertEqual(client.push(), 0)
+
+        self.assertEqual(self.hub_readings().count(), 5)
+        self.assertEqual(Input.objects.filter(origin=u'room-1').count(), 3)
+        hub_sensor = Sensor.objects.get(origin=u'room-1', origin_id=self.sensor.pk)
+        self.assertEqual(hub_sensor.name, u'tent_temp')
+        self.assertEqual(hub_sensor.current_reading.data, u'4')
+        self.assertEqual(self.hub_readings().get(origin_id=Reading.objects.filter(origin=u'').first().pk).created_at,
+                         self.t0)
+
+        Reading.objects.bulk_ingest([(self.sensor.pk, self.t0 + timedelta(seconds=10), u'10')])
+        # cursors, the batch and its sensors, the hub ingest, one cursor update
+        with self.assertNumQueries(13):
+            self.assertEqual(client.push(), 1)
+        self.assertEqual(self.hub_readings().count(), 6)
+
+    def test_lost_cursor_is_resumed_from_hub(self):
+        client = self.sync_client()
+        client.push()
+        SyncCursor.objects.all().delete()
+
+        # re-sent rows are skipped
+        response = client.send(build_batch(u'room-1', {}, 10))
+        self.assertEqual((response[u'created'], response[u'duplicates']), (0, 8))
+        self.assertEqual(self.hub_readings().count(), 5)
+
+        client.resume()
+        self.assertEqual(client.push(), 0)
+
+    def test_rejects_bad_batches(self):
+        self.assertEqual(self.client.post(self.url, u'{}', content_type=u'application/json').status_code, 403)
+
+        headers = {u'HTTP_X_VEGGY_PI_TOKEN': u'secret', u'HTTP_CONTENT_ENCODING': u'deflate'}
+        payload = {u'node': u'room-1', u'sensors': {}, u'readings': [[1, self.sensor.pk, u'2016-06-20T12:00:00', u'1']]}
+        response = self.client.post(self.url, encode(payload), content_type=u'application/json', **headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.hub_readings().count(), 0)
+
+        response = self.client.post(self.url, b'not zlib', content_type=u'application/json', **headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class TestPartitions(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(VEGGY_PI_PARTITION_DIR=self.directory)
+        self.settings.enable()
+
+        self.sensor = Sensor.objects.create(name=u'tent_temp')
+        self.june = datetime(2016, 6, 1, tzinfo=pytz.UTC)
+        self.july = datetime(2016, 7, 1, tzinfo=pytz.UTC)
+        records = []
+        for day in range(3):
+            records.append((self.sensor.pk, self.june + timedelta(days=day), u'6.%s' % day))
+            records.append((self.sensor.pk, self.july + timedelta(days=day), u'7.%s' % day))
+        Reading.objects.bulk_ingest(records)
+        Reading.objects.bulk_ingest([(self.sensor.pk, timezone.now(), u'now')])
+
+    def tearDown(self):
+        for month in partitions.months():
+            partitions.set_readonly(month, False)
+            partitions.unregister(month)
+        self.settings.disable()
+
+    def test_archive_and_query(self):
+        self.assertEqual(partitions.archive_month(self.june), 3)
+        self.assertEqual(partitions.archive_month(self.july), 3)
+        self.assertEqual(Reading.objects.count(), 1)
+        self.assertEqual(partitions.months(), [self.june, self.july])
+
+        readings = partitions.PartitionedReadings(self.june + timedelta(days=1), self.july + timedelta(days=2))
+        self.assertEqual(readings.aliases, [u'readings_2016_06', u'readings_2016_07', u'default'])
+        self.assertEqual([data for data, in readings.filter(sensor=self.sensor).iterator(u'data')],
+                         [u'6.1', u'6.2', u'7.0', u'7.1'])
+
+        # only the partitions overlapping the range are queried
+        readings = partitions.PartitionedReadings(self.july, self.july + timedelta(days=1))
+        self.assertEqual(readings.aliases, [u'readings_2016_07', u'default'])
+        self.assertEqual(readings.count(), 1)
+
+        # rerunning moves nothing and keeps the archived rows
+        self.assertEqual(partitions.archive_month(self.june), 0)
+        self.assertEqual(partitions.PartitionedReadings().count(), 7)
+
+    def test_archive_keeps_rows_written_meanwhile(self):
+        # a backdated reading of the month arrives between the copy and the delete
+        delete = QuerySet.delete
+        late = []
+
+        def write_then_delete(queryset):
+            if not late:
+                late.append(Reading.objects.bulk_ingest([(self.sensor.pk, self.june + timedelta(hours=1), u'late')]))
+            return delete(queryset)
+
+        QuerySet.delete = write_then_delete
+        try:
+            self.assertEqual(partitions.archive_month(self.june), 3)
+        finally:
+            QuerySet.delete = delete
+        self.assertEqual(list(Reading.objects.filter(created_at__lt=self.july).values_list(u'data', flat=True)), [u'late'])
+
+        # the next run moves it
+        self.assertEqual(partitions.archive_month(self.june), 1)
+        self.assertEqual(partitions.PartitionedReadings().count(), 8)
+
+    def test_compliance_across_partitions(self):
+        # the last june reading holds until the first july one
+        Reading.objects.bulk_ingest([(self.sensor.pk, self.july - timedelta(minutes=5), u'40')])
+        partitions.archive_month(self.june)
+        start = compliance.to_timestamp(self.july - timedelta(minutes=10))
+        runs = compliance.sensor_runs(self.sensor.pk, start, start + 3600, None, 30, max_gap=3600)
+        self.assertEqual(runs, [(start + 300, start + 600, compliance.HIGH)])
+
+    def test_readonly_and_drop(self):
+        with self.assertRaises(ValueError):
+            partitions.archive_month(timezone.now())
+
+        partitions.archive_month(self.june)
+        partitions.set_readonly(self.june)
+        alias = partitions.alias_for(self.june)
+        self.assertEqual(Reading.objects.using(alias).count(), 3)
+        with self.assertRaises(OperationalError):
+            Reading.objects.using(alias).filter(data=u'6.0').delete()
+
+        archive = os.path.join(self.directory, u'archive')
+        partitions.set_readonly(self.june, False)
+        partitions.drop_month(self.june, archive_to=archive)
+        self.assertEqual(partitions.months(), [])
+        self.assertNotIn(alias, connections.databases)
+        self.assertEqual(os.listdir(archive), [u'readings-2016-06.sqlite3'])
+
+    def test_rollover_command(self):
+        call_command(u'partitions', u'rollover', keep_months=0, stdout=StringIO())
+        self.assertEqual(partitions.months(), [self.june, self.july])
+        self.assertEqual(Reading.objects.count(), 1)
+
+
+class TestWorkloadRouter(TestCase):
+    def test_single_file_install_unchanged(self):
+        self.assertNotIn(u'timeseries', settings.DATABASES)
+        self.assertEqual(settings.VEGGY_PI_SQLITE_PRAGMAS, {})
+
+    def test_opt_in(self):
+        router = WorkloadRouter()
+        self.assertIsNone(router.db_for_write(Reading))
+        self.assertIsNone(router.allow_migrate(u'default', u'veggy_pi', u'reading'))
+
+    @override_settings(VEGGY_PI_SQLITE_PRAGMAS={
+        u'default': {u'cache_size': -1234},
+        u'timeseries': {u'synchronous': u'NORMAL'},
+    })
+    def test_split_databases(self):
+        router = WorkloadRouter()
+        with file_databases(split=True):
+            self.assertEqual(router.db_for_write(Reading), u'timeseries')
+            self.assertEqual(router.db_for_read(DHT22Sensor), u'timeseries')
+            self.assertEqual(router.db_for_read(Condition), u'default')
+            self.assertFalse(router.allow_migrate(u'timeseries', u'auth', u'user'))
+            self.assertFalse(router.allow_migrate(u'default', u'veggy_pi', u'reading'))
+            self.assertTrue(router.allow_migrate(u'default', u'veggy_pi', u'condition'))
+
+            relay = RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+            group = ConditionGroup.objects.create(operator=Operator.AND, output_pin=relay)
+            Condition.objects.create(lhs=u'TEMP', operator=Operator.LT, rhs=u'20', group=group)
+            sensor = Sensor.objects.create(name=u'TEMP', pin=relay)
+            Reading.objects.bulk_ingest([(sensor.pk, timezone.now(), u'15')])
+
+            # the pin of a timeseries sensor is read from default
+            self.assertEqual(Sensor.objects.get(pk=sensor.pk).pin.pin_number, 11)
+
+            with connections[u'default'].cursor() as cursor:
+                cursor.execute(u'SELECT COUNT(*) FROM veggy_pi_condition')
+                self.assertEqual(cursor.fetchone()[0], 1)
+                cursor.execute(u'PRAGMA cache_size')
+                self.assertEqual(cursor.fetchone()[0], -1234)
+            with connections[u'timeseries'].cursor() as cursor:
+                cursor.execute(u'SELECT COUNT(*) FROM veggy_pi_reading')
+                self.assertEqual(cursor.fetchone()[0], 1)
+                cursor.execute(u'PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            controller = Controller(actuators=ActuatorQueue(writer=lambda pin, state: None))
+            self.assertEqual(controller.tick(controller.read_sensors()), 1)
+
+
+class TestConfigIO(TestCase):
+    def setUp(self):
+        temperature = ConfigurationOption.objects.create(option_label=u'temperature')
+        for label in (u'min_temp', u'max_temp'):
+            ConfigurationOption.objects.create(option_label=label, parent_option=temperature)
+        ConfigurationOption.objects.create(option_label=u'temp_format')
+        RPiPin.objects.create(pin_number=11, label=u'gpio_17')
+
+    def document(self, configs=1):
+        document = {
+            u'configurations': [{u'label': u'main_config', u'values': {u'temp_format': u'celcius', u'min_temp': 20}}],
+            u'condition_groups': [{
+                u'operator': u'AND',
+                u'output_pin': 11,
+                u'conditions': [{u'lhs': u'TEMP', u'operator': u'<', u'rhs': u'20'}],
+            }, {
+                u'operator': u'OR',
+                u'conditions': [{u'lhs': u'RH', u'operator': u'>', u'rhs': u'80'}],
+            }],
+        }
+        for i in range(configs - 1):
+            # distinct times, so no two rows share an update
+            document[u'configurations'].append({
+                u'label': u'config_%s' % i,
+                u'parent': u'main_config',
+                u'start_time': u'2026-01-01T06:%02d:%02d+00:00' % divmod(i, 60),
+                u'end_time': u'2026-01-01T18:%02d:%02d+00:00' % divmod(i, 60),
+                u'values': {u'max_temp': 30},
+            })
+        return document
+
+    def test_round_trip(self):
+        counts = config_io.import_configuration(self.document(configs=2))
+        self.assertEqual(counts[u'configurations'], 2)
+        self.assertEqual(counts[u'values'], 3)
+        self.assertEqual(counts[u'conditions'], 2)
+        day = VeggyConfiguration.objects.get(label=u'config_0')
+        self.assertEqual(day.parent_config.label, u'main_config')
+        self.assertEqual(day.start_time.hour, 6)
+        condition = Condition.objects.get(group__output_pin__isnull=False)
+        self.assertEqual((condition.group.output_pin.pin_number, condition.rhs_number), (11, 20.0))
+
+        text = config_io.dump(config_io.export_configuration())
+        document = config_io.load(StringIO(text))
+        self.assertEqual(document[u'configurations'][1][u'values'], {u'max_temp': u'30'})
+        self.assertIn({u'label': u'min_temp', u'parent': u'temperature'}, document[u'options'])
+
+        # importing the export again replaces rather than duplicates
+        config_io.import_configuration(document)
+        self.assertEqual(VeggyConfiguration.objects.count(), 2)
+        self.assertEqual(UserInput.objects.count(), 3)
+        self.assertEqual(ConditionGroup.objects.count(), 2)
+        self.assertEqual(config_io.export_configuration(), document)
+
+    def test_export_labels(self):
+        config_io.import_configuration(self.document(configs=3))
+        document = config_io.export_configuration([u'config_1'])
+        self.assertEqual([c[u'label'] for c in document[u'configurations']], [u'main_config', u'config_1'])
+
+    def test_queries_independent_of_size(self):
+        def queries(configs):
+            with CaptureQueriesContext(connection) as context:
+                config_io.import_configuration(self.document(configs))
+            VeggyConfiguration.objects.all().delete()
+            ConditionGroup.objects.all().delete()
+            # the writes - the validation of the resolved values reads per config
+            return len([q for q in context.captured_queries if not q[u'sql'].startswith(u'SELECT')])
+
+        self.assertEqual(queries(5), queries(config_io.UPDATE_BATCH))
+
+    def test_errors_reported_together(self):
+        document = self.document(configs=2)
+        document[u'configurations'][0][u'values'][u'unknown'] = u'1'
+        document[u'configurations'][1][u'parent'] = u'missing'
+        document[u'condition_groups'][0][u'output_pin'] = 99
+        with self.assertRaises(config_io.ConfigImportError) as context:
+            config_io.import_configuration(document)
+        self.assertEqual(len(context.exception.errors), 3)
+        self.assertFalse(VeggyConfiguration.objects.exists())
+
+        with self.assertRaises(config_io.ConfigImportError):
+            config_io.load(StringIO(u'configurations: [unclosed'))
+
+    def test_unhashable_values_reported(self):
+        document = self.document(configs=2)
+        document[u'condition_groups'][0][u'output_pin'] = [11]
+        document[u'condition_groups'][0][u'conditions'][0][u'operator'] = {u'<': 1}
+        document[u'condition_groups'][1][u'operator'] = [u'OR']
+        with self.assertRaises(config_io.ConfigImportError) as context:
+            config_io.import_configuration(document)
+        self.assertEqual(len(context.exception.errors), 3)
+
+    def test_cycle(self):
+        document = self.document(configs=2)
+        document[u'configurations'][0][u'parent'] = u'config_0'
+        with self.assertRaises(config_io.ConfigImportError):
+            config_io.import_configuration(document)
+
+    def test_validation_rolls_back(self):
+        document = self.document(configs=2)
+        document[u'configurations'][1][u'values'][u'max_temp'] = 10
+        with self.assertRaises(config_io.ConfigImportError) as context:
+            config_io.import_configuration(document)
+        self.assertIn(u'config_0', context.exception.errors[0])
+        self.assertFalse(VeggyConfiguration.objects.exists())
+        self.assertFalse(ConditionGroup.objects.exists())
+
+    def test_dry_run(self):
+        counts = config_io.import_configuration(self.document(configs=2), dry_run=True)
+        self.assertEqual(counts[u'configurations'], 2)
+        self.assertFalse(VeggyConfiguration.objects.exists())
+
+    def test_commands(self):
+        path = os.path.join(tempfile.mkdtemp(), u'config.yaml')
+        with open(path, u'w') as stream:
+            config_io.dump(self.document(configs=2), stream)
+        out = StringIO()
+        call_command(u'import_config', path, dry_run=True, stdout=out)
+        self.assertIn(u'dry run', out.getvalue())
+        self.assertFalse(VeggyConfiguration.objects.exists())
+
+        call_command(u'import_config', path, stdout=StringIO())
+        out = StringIO()
+        call_command(u'export_config', u'config_0', stdout=out)
+        self.assertEqual(len(config_io.load(StringIO(out.getvalue()))[u'configurations']), 2)
+
+
+class TestQueryBudget(TestCase):
+    def test_hot_paths_within_budget(self):
+        report = querybudget.check()
+        self.assertEqual(list(report), list(querybudget.HOT_PATHS))
+        self.assertEqual(querybudget.violations(report), [])
+
+    def test_detects_n_plus_one(self):
+        @querybudget.hot_path(budget=1, name=u'per_config_labels')
+        def per_config_labels(size):
+            for i in range(size):
+                VeggyConfiguration.objects.create(label=u'config_%s' % i)
+            return lambda: [config.label for config in VeggyConfiguration.objects.all() if config.get_values([], [])]
+
+        try:
+            report = querybudget.check([u'per_config_labels'], sizes=(1, 4))
+        finally:
+            del querybudget.HOT_PATHS[u'per_config_labels']
+        result = report[u'per_config_labels']
+        self.assertEqual(result[u'queries'], {1: 2, 4: 5})
+        self.assertTrue(result[u'over_budget'])
+        self.assertTrue(result[u'grows'])
+        self.assertEqual(result[u'repeated'][0][u'count'], 4)
+        self.assertEqual(len(querybudget.violations(report)), 3)
+
+    def test_split_databases(self):
+        # the reading queries run on the timeseries database
+        with file_databases(split=True):
+            report = querybudget.check([u'reading_save', u'controller_tick'], sizes=(2,))
+            self.assertFalse(Reading.objects.exists())
+        self.assertEqual(report[u'reading_save'][u'queries'], {2: 2})
+        self.assertEqual(report[u'controller_tick'][u'queries'], {2: 1})
+
+    def test_command(self):
+        out = StringIO()
+        call_command(u'querybudget', u'reading_save', sizes=[1, 2], stdout=out)
+        self.assertEqual(json.loads(out.getvalue())[u'reading_save'][u'queries'], {u'1': 2, u'2': 2})
@@ -1,10 +1,20 @@
+from django.conf.urls import url
+
 from rest_framework.routers import DefaultRouter
 
 
 from . import views
 
 
-# veggy_pi_router = DefaultRouter()
+veggy_pi_router = DefaultRouter()
+veggy_pi_router.register(r'sensors', views.SensorViewSet)
+veggy_pi_router.register(r'readings', views.ReadingViewSet)
 # veggy_pi_router.register(r'rpipin', views.RPiPinViewSet)
 # veggy_pi_router.register(r'users', views.UserViewSet)
 
+urlpatterns = [
+    url(r'^latest/$', views.latest_readings, name=u'latest-readings'),
+    url(r'^stream/$', views.reading_stream, name=u'reading-stream'),
+    url(r'^profile/$', views.profile, name=u'profile'),
+    url(r'^sync/$', views.sync_batch, name=u'sync'),
+]
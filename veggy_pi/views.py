@@ -1,7 +1,43 @@
+from django.db.models import Max
+from django.conf import settings
+from django.db import router, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_http_methods, require_safe
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+
+import json
+import zlib
 
 from rest_framework import viewsets, authentication, permissions
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from veggy_pi.models import Reading, Sensor
+from veggy_pi.pagination import KeysetPagination
+from veggy_pi import metrics
+from veggy_pi.broker import broker
+from veggy_pi.profiling import profiler
+from veggy_pi.records import ReadingRecord
+from veggy_pi import sync
+from veggy_pi.ingest import validate_records
+from veggy_pi.cache import latest_readings as latest_readings_cache
+from veggy_pi.serializers import (
+    ReadingSerializer,
+    SensorSerializer,
+    FastReadingSerializer,
+    LatestReadingSerializer,
+    fast_json,
+    iso_datetime,
+)
 
 
 # from veggy_pi.models import RPiPin
@@ -9,19 +45,264 @@ from rest_framework import viewsets, authentication, permissions
 # 
 # 
 # User = get_user_model()
-# 
-# class DefaultsMixin(object):
-#     authentication_classes = (
-#         authentication.BasicAuthentication,
-#         authentication.TokenAuthentication,
-#     )
-#     permission_classe = (
-#         permissions.IsAuthenticated,
-#     )
-#     paginate_by = 25
-#     paginate_by_param = u'page_size'
-#     max_paginate_by = 100
-# 
+
+
+def filter_window(queryset, params):
+    """
+    limits a reading queryset to the ?since= / ?until= iso 8601 datetimes
+    """
+    for param, lookup in ((u'since', u'created_at__gte'), (u'until', u'created_at__lt')):
+        value = params.get(param)
+        if value:
+            try:
+                timestamp = parse_datetime(value)
+            except ValueError:
+                timestamp = None
+            if timestamp is None:
+                raise ValidationError({param: _(u'expected an iso 8601 datetime')})
+            queryset = queryset.filter(**{lookup: timestamp})
+    return queryset
+
+
+class DefaultsMixin(object):
+    authentication_classes = (
+        authentication.BasicAuthentication,
+        authentication.SessionAuthentication,
+    )
+    permission_classes = (
+        permissions.DjangoModelPermissionsOrAnonReadOnly,
+    )
+    pagination_class = KeysetPagination
+
+
+class SensorPagination(KeysetPagination):
+    keyset = ('id',)
+
+
+class SensorViewSet(DefaultsMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Sensor.objects.select_related(u'current_reading').only(
+        u'id', u'name', u'pin', u'current_reading',
+        u'current_reading__created_at', u'current_reading__data',
+    )
+    serializer_class = SensorSerializer
+    pagination_class = SensorPagination
+
+    @detail_route()
+    def aggregate(self, request, pk=None):
+        """
+        windowed aggregates of the sensor's readings computed by the
+        database, i.e. ?interval=3600&funcs=min,max,avg,p95&since=<iso datetime>
+        """
+        params = request.query_params
+        funcs = [func for func in params.get(u'funcs', u'min,max,avg,count').split(u',') if func]
+        try:
+            interval = int(params.get(u'interval', 3600))
+        except ValueError:
+            raise ValidationError({u'interval': _(u'expected a number of seconds')})
+
+        queryset = filter_window(Reading.objects.filter(sensor_id=self.get_object().pk), params)
+        try:
+            buckets = queryset.window_aggregate(interval, funcs)
+        except ValueError as ex:
+            raise ValidationError(u'%s' % ex)
+
+        for bucket in buckets:
+            del bucket[u'sensor']
+            bucket[u'bucket'] = iso_datetime(bucket[u'bucket'])
+        return Response(buckets)
+
+
+class ReadingViewSet(DefaultsMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    reading history, newest first - filter with ?sensor=<id>&since=<iso
+    datetime>&until=<iso datetime> and page with the `next` cursor link.
+    """
+    queryset = Reading.objects.select_related(u'sensor').only(
+        u'id', u'created_at', u'data', u'sensor', u'sensor__name',
+    )
+    serializer_class = ReadingSerializer
+
+    def get_queryset(self):
+        queryset = super(ReadingViewSet, self).get_queryset()
+        params = self.request.query_params
+
+        sensor = params.get(u'sensor')
+        if sensor:
+            try:
+                queryset = queryset.filter(sensor_id=int(sensor))
+            except ValueError:
+                raise ValidationError({u'sensor': _(u'expected a sensor id')})
+
+        return filter_window(queryset, params)
+
+    @list_route()
+    def history(self, request):
+        """
+        the same listing as the default list view but serialized from
+        values_list() tuples straight to JSON - for charts and bulk exports.
+        """
+        queryset = FastReadingSerializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginator.paginate_queryset(queryset, request, view=self)
+        body = u'{"next": %s, "results": %s}' % (
+            fast_json.dumps(self.paginator.get_next_link()),
+            FastReadingSerializer(page).to_json(),
+        )
+        return HttpResponse(body, content_type=u'application/json')
+
+    @list_route(methods=[u'post'])
+    def bulk(self, request):
+        """
+        batch upload for remote sensor nodes - the body is a list of compact
+        [sensor_id, timestamp, value] records (epoch or iso 8601 timestamps).
+        valid records are written in one transaction through the bulk ingest
+        path and the response holds a status for every record.
+        """
+        records = request.data
+        if isinstance(records, dict):
+            records = records.get(u'readings')
+        if not isinstance(records, list):
+            raise ValidationError(_(u'expected a list of [sensor, timestamp, value] records'))
+        if len(records) > settings.VEGGY_PI_BULK_UPLOAD_MAX:
+            raise ValidationError(_(u'at most %s records per request') % settings.VEGGY_PI_BULK_UPLOAD_MAX)
+
+        valid, statuses = validate_records(records)
+        with transaction.atomic(using=router.db_for_write(Reading)):
+            Reading.objects.bulk_ingest(valid)
+
+        return Response({
+            u'accepted': len(valid),
+            u'rejected': len(records) - len(valid),
+            u'status': statuses,
+        })
+
+
+@require_safe
+def latest_readings(request):
+    """
+    the current value of every sensor for dashboards.
+
+    the ETag is the newest reading id, which costs a single MAX() on the
+    primary key, and a checksum of the (small) sensor list, so an added,
+    renamed or deleted sensor changes it too - clients sending it back in
+    If-None-Match get a 304 until either changes, and while nothing changed
+    the body is served from the in-process cache rather than re-querying
+    the sensors.
+    """
+    latest = Reading.objects.aggregate(latest=Max(u'id'))[u'latest'] or 0
+    sensors = zlib.crc32(json.dumps(list(Sensor.objects.order_by(u'id').values_list(u'id', u'name'))))
+    version = u'%s-%x' % (latest, sensors & 0xffffffff)
+    etag = version
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        body = latest_readings_cache.get(version, lambda: LatestReadingSerializer(
+            LatestReadingSerializer.values(Sensor.objects.order_by(u'id'))
+        ).to_json())
+        response = HttpResponse(body, content_type=u'application/json')
+
+    response[u'ETag'] = quote_etag(etag)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_safe
+def reading_stream(request):
+    """
+    server-sent-events stream of new readings and condition state changes,
+    optionally limited to some sensors with ?sensor=<id>&sensor=<id>.
+    """
+    try:
+        sensors = set(int(sensor) for sensor in request.GET.getlist(u'sensor'))
+    except ValueError:
+        return HttpResponse(status=400)
+
+    accept = None
+    if sensors:
+        accept = lambda key: key[0] != u'reading' or key[1] in sensors
+
+    def events():
+        # subscribed only once the stream is consumed - a HEAD request or a
+        # client gone before the first chunk never starts the generator and
+        # so never runs its finally
+        subscription = broker.subscribe(maxsize=settings.VEGGY_PI_STREAM_QUEUE_SIZE, accept=accept)
+        try:
+            yield u'retry: 2000\n\n'
+            while True:
+                event = subscription.get(timeout=settings.VEGGY_PI_STREAM_KEEPALIVE)
+                if event is None:
+                    yield u': keepalive\n\n'
+                    continue
+                kind, data = event
+                if isinstance(data, ReadingRecord):
+                    data = data.as_event()
+                yield u'event: %s\ndata: %s\n\n' % (kind, fast_json.dumps(data))
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type=u'text/event-stream')
+    response[u'Cache-Control'] = u'no-cache'
+    return response
+
+
+@require_safe
+def prometheus_metrics(request):
+    """
+    the metrics of this process in the prometheus text format
+    """
+    return HttpResponse(metrics.REGISTRY.render(), content_type=u'text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+@require_http_methods([u'GET', u'POST'])
+def profile(request):
+    """
+    POST starts a profiling session of `seconds` in the serving process,
+    GET reports whether one is running and where the last one was written.
+    """
+    if request.method == u'POST':
+        try:
+            seconds = float(request.POST.get(u'seconds') or settings.VEGGY_PI_PROFILE_SECONDS)
+        except ValueError:
+            return JsonResponse({u'seconds': [u'%s' % _(u'A number is required.')]}, status=400)
+        profiler.start(seconds, label=u'http')
+
+    session = profiler.session
+    return JsonResponse({
+        u'active': session is not None,
+        u'until': session.until if session is not None else None,
+        u'last': profiler.last_path,
+    })
+
+
+@csrf_exempt
+@require_http_methods([u'GET', u'POST'])
+def sync_batch(request):
+    """
+    hub end of the controller sync (see veggy_pi.sync) - POST ingests a
+    batch, GET ?node=<name> returns the high-water marks held for a node.
+    both need the shared VEGGY_PI_SYNC_TOKEN.
+    """
+    token = settings.VEGGY_PI_SYNC_TOKEN
+    if not token or not constant_time_compare(request.META.get(u'HTTP_X_VEGGY_PI_TOKEN', u''), token):
+        return JsonResponse({u'detail': u'%s' % _(u'invalid sync token')}, status=403)
+
+    if request.method == u'GET':
+        node = request.GET.get(u'node')
+        if not node:
+            return JsonResponse({u'node': [u'%s' % _(u'This field is required.')]}, status=400)
+        return JsonResponse({u'node': node, u'acked': sync.high_water_marks(node)})
+
+    try:
+        if request.META.get(u'HTTP_CONTENT_ENCODING') == u'deflate':
+            payload = sync.decode(request.body)
+        else:
+            payload = json.loads(request.body.decode(u'utf-8'))
+        result = sync.ingest_batch(payload)
+    except ValueError as ex:
+        return JsonResponse({u'detail': u'%s' % ex}, status=400)
+    return JsonResponse(result)
+
+
 # class RPiPinViewSet(DefaultsMixin, viewsets.ModelViewSet):
 #     queryset = RPiPin.objects.order_by(u'pin')
 #     serializer_class = RPiPinSerializer
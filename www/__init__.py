@@ -0,0 +1,9 @@
+from __future__ import absolute_import
+
+import os
+
+# make sure the celery app is loaded when django starts so that
+# @shared_task uses it - except for the slim controller profile
+# (www.settings_controller) which never queues tasks.
+if os.environ.get('DJANGO_SETTINGS_MODULE') != 'www.settings_controller':
+    from .celery import app as celery_app
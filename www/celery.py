@@ -0,0 +1,19 @@
+"""
+celery application for the www project.
+
+tasks are picked up from the installed apps (i.e. veggy_pi/tasks.py), the
+broker and result backend are configured in www/settings.py.
+"""
+from __future__ import absolute_import
+
+import os
+
+from celery import Celery
+from django.conf import settings
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "www.settings")
+
+app = Celery('www')
+app.config_from_object('django.conf:settings')
+app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
@@ -42,11 +42,14 @@ INSTALLED_APPS = (
     #
     'django_extensions',
     'rest_framework',
+    'djcelery',
     #
     'veggy_pi',
 )
 
 MIDDLEWARE_CLASSES = (
+    'veggy_pi.middleware.MetricsMiddleware',
+    'veggy_pi.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,6 +93,45 @@ DATABASES = {
     }
 }
 
+# optional second database for the append heavy reading history - set
+# VEGGY_PI_TIMESERIES_DB to a sqlite path to split the workloads (see
+# veggy_pi.routers.WorkloadRouter) and migrate both databases:
+#   ./manage.py migrate && ./manage.py migrate --database=timeseries
+# the ingest side keeps its connections open between requests
+if os.environ.get('VEGGY_PI_TIMESERIES_DB'):
+    DATABASES['timeseries'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['VEGGY_PI_TIMESERIES_DB'],
+        'CONN_MAX_AGE': 600,
+    }
+
+DATABASE_ROUTERS = [
+    'veggy_pi.routers.WorkloadRouter',
+    'veggy_pi.routers.PartitionRouter',
+]
+
+# PRAGMAs set on every new sqlite connection, per database alias - only for
+# the split databases, a single file install keeps the sqlite defaults. WAL
+# lets readers carry on while a writer commits; the config stays fully
+# durable while the history trades the fsync per commit for ingest
+# throughput (a power cut can lose the last commits but never corrupts the
+# file). cache_size is in KiB when negative.
+VEGGY_PI_SQLITE_PRAGMAS = {}
+if 'timeseries' in DATABASES:
+    VEGGY_PI_SQLITE_PRAGMAS = {
+        'default': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'cache_size': -8000,
+        },
+        'timeseries': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -4000,
+            'wal_autocheckpoint': 4000,
+        },
+    }
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -131,4 +173,96 @@ REST_FRAMEWORK = {
 # celery django result backend
 CELERY_RESULT_BACKEND='djcelery.backends.database:DatabaseBackend'
 
-BROKER='amqp://guest@localhost/'
+BROKER_URL = os.environ.get('VEGGY_PI_BROKER_URL', 'amqp://guest@localhost/')
+
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+
+# run tasks in-process with an in-memory broker i.e. for tests or a single
+# node setup without rabbitmq: VEGGY_PI_CELERY_EAGER=1 ./manage.py ...
+CELERY_ALWAYS_EAGER = os.environ.get('VEGGY_PI_CELERY_EAGER') == '1'
+CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
+if CELERY_ALWAYS_EAGER:
+    BROKER_URL = 'memory://'
+
+CELERYBEAT_SCHEDULE = {
+    'purge-readings': {
+        'task': 'veggy_pi.tasks.purge_readings',
+        'schedule': 60 * 60,
+    },
+}
+
+# readings are handed to the ingest task once a batch reaches either limit
+VEGGY_PI_INGEST_BATCH_SIZE = 500
+VEGGY_PI_INGEST_BATCH_AGE = 1.0
+
+# largest batch accepted by the bulk reading upload endpoint
+VEGGY_PI_BULK_UPLOAD_MAX = 5000
+
+# rollup bucket size in seconds and how many days of raw readings are kept,
+# None keeps everything
+VEGGY_PI_ROLLUP_PERIOD = 60 * 60
+VEGGY_PI_READING_RETENTION_DAYS = None
+
+# seconds between two control loop ticks (see the run_controller command)
+VEGGY_PI_CONTROLLER_INTERVAL = 5
+# seconds after which the controller reloads its condition groups and their
+# conditions, so rules edited in the admin or imported are picked up
+VEGGY_PI_CONTROLLER_RELOAD = 30
+
+# configuration schedule (see veggy_pi.schedule) - hours of active config
+# intervals materialized ahead and the seconds after which changes saved by
+# another process are picked up
+VEGGY_PI_SCHEDULE_HOURS = 48
+VEGGY_PI_SCHEDULE_RELOAD = 60
+
+# threshold compliance (see veggy_pi.compliance) - the sensor measuring
+# each metric, the longest a reading counts for and the seconds of history
+# evaluated at a time
+VEGGY_PI_COMPLIANCE_SENSORS = {'temp': 'TEMP', 'rh': 'RH', 'ph': 'PH'}
+VEGGY_PI_COMPLIANCE_MAX_GAP = 15 * 60
+VEGGY_PI_COMPLIANCE_CHUNK = 6 * 60 * 60
+
+# signal filters applied to the samples of a sensor (by name) before the
+# rules see them, see veggy_pi.filters for the available filters
+VEGGY_PI_SENSOR_FILTERS = {}
+
+# actuator (relay) protection - minimum seconds a pin is held HIGH / LOW
+# before it may switch again and the maximum number of switches per pin
+# within VEGGY_PI_ACTUATOR_SWITCH_WINDOW seconds, None disables the limit
+VEGGY_PI_ACTUATOR_MIN_ON = 0
+VEGGY_PI_ACTUATOR_MIN_OFF = 0
+VEGGY_PI_ACTUATOR_MAX_SWITCHES = None
+VEGGY_PI_ACTUATOR_SWITCH_WINDOW = 60
+
+# live event stream - events a slow client may have waiting before the
+# oldest is dropped and the seconds between keepalive comments
+VEGGY_PI_STREAM_QUEUE_SIZE = 100
+VEGGY_PI_STREAM_KEEPALIVE = 15
+
+# metrics - the headless controller writes its metrics to this prometheus
+# textfile (None disables it) every VEGGY_PI_METRICS_INTERVAL seconds, and
+# counting the sql queries of every http request needs a debug cursor
+VEGGY_PI_METRICS_TEXTFILE = None
+VEGGY_PI_METRICS_INTERVAL = 15
+VEGGY_PI_METRICS_COUNT_QUERIES = False
+
+# closed months of reading history are moved into per month sqlite files
+# in this directory (see veggy_pi.partitions)
+VEGGY_PI_PARTITION_DIR = os.path.join(BASE_DIR, 'partitions')
+
+# sync to a hub (see veggy_pi.sync) - the sync view url of the hub, the
+# name this controller is known by there and the shared secret both ends
+# check, rows per batch and the largest batch a hub inflates
+VEGGY_PI_SYNC_HUB_URL = os.environ.get('VEGGY_PI_SYNC_HUB_URL')
+VEGGY_PI_SYNC_NODE = os.environ.get('VEGGY_PI_SYNC_NODE')
+VEGGY_PI_SYNC_TOKEN = os.environ.get('VEGGY_PI_SYNC_TOKEN')
+VEGGY_PI_SYNC_BATCH_SIZE = 1000
+VEGGY_PI_SYNC_MAX_BYTES = 16 * 1024 * 1024
+VEGGY_PI_SYNC_TIMEOUT = 30
+
+# on-demand profiling (SIGUSR2 or the staff-only profile view) - default
+# session length in seconds and where the stats are written
+VEGGY_PI_PROFILE_SECONDS = 30
+VEGGY_PI_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
@@ -0,0 +1,19 @@
+"""
+minimal settings for the headless controller process (run_controller).
+
+the controller serves no http and hands nothing to celery, so it only loads
+the app its models live in and none of the admin / rest_framework / celery /
+django_extensions machinery or the middleware stack:
+
+    DJANGO_SETTINGS_MODULE=www.settings_controller ./manage.py run_controller
+"""
+from .settings import *
+
+
+INSTALLED_APPS = (
+    'veggy_pi',
+)
+
+MIDDLEWARE_CLASSES = ()
+
+TEMPLATES = []
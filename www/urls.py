@@ -16,14 +16,16 @@ Including another URLconf
 from django.conf.urls import include, url
 from django.contrib import admin
 from django.conf import settings
-from veggy_pi import urls
+from veggy_pi import urls, views
 
 from rest_framework.authtoken.views import obtain_auth_token
 
-# from veggy_pi.urls import veggy_pi_router
+from veggy_pi.urls import veggy_pi_router
 
 urlpatterns = [
     # url(r'^api/v1/token', obtain_auth_token, name=u'api-token'),
-    # url(r'^veggy_pi/api/v1/', include(veggy_pi_router.urls)),
+    url(r'^veggy_pi/api/v1/', include(urls)),
+    url(r'^veggy_pi/api/v1/', include(veggy_pi_router.urls)),
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^metrics/?$', views.prometheus_metrics, name=u'metrics'),
 ]